@@ -13,7 +13,11 @@ import time
 from datetime import datetime, timedelta
 
 import db_manager as db
+import logic
+import prompt_builder
 import subscription_manager as sub_manager
+import llm_gateway
+import subscription_sync
 from tier_config import TIER_CONFIG
 import product_analytics
 
@@ -82,11 +86,14 @@ def _render_user_management():
     users = db.get_all_users_full()
     billing_month = datetime.now().strftime("%Y-%m")
 
+    brand_counts = db.count_brands_by_org(exclude_sample=True)
+    usage_by_user = db.get_monthly_usage_by_user(billing_month)
+
     rows = []
     for u in users:
         org_id = u.get('org_id') or u['username']
-        brand_count = db.count_user_brands(org_id, exclude_sample=True)
-        usage = db.get_monthly_usage_user(u['username'], billing_month)
+        brand_count = brand_counts.get(org_id, 0)
+        usage = usage_by_user.get(u['username'], 0)
         tier_key = u.get('subscription_tier', 'solo')
         tier_display = TIER_CONFIG.get(tier_key, {}).get('display_name', tier_key)
         org_name = u.get('org_id') or 'Solo'
@@ -316,6 +323,7 @@ def _render_org_management():
     st.subheader("Organization Management")
 
     orgs = db.get_all_organizations()
+    brand_counts = db.count_brands_by_org(exclude_sample=True)
     rows = []
     for o in orgs:
         conn = db._get_connection()
@@ -324,7 +332,7 @@ def _render_org_management():
                 db._execute_plain(conn, db._q("SELECT COUNT(*) FROM users WHERE org_id = ?"), (o['org_id'],)), 0)
         finally:
             conn.close()
-        brand_count = db.count_user_brands(o['org_id'], exclude_sample=True)
+        brand_count = brand_counts.get(o['org_id'], 0)
         tier_key = o.get('subscription_tier', 'agency')
         tier = TIER_CONFIG.get(tier_key, TIER_CONFIG['solo'])
         rows.append({
@@ -700,7 +708,7 @@ def _start_impersonation(target_username):
     st.session_state['user_id'] = target['username']
     st.session_state['org_id'] = target.get('org_id') or target['username']
     st.session_state['is_admin'] = bool(target.get('is_admin', 0))
-    st.session_state['profiles'] = db.get_profiles(target['username'])
+    st.session_state['profiles'] = db.get_profiles_lazy(target['username'])
     # Reset active profile to first available (admin's profile name won't exist for target)
     target_profiles = st.session_state['profiles']
     st.session_state['active_profile_name'] = list(target_profiles.keys())[0] if target_profiles else None
@@ -752,7 +760,8 @@ def _render_usage_analytics():
     # --- Overview Cards ---
     users = db.get_all_users_full()
     orgs = db.get_all_organizations()
-    total_brands = sum(db.count_user_brands(u.get('org_id') or u['username']) for u in users
+    brand_counts = db.count_brands_by_org()
+    total_brands = sum(brand_counts.get(u.get('org_id') or u['username'], 0) for u in users
                        if u.get('is_admin', 0) or not u.get('org_id'))
     total_actions = db.get_monthly_usage_all(billing_month)
     # Estimate: $0.025 per action, visual_audit weighted 3x already baked into action_weight
@@ -962,6 +971,102 @@ def _render_system_health():
 
         st.divider()
 
+        # Connection pool metrics (process-wide, since last restart)
+        st.markdown("#### Connection Pool")
+        pool = db.get_pool_stats()
+        st.caption(f"Backend: {pool['backend']}"
+                   + (f" — max {pool['max_size']} connections" if 'max_size' in pool else " — one connection per thread"))
+        pc = st.columns(6)
+        pc[0].metric("Checkouts", pool['checkouts'])
+        pc[1].metric("Waits", pool['waits'])
+        pc[2].metric("In Use", pool['in_use'])
+        pc[3].metric("Peak In Use", pool['peak_in_use'])
+        pc[4].metric("Opened", pool['created'])
+        pc[5].metric("Failed Health Checks", pool['health_check_failures'])
+
+        # Background product-event writer
+        st.markdown("#### Event Writer")
+        ev = db.get_event_writer_stats()
+        st.caption("Batched background writes" if ev['async'] else "Synchronous writes (EVENT_WRITER_ASYNC=0)")
+        ec = st.columns(5)
+        ec[0].metric("Queued", ev['queued'])
+        ec[1].metric("Written", ev['written'])
+        ec[2].metric("Batches", ev['batches'])
+        ec[3].metric("Dropped", ev['dropped'])
+        ec[4].metric("Failed", ev['failed'])
+
+        # Dominant-color (KMeans) cache
+        st.markdown("#### Color Extraction Cache")
+        cc = logic.get_color_cache_stats()
+        st.caption("Memory + disk tiers" if cc['disk_enabled'] else "Memory tier only (set COLOR_CACHE_DIR for disk)")
+        ccols = st.columns(5)
+        ccols[0].metric("Memory Hits", cc['memory_hits'])
+        ccols[1].metric("Disk Hits", cc['disk_hits'])
+        ccols[2].metric("Misses", cc['misses'])
+        ccols[3].metric("Hit Rate", f"{cc['hit_rate'] * 100:.0f}%")
+        ccols[4].metric("Cached Assets", cc['memory_entries'])
+
+        st.markdown("#### Brand Context Cache")
+        bc = prompt_builder.get_brand_context_cache_stats()
+        bcols = st.columns(5)
+        bcols[0].metric("Hits", bc['hits'])
+        bcols[1].metric("Misses", bc['misses'])
+        bcols[2].metric("Hit Rate", f"{bc['hit_rate'] * 100:.0f}%")
+        bcols[3].metric("Cached Contexts", bc['entries'])
+        bcols[4].metric("Invalidations", bc['invalidations'])
+
+        st.markdown("#### Tier Cache")
+        tc = sub_manager.get_tier_cache_stats()
+        tcols = st.columns(5)
+        tcols[0].metric("Hits", tc['hits'] + tc['stale'])
+        tcols[1].metric("Misses", tc['misses'])
+        tcols[2].metric("Served Stale", tc['stale'])
+        tcols[3].metric("Cached Tiers", tc['entries'])
+        tcols[4].metric("Invalidations", tc['invalidations'])
+
+        st.markdown("#### Subscription Reconciliation")
+        last_sync = subscription_sync.get_last_run()
+        if last_sync:
+            scols = st.columns(5)
+            scols[0].metric("Last Run", last_sync.get('status', '?').upper())
+            scols[1].metric("LS Subscriptions", last_sync.get('subscriptions', 0))
+            scols[2].metric("Users Matched", last_sync.get('users_matched', 0))
+            scols[3].metric("Updated", last_sync.get('updated', 0))
+            scols[4].metric("Duration", f"{last_sync.get('duration_ms', 0) / 1000:.1f}s")
+            st.caption(f"Started {last_sync.get('started_at', '')}"
+                       + (f" — error: {last_sync['error']}" if last_sync.get('error') else ""))
+        else:
+            st.caption("No reconciliation run recorded yet.")
+
+        st.markdown("#### LLM Gateway")
+        gw = llm_gateway.get_stats()
+        gcols = st.columns(5)
+        gcols[0].metric("Calls", gw['calls'])
+        gcols[1].metric("In Flight", f"{gw['in_flight']}/{gw['max_concurrency']}")
+        gcols[2].metric("Retries", gw['retries'])
+        gcols[3].metric("Rate Limited", gw['rate_limited'])
+        gcols[4].metric("Queue Wait p95", f"{gw['queue_wait_p95']:.2f}s")
+        st.caption("Per-process counters since the app started.")
+
+        st.markdown("#### Usage Counters")
+        st.caption("Soft-cap checks read materialized monthly totals. Rebuild them from usage_tracking if they drift.")
+        if st.button("Rebuild Usage Counters", key="admin_rebuild_usage_counters"):
+            rebuilt = db.rebuild_usage_counters()
+            db.log_admin_action(_admin_user(), "usage_counters_rebuilt", "platform", "usage_counters",
+                                {"rows": rebuilt})
+            st.success(f"Rebuilt {rebuilt} counter rows.")
+
+        st.markdown("#### Analytics Rollups")
+        st.caption(f"Product analytics reads daily rollups of product_events, folded in up to "
+                   f"event #{db.get_rollup_watermark()}. Rebuild them after editing or deleting events.")
+        if st.button("Rebuild Analytics Rollups", key="admin_rebuild_analytics_rollups"):
+            folded = db.rebuild_analytics_rollups()
+            db.log_admin_action(_admin_user(), "analytics_rollups_rebuilt", "platform", "analytics_rollups",
+                                {"events": folded})
+            st.success(f"Rolled up {folded} events.")
+
+        st.divider()
+
         # Env var status
         st.markdown("#### Environment Variables")
         env_vars = {
@@ -1019,21 +1124,10 @@ def _render_system_health():
 
         # CSV Export
         st.markdown("#### Export Users")
+        st.caption("One row per user with this month's usage. The file is built in memory for the download.")
         if st.button("Generate CSV Export", key="admin_export_csv"):
             billing_month = datetime.now().strftime("%Y-%m")
-            rows = []
-            for u in users:
-                usage = db.get_monthly_usage_user(u['username'], billing_month)
-                rows.append({
-                    "username": u['username'],
-                    "email": u.get('email', ''),
-                    "tier": u.get('subscription_tier', 'solo'),
-                    "org": u.get('org_id') or 'Solo',
-                    "status": u.get('subscription_status', 'inactive'),
-                    "actions_this_month": usage,
-                })
-            df = pd.DataFrame(rows)
-            csv = df.to_csv(index=False)
+            csv = "".join(db.iter_user_export_csv(billing_month))
             st.download_button("Download CSV", csv, "signet_users_export.csv", "text/csv")
 
     # --- Announcements ---
@@ -0,0 +1,66 @@
+"""
+analytics_worker.py — Keeps the analytics rollups current in the background.
+
+Folds new product_events into analytics_user_daily / analytics_module_daily
+every ANALYTICS_ROLLUP_INTERVAL_SECONDS, so the dashboard's raw "past the
+watermark" branch only ever covers the last interval (plus the safety lag)
+regardless of how long the page goes unvisited.
+
+Run alongside Streamlit via start.sh:
+    python analytics_worker.py                   # loop every ANALYTICS_ROLLUP_INTERVAL_SECONDS
+    python analytics_worker.py --once            # single pass (cron)
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import db_manager as db
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIG ---
+ANALYTICS_ROLLUP_INTERVAL_SECONDS = int(os.environ.get("ANALYTICS_ROLLUP_INTERVAL_SECONDS", "60"))
+
+
+def refresh_once() -> int:
+    """One refresh pass over everything past the watermark. Returns events folded."""
+    started = time.perf_counter()
+    try:
+        folded = db.refresh_analytics_rollups()
+    except Exception as e:
+        logger.warning(f"Analytics rollup refresh failed: {e}")
+        return 0
+    if folded:
+        logger.info(f"Analytics rollups: folded {folded} events in "
+                    f"{(time.perf_counter() - started) * 1000:.0f} ms")
+    return folded
+
+
+def run_forever(interval: int = ANALYTICS_ROLLUP_INTERVAL_SECONDS) -> None:
+    """Refresh every `interval` seconds."""
+    while True:
+        refresh_once()
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fold new product events into the analytics rollups.")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--interval", type=int, default=ANALYTICS_ROLLUP_INTERVAL_SECONDS,
+                        help="seconds between passes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.once:
+        refresh_once()
+        return 0
+    run_forever(args.interval)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
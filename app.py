@@ -12,7 +12,8 @@ import subscription_manager as sub_manager
 import admin_panel
 import visual_audit
 import html
-from prompt_builder import build_brand_context, build_social_context, build_mh_context
+from prompt_builder import (build_brand_context, build_social_context, build_mh_context,
+                            invalidate_brand_context_cache)
 from content_types import (CONTENT_TYPES, SOCIAL_PLATFORMS, VISUAL_ASSET_TYPES,
                            CLUSTER_DISPLAY_NAMES,
                            get_cluster_for_label,
@@ -55,6 +56,12 @@ if 'db_init_v3' not in st.session_state:
     db.init_db()
     st.session_state['db_init_v3'] = True
 
+# Saved profiles drop memoized brand contexts (idempotent across reruns)
+db.register_profile_saved_hook(invalidate_brand_context_cache)
+
+# One users-table read per rerun: tier, usage and trial checks share a snapshot
+db.begin_request_cache()
+
 # --- 2. SECURITY: SESSION EXPIRY WATCHDOG ---
 # Fix: Force logout after 60 minutes of inactivity (Oliver's Suggestion #5)
 if st.session_state.get('authenticated'):
@@ -438,6 +445,13 @@ if 'usage' not in st.session_state: st.session_state['usage'] = {}
 if 'subscription_status' not in st.session_state: st.session_state['subscription_status'] = 'inactive'
 if '_tier_resolved_at' not in st.session_state: st.session_state['_tier_resolved_at'] = 0
 
+# Re-read the tier from the shared cache every rerun so webhook changes reach
+# open sessions; expired entries are served while a worker revalidates them.
+if st.session_state.get('authenticated') and st.session_state.get('username'):
+    st.session_state['tier'] = sub_manager.resolve_user_tier(st.session_state['username'])
+    st.session_state['subscription_status'] = st.session_state['tier'].get('_subscription_status', 'inactive')
+    st.session_state['status'] = st.session_state['subscription_status']
+
 ARCHETYPES = [
     "The Ruler", "The Creator", "The Sage", "The Innocent", 
     "The Outlaw", "The Magician", "The Hero", "The Lover", 
@@ -1304,7 +1318,7 @@ if not st.session_state['authenticated']:
                     st.session_state['suspend_reason'] = _susp_reason
 
                     # 4. LOAD PROFILES & RERUN
-                    st.session_state['profiles'] = db.get_profiles(user_data['username'])
+                    st.session_state['profiles'] = db.get_profiles_lazy(user_data['username'])
 
                     # 5. ANALYTICS: Session start + onboarding milestone
                     _sid = str(uuid.uuid4())
@@ -1518,8 +1532,10 @@ with st.sidebar:
         st.session_state['active_profile_name'] = active_profile_selection
         st.rerun()
     
-    if active_profile_selection != "Create New..." and active_profile_selection in st.session_state['profiles']:
-        current_profile = st.session_state['profiles'][active_profile_selection]
+    current_profile = None
+    if active_profile_selection != "Create New...":
+        current_profile = st.session_state['profiles'].get(active_profile_selection)
+    if current_profile is not None:
         
         # --- DYNAMIC SCORE CALCULATION ---
         cal_data = calculate_calibration_score(current_profile)
@@ -1740,8 +1756,69 @@ def _show_trial_gate():
     """, unsafe_allow_html=True)
 
 
-def _track_module_and_cost(module_name, metadata_extra=None):
-    """Fire module_action and api_cost events after an AI module action."""
+def _write_stream(chunks):
+    """Render streamed text deltas as they arrive; returns the full response text."""
+    written = st.write_stream(chunks)
+    return written if isinstance(written, str) else "".join(str(c) for c in (written or []))
+
+
+def _track_api_cost(module_name, usage, model, username, session_id=None, org_id=None, extra=None):
+    """Write one api_cost event for `usage` token totals.
+
+    Doesn't touch st.session_state, so it is safe from worker threads.
+    """
+    if not usage or not (usage.get('input_tokens') or usage.get('output_tokens')):
+        return
+    cost = db.estimate_api_cost(
+        usage['input_tokens'], usage['output_tokens'], model=model,
+        cache_creation_input_tokens=usage.get('cache_creation_input_tokens', 0),
+        cache_read_input_tokens=usage.get('cache_read_input_tokens', 0),
+    )
+    cost_meta = {
+        "module": module_name,
+        "model": model,
+        "input_tokens": usage['input_tokens'],
+        "output_tokens": usage['output_tokens'],
+        "cache_creation_input_tokens": usage.get('cache_creation_input_tokens', 0),
+        "cache_read_input_tokens": usage.get('cache_read_input_tokens', 0),
+        "estimated_cost_usd": cost,
+    }
+    # Vision calls also report original vs sent image bytes
+    for _k in ("images", "image_bytes_original", "image_bytes_sent"):
+        if _k in usage:
+            cost_meta[_k] = usage[_k]
+    if extra:
+        cost_meta.update(extra)
+    db.track_event("api_cost", username, metadata=cost_meta,
+                   session_id=session_id, org_id=org_id)
+
+
+def _late_audit_cost_recorder():
+    """on_late_usage hook for visual_audit.run_audit_layers.
+
+    A layer that timed out keeps running and is still billed; when it
+    finishes, its tokens are recorded as a follow-up api_cost event.
+    """
+    _user = st.session_state.get('username', '')
+    _sid = st.session_state.get('_analytics_session_id')
+    _org = st.session_state.get('org_id')
+
+    def _record(layer, usage):
+        try:
+            _track_api_cost("visual_audit", usage, visual_audit._MODEL, _user, _sid, _org,
+                            extra={"layer": layer, "timed_out": True, "late": True})
+        except Exception:
+            pass  # Tracking never breaks the app
+    return _record
+
+
+def _track_module_and_cost(module_name, metadata_extra=None, usage=None, model=None, cost_extra=None):
+    """Fire module_action and api_cost events after an AI module action.
+
+    usage/model default to the logic engine's last call; modules that call
+    the API themselves (visual audit) pass their own totals. cost_extra is
+    merged into the api_cost metadata.
+    """
     try:
         _user = st.session_state.get('username', '')
         _sid = st.session_state.get('_analytics_session_id')
@@ -1764,19 +1841,12 @@ def _track_module_and_cost(module_name, metadata_extra=None):
         db.check_milestone(_user, "first_module_run", session_id=_sid, org_id=_org)
 
         # API cost tracking from logic engine
-        usage = logic_engine._last_usage
-        if usage:
-            cost = db.estimate_api_cost(
-                usage['input_tokens'], usage['output_tokens'],
-                model=logic_engine.model
-            )
-            db.track_event("api_cost", _user, metadata={
-                "module": module_name,
-                "model": logic_engine.model,
-                "input_tokens": usage['input_tokens'],
-                "output_tokens": usage['output_tokens'],
-                "estimated_cost_usd": cost,
-            }, session_id=_sid, org_id=_org)
+        from_engine = usage is None
+        if from_engine:
+            usage = logic_engine._last_usage
+        model = model or logic_engine.model
+        _track_api_cost(module_name, usage, model, _user, _sid, _org, extra=cost_extra)
+        if from_engine:
             logic_engine._last_usage = None
     except Exception:
         pass  # Tracking never breaks the app
@@ -1943,7 +2013,7 @@ if _checkout_success and st.session_state.get('authenticated'):
         if st.button("SYNC NOW", use_container_width=True):
             import time as _pct
             st.session_state.pop('_tier_resolved_at', None)
-            _new_tier = sub_manager.resolve_user_tier(st.session_state.get('username', ''))
+            _new_tier = sub_manager.resolve_user_tier(st.session_state.get('username', ''), force_refresh=True)
             st.session_state['tier'] = _new_tier
             st.session_state['subscription_status'] = _new_tier.get('_subscription_status', 'inactive')
             st.session_state['status'] = st.session_state['subscription_status']
@@ -1995,7 +2065,7 @@ elif app_mode == "DASHBOARD":
                 if st.button("Try a Sample Brand", use_container_width=True, key="empty_load_sample"):
                     _uid = st.session_state.get('user_id', '')
                     db.load_sample_brand(_uid)
-                    st.session_state['profiles'] = db.get_profiles(_uid)
+                    st.session_state['profiles'] = db.get_profiles_lazy(_uid)
                     st.success("Sample brand loaded! Meridian Labs is now available in your brand list. Explore the Brand Architect to see how a complete brand profile is structured, then try generating content or running an audit.")
                     import time as _t; _t.sleep(2)
                     st.rerun()
@@ -2322,7 +2392,7 @@ elif app_mode == "DASHBOARD":
                 with _rc1:
                     if st.button("Yes, Remove", key="dash_confirm_remove_sample", type="primary"):
                         db.delete_sample_brand(_bm_uid)
-                        st.session_state['profiles'] = db.get_profiles(_bm_uid)
+                        st.session_state['profiles'] = db.get_profiles_lazy(_bm_uid)
                         # Clear active profile if it was the sample brand
                         if st.session_state.get('active_profile_name', '').startswith("Meridian Labs"):
                             remaining = list(st.session_state['profiles'].keys())
@@ -2336,7 +2406,7 @@ elif app_mode == "DASHBOARD":
         else:
             if st.button("Load Sample Brand", key="dash_load_sample"):
                 db.load_sample_brand(_bm_uid)
-                st.session_state['profiles'] = db.get_profiles(_bm_uid)
+                st.session_state['profiles'] = db.get_profiles_lazy(_bm_uid)
                 st.success("Sample brand loaded! Meridian Labs is now available in your brand list.")
                 import time as _t; _t.sleep(1.5)
                 st.rerun()
@@ -2357,7 +2427,7 @@ elif app_mode == "DASHBOARD":
 
         _del_candidates = [
             name for name in profiles.keys()
-            if not db.is_profile_sample(_bm_uid, name)
+            if not (profiles.meta(name) or {}).get('is_sample_brand')
         ]
         if _del_candidates:
             del_brand = st.selectbox("Select brand to delete", [""] + _del_candidates, key="dash_del_brand")
@@ -2386,7 +2456,7 @@ elif app_mode == "DASHBOARD":
                                     st.session_state['active_profile_name'] = remaining[0] if remaining else None
 
                                 db.delete_profile(_bm_uid, del_brand)
-                                st.session_state['profiles'] = db.get_profiles(_bm_uid)
+                                st.session_state['profiles'] = db.get_profiles_lazy(_bm_uid)
                                 st.session_state.pop('_confirm_delete_brand', None)
 
                                 # Analytics: brand deleted
@@ -2455,16 +2525,17 @@ elif app_mode == "VISUAL COMPLIANCE":
 
     # --- HELPER: ASSET LIBRARY RETRIEVAL (UPDATED) ---
     def get_all_visual_assets(profile_data):
-        """Parses visual and social sample blobs to find ALL saved images."""
+        """Parses visual and social sample blobs to find ALL saved images.
+
+        Returns {asset name: VISUAL_REF payload}; nothing is fetched or decoded
+        until load_visual_asset() is called for a selected name.
+        """
         inputs = profile_data.get('inputs', {})
         assets = {}
         
         # WE NOW SCAN BOTH VISUAL AND SOCIAL SAMPLE BLOBS
         sources = [inputs.get('visual_dna', ''), inputs.get('social_dna', '')]
 
-        import base64
-        from io import BytesIO
-
         for source_text in sources:
             if not source_text: continue
             
@@ -2477,27 +2548,34 @@ elif app_mode == "VISUAL COMPLIANCE":
                     if lines and "[ASSET:" in lines[0]:
                         name = lines[0].replace("[ASSET:", "").replace("]", "").strip()
                     
-                    # Extract Image
+                    # Extract Image reference (inline data URI or asset:<hash>)
                     for line in lines:
                         if line.startswith("[VISUAL_REF:"):
-                            b64 = line.replace("[VISUAL_REF:", "").replace("]", "").strip()
-                            if b64.startswith("data:image"): 
-                                try:
-                                    b64_clean = b64.split(",")[1]
-                                    image_data = base64.b64decode(b64_clean)
-                                    
-                                    # Handle Duplicates (e.g. multiple "LinkedIn Post" assets)
-                                    key = name
-                                    count = 2
-                                    while key in assets:
-                                        key = f"{name} ({count})"
-                                        count += 1
-                                        
-                                    assets[key] = Image.open(BytesIO(image_data))
-                                except: 
-                                    pass
+                            ref = line.replace("[VISUAL_REF:", "").replace("]", "").strip()
+                            if ref.startswith("data:image") or ref.startswith(db.ASSET_REF_PREFIX):
+                                # Handle Duplicates (e.g. multiple "LinkedIn Post" assets)
+                                key = name
+                                count = 2
+                                while key in assets:
+                                    key = f"{name} ({count})"
+                                    count += 1
+
+                                assets[key] = ref
         return assets
 
+    def load_visual_asset(ref):
+        """Fetch (if stored externally) and decode one visual asset. None if unreadable."""
+        import base64
+        from io import BytesIO
+
+        data_uri = db.resolve_visual_ref(ref)
+        if not data_uri:
+            return None
+        try:
+            return Image.open(BytesIO(base64.b64decode(data_uri.split(",")[1])))
+        except Exception:
+            return None
+
     # --- HELPER: COLLAGE MAKER ---
     def create_reference_collage(image_list):
         """Stitches multiple reference images into one 'Reference Sheet' for the AI."""
@@ -2527,10 +2605,10 @@ elif app_mode == "VISUAL COMPLIANCE":
 
     # 1. Check if Profile is Active
     active_profile_name = st.session_state.get('active_profile_name')
-    if not active_profile_name or active_profile_name not in st.session_state.get('profiles', {}):
+    profile_data = st.session_state.get('profiles', {}).get(active_profile_name) if active_profile_name else None
+    if profile_data is None:
         st.warning("No Brand Profile Loaded. Please select one in the Sidebar.")
     else:
-        profile_data = st.session_state['profiles'][active_profile_name]
 
         # --- PERSISTENCE CHECK ---
         if 'active_audit_result' in st.session_state and st.session_state['active_audit_result']:
@@ -2600,7 +2678,7 @@ elif app_mode == "VISUAL COMPLIANCE":
                     
                     # Preview the Reference Sheet
                     if selected_asset_names:
-                        selected_imgs = [all_assets[n] for n in selected_asset_names]
+                        selected_imgs = [img for img in (load_visual_asset(all_assets[n]) for n in selected_asset_names) if img]
                         collage = create_reference_collage(selected_imgs)
                         st.image(collage, caption="Active Reference Sheet (Brand Benchmark)", use_container_width=True)
                     else:
@@ -2634,16 +2712,22 @@ elif app_mode == "VISUAL COMPLIANCE":
                         # 1. PREPARE REFERENCE IMAGE
                         reference_image_obj = None
                         if selected_asset_names:
-                            imgs = [all_assets[n] for n in selected_asset_names]
+                            imgs = [img for img in (load_visual_asset(all_assets[n]) for n in selected_asset_names) if img]
                             reference_image_obj = create_reference_collage(imgs)
 
                         _asset_ctx = asset_description.strip() if asset_description else asset_type
 
-                        # --- LAYER 1: COLOR COMPLIANCE (deterministic, fast) ---
-                        with st.spinner("Layer 1/3: Analyzing color compliance..."):
-                            color_result = visual_audit.run_color_compliance(image, inputs)
+                        # --- LAYERS 1-3: COLOR, VISUAL IDENTITY, COPY (run concurrently) ---
+                        with st.spinner("Analyzing color, visual identity and copy..."):
+                            _layers = visual_audit.run_audit_layers(
+                                image, inputs, reference_image=reference_image_obj,
+                                on_late_usage=_late_audit_cost_recorder(),
+                            )
+                        color_result = _layers['color_result']
+                        visual_result = _layers['visual_result']
+                        copy_result = _layers['copy_result']
 
-                        # Show color results immediately
+                        # Show color results
                         _cs = color_result.get('score')
                         if color_result.get('skipped'):
                             st.info("Color compliance skipped — no hex palette defined.")
@@ -2651,18 +2735,6 @@ elif app_mode == "VISUAL COMPLIANCE":
                             _cc = "#09ab3b" if _cs >= 80 else "#ffa421" if _cs >= 50 else "#ff4b4b"
                             st.markdown(f"<div style='padding:8px; border-left:3px solid {_cc};'><strong>Color Compliance:</strong> {_cs}/100</div>", unsafe_allow_html=True)
 
-                        # --- LAYER 2: VISUAL IDENTITY (AI) ---
-                        with st.spinner("Layer 2/3: Analyzing visual identity..."):
-                            visual_result = visual_audit.run_visual_identity_check(
-                                image, inputs,
-                                color_result.get('detected_hexes', []),
-                                reference_image=reference_image_obj,
-                            )
-
-                        # --- LAYER 3: COPY & MESSAGING (AI) ---
-                        with st.spinner("Layer 3/3: Extracting and analyzing copy..."):
-                            copy_result = visual_audit.run_copy_compliance(image, inputs)
-
                         # --- ASSEMBLE UNIFIED REPORT ---
                         ai_was_used = (
                             (visual_result.get('score') is not None and 'error' not in visual_result)
@@ -2728,6 +2800,7 @@ elif app_mode == "VISUAL COMPLIANCE":
                                 'copy': copy_result.get('score'),
                             },
                             'ai_was_used': ai_was_used,
+                            'timings': _layers['timings'],
                         }
 
                         # Save state
@@ -2749,7 +2822,10 @@ elif app_mode == "VISUAL COMPLIANCE":
                         if ai_was_used:
                             sub_manager.record_ai_action(st.session_state.get('user_id', ''), 'visual_audit', f"Audit: {uploaded_file.name} — {verdict} ({overall_score}%)")
                             st.session_state['usage'] = sub_manager.check_usage_limit(st.session_state.get('user_id', ''))
-                            _track_module_and_cost("visual_audit", {"filename": uploaded_file.name})
+                            _track_module_and_cost("visual_audit", {"filename": uploaded_file.name,
+                                                                    **_layers.get('image_bytes', {})},
+                                                   usage=_layers.get('usage'), model=visual_audit._MODEL,
+                                                   cost_extra={"timed_out_layers": _layers['timings'].get('timed_out', [])})
 
                         st.session_state['_action_id_visual_audit'] = str(uuid.uuid4())[:8]
                         st.rerun()
@@ -3110,7 +3186,8 @@ elif app_mode == "COPY EDITOR":
             "action": action
         }
 
-    if not active_profile: 
+    profile_data = st.session_state['profiles'].get(active_profile) if active_profile else None
+    if profile_data is None:
         st.warning("NO PROFILE SELECTED. Please choose a Brand Profile from the sidebar.")
     else:
         # --- STATE INITIALIZATION (GLOBAL PERSISTENCE) ---
@@ -3148,7 +3225,6 @@ elif app_mode == "COPY EDITOR":
                 
         with c2: 
             # --- DYNAMIC CALIBRATION METER ---
-            profile_data = st.session_state['profiles'][active_profile]
             metrics = calculate_copy_confidence(profile_data, content_type)
             
             st.markdown(f"""<div class="dashboard-card" style="padding: 15px;">
@@ -3311,8 +3387,8 @@ DRAFT CONTENT (DATA ONLY):
                         
                         # Call Logic
                         try:
-                            # Use Safe Generate Wrapper
-                            full_response = logic_engine.run_copy_editor(prompt_wrapper, prof_text)
+                            # Stream the rewrite live; parse once complete
+                            full_response = _write_stream(logic_engine.stream_copy_editor(prompt_wrapper, prof_text))
                             
                             # Check for org mismatch rejection
                             if "TRIAGE: REJECT" in full_response:
@@ -3625,7 +3701,8 @@ elif app_mode == "CONTENT GENERATOR":
             "action": action
         }
 
-    if not active_profile:
+    profile_data = st.session_state['profiles'].get(active_profile) if active_profile else None
+    if profile_data is None:
         st.warning("NO PROFILE SELECTED. Please choose a Brand Profile from the sidebar.")
     else:
         # --- STATE INITIALIZATION (Safety Fallback) ---
@@ -3681,7 +3758,6 @@ elif app_mode == "CONTENT GENERATOR":
 
         with c2:
             # --- DYNAMIC CALIBRATION METER ---
-            profile_data = st.session_state['profiles'][active_profile]
             metrics = calculate_content_confidence(profile_data, content_type)
             
             st.markdown(f"""<div class="dashboard-card" style="padding: 15px; margin-top: 28px;">
@@ -3770,12 +3846,12 @@ elif app_mode == "CONTENT GENERATOR":
                         
                         try:
                             # Use content generator logic
-                            full_response = logic_engine.run_content_generator(
+                            full_response = _write_stream(logic_engine.stream_content_generator(
                                 st.session_state['cg_topic'], 
                                 content_type, 
                                 st.session_state['cg_key_points'], 
                                 prof_text
-                            )
+                            ))
                             
                             # Heuristic Parsing
                             if "DRAFT:" in full_response:
@@ -3966,7 +4042,8 @@ elif app_mode == "SOCIAL MEDIA ASSISTANT":
             "action": action
         }
 
-    if not active_profile:
+    profile_data = st.session_state['profiles'].get(active_profile) if active_profile else None
+    if profile_data is None:
         st.warning("NO PROFILE SELECTED. Please choose a Brand Profile from the sidebar.")
     else:
         # --- STATE INITIALIZATION (GLOBAL PERSISTENCE) ---
@@ -4051,7 +4128,6 @@ elif app_mode == "SOCIAL MEDIA ASSISTANT":
             
         with c2:
             # --- DYNAMIC CALIBRATION METER ---
-            profile_data = st.session_state['profiles'][active_profile]
             # Calculate off the persisted state value
             metrics = calculate_social_confidence(profile_data, st.session_state['sm_platform'])
             
@@ -4162,12 +4238,12 @@ elif app_mode == "SOCIAL MEDIA ASSISTANT":
                         )
 
                         try:
-                            response = logic_engine.run_social_generator(
+                            response = _write_stream(logic_engine.stream_social_generator(
                                 st.session_state['sm_platform'],
                                 st.session_state['sm_goal'],
                                 prompt,
                                 prof_text
-                            )
+                            ))
 
                             # --- Parse structured response ---
                             _raw = response
@@ -4908,7 +4984,10 @@ elif app_mode == "BRAND ARCHITECT":
             if st.session_state.get('active_profile_name') in p_keys:
                 default_ix = p_keys.index(st.session_state['active_profile_name'])
             target = st.selectbox("SELECT PROFILE TO MANAGE", p_keys, index=default_ix)
-            profile_obj = st.session_state['profiles'][target]
+            profile_obj = st.session_state['profiles'].get(target)
+            if profile_obj is None:
+                # Removed or renamed elsewhere in the org; the index has dropped it.
+                st.rerun()
             
             is_structured = isinstance(profile_obj, dict) and "inputs" in profile_obj
             final_text_view = profile_obj['final_text'] if is_structured else profile_obj
@@ -5193,8 +5272,9 @@ elif app_mode == "BRAND ARCHITECT":
                                     st.markdown(f"<div class='asset-box'><div class='asset-header'>{asset['header']}</div></div>", unsafe_allow_html=True)
                                     c_img, c_txt, c_del = st.columns([1, 3, 1])
                                     with c_img:
-                                        if asset['image']:
-                                            st.image(asset['image'], caption="Asset Thumbnail")
+                                        _thumb = db.resolve_visual_ref(asset['image']) if asset['image'] else None
+                                        if _thumb:
+                                            st.image(_thumb, caption="Asset Thumbnail")
                                         else:
                                             st.caption("No Image")
                                     with c_txt:
@@ -5512,8 +5592,9 @@ elif app_mode == "BRAND ARCHITECT":
                                     st.markdown(f"<div class='asset-box'><div class='asset-header'>{asset['header']}</div></div>", unsafe_allow_html=True)
                                     c_img, c_txt, c_del = st.columns([1, 3, 1])
                                     with c_img:
-                                        if asset['image']:
-                                            st.image(asset['image'], caption="Asset Thumbnail")
+                                        _thumb = db.resolve_visual_ref(asset['image']) if asset['image'] else None
+                                        if _thumb:
+                                            st.image(_thumb, caption="Asset Thumbnail")
                                         else:
                                             st.caption("No Image")
                                     with c_txt:
@@ -6069,7 +6150,7 @@ elif app_mode == "SUBSCRIPTION":
     if st.button("SYNC SUBSCRIPTION STATUS"):
         import time as _sync_t
         st.session_state.pop('_tier_resolved_at', None)
-        _new_tier = sub_manager.resolve_user_tier(_sub_user)
+        _new_tier = sub_manager.resolve_user_tier(_sub_user, force_refresh=True)
         st.session_state['tier'] = _new_tier
         st.session_state['subscription_status'] = _new_tier.get('_subscription_status', 'inactive')
         st.session_state['status'] = st.session_state['subscription_status']
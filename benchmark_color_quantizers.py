@@ -0,0 +1,108 @@
+"""
+Benchmark the color quantization engines behind logic.extract_dominant_colors.
+
+For every sample asset, each engine in logic.QUANTIZERS is timed (median of
+--runs, cache bypassed) and its palette is compared against the sklearn
+KMeans reference with a weighted CIE76 ΔE (logic.palette_delta_e).
+
+Usage:
+    python benchmark_color_quantizers.py                 # repo logos + synthetic images
+    python benchmark_color_quantizers.py a.png b.jpg     # add your own assets
+    python benchmark_color_quantizers.py --runs 5 --colors 6
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+import logic
+
+REPO_ASSETS = ["Castellan_Logo_V2.png", "Signet_Icon_Color.png", "Signet_Logo_Color.png"]
+
+
+def _synthetic_assets():
+    """Deterministic test images: flat blocks, a gradient, and photo-like noise."""
+    rng = np.random.default_rng(7)
+
+    blocks = np.zeros((400, 400, 3), dtype=np.uint8)
+    for i, color in enumerate([(24, 54, 59), (171, 143, 89), (245, 245, 240), (0, 92, 92)]):
+        blocks[:, i * 100:(i + 1) * 100] = color
+
+    ramp = np.linspace(0, 255, 600, dtype=np.uint8)
+    gradient = np.stack([np.tile(ramp, (400, 1)),
+                         np.tile(ramp[::-1], (400, 1)),
+                         np.full((400, 600), 128, dtype=np.uint8)], axis=-1)
+
+    base = rng.integers(0, 256, size=(12, 16, 3), dtype=np.uint8)
+    photo = np.array(Image.fromarray(base).resize((800, 600), Image.BILINEAR), dtype=np.int16)
+    photo = np.clip(photo + rng.normal(0, 12, photo.shape), 0, 255).astype(np.uint8)
+
+    return [("synthetic:blocks", Image.fromarray(blocks)),
+            ("synthetic:gradient", Image.fromarray(gradient)),
+            ("synthetic:photo", Image.fromarray(photo))]
+
+
+def _load_assets(paths):
+    here = os.path.dirname(os.path.abspath(__file__))
+    assets = []
+    for path in [os.path.join(here, p) for p in REPO_ASSETS] + list(paths):
+        if not os.path.exists(path):
+            print(f"[skip] {path} not found")
+            continue
+        with Image.open(path) as img:
+            assets.append((os.path.basename(path), img.copy()))
+    return assets + _synthetic_assets()
+
+
+def _time_engine(image, method, num_colors, runs):
+    timings, palette = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        palette = logic.extract_dominant_colors(image, num_colors, method=method, use_cache=False)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), palette
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="*", help="extra image files to include")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per engine (median reported)")
+    parser.add_argument("--colors", type=int, default=8, help="palette size (num_colors)")
+    args = parser.parse_args(argv)
+
+    methods = ["kmeans"] + [m for m in logic.QUANTIZERS if m != "kmeans"]
+    totals = {m: [] for m in methods}
+    agreement = {m: [] for m in methods}
+
+    print(f"{'asset':<26} {'engine':<11} {'median ms':>10} {'speedup':>8} {'ΔE vs kmeans':>13}")
+    print("-" * 72)
+    for name, image in _load_assets(args.paths):
+        reference_time, reference = _time_engine(image, "kmeans", args.colors, args.runs)
+        for method in methods:
+            if method == "kmeans":
+                elapsed, palette = reference_time, reference
+            else:
+                elapsed, palette = _time_engine(image, method, args.colors, args.runs)
+            delta_e = logic.palette_delta_e(palette, reference)
+            totals[method].append(elapsed)
+            agreement[method].append(delta_e)
+            print(f"{name[:26]:<26} {method:<11} {elapsed * 1000:>10.1f} "
+                  f"{reference_time / elapsed if elapsed else 0:>7.1f}x {delta_e:>13.2f}")
+        print()
+
+    print("SUMMARY (all assets)")
+    print(f"{'engine':<11} {'total ms':>10} {'speedup':>8} {'mean ΔE':>9} {'max ΔE':>8}")
+    reference_total = sum(totals["kmeans"])
+    for method in methods:
+        total = sum(totals[method])
+        print(f"{method:<11} {total * 1000:>10.1f} {reference_total / total if total else 0:>7.1f}x "
+              f"{np.nanmean(agreement[method]):>9.2f} {np.nanmax(agreement[method]):>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Benchmark per-audit color scoring cost: CIEDE2000 (Lab) vs. legacy RGB.
+
+Times ColorScorer.grade_color_match for both modes across brand palette
+sizes, with the per-palette Lab cache cold (first audit of a brand) and warm
+(every later audit), then times visual_audit.run_color_compliance end to end
+with the dominant-color cache warm so only the scoring path differs.
+
+Usage:
+    python benchmark_color_scoring.py
+    python benchmark_color_scoring.py --runs 500 --sizes 4 12 24 48
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+
+import logic
+import visual_audit
+from logic import ColorScorer
+
+
+def _random_hexes(rng, count):
+    return ["#%06x" % rng.randint(0, 0xFFFFFF) for _ in range(count)]
+
+
+def _median_us(fn, runs, before=None):
+    timings = []
+    for _ in range(runs):
+        if before:
+            before()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=300, help="timed runs per cell (median reported)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 8, 20, 40], help="brand palette sizes")
+    parser.add_argument("--detected", type=int, default=8, help="detected colors per asset")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(6)
+    detected = _random_hexes(rng, args.detected)
+
+    print(f"grade_color_match, {args.detected} detected colors (median µs per audit)")
+    print(f"{'brand colors':>12} {'rgb':>9} {'lab cold':>9} {'lab warm':>9} {'warm/rgb':>9}")
+    for size in args.sizes:
+        profile = " ".join(_random_hexes(rng, size))
+        rgb = _median_us(lambda: ColorScorer.grade_color_match(detected, profile, mode="rgb"), args.runs)
+        cold = _median_us(lambda: ColorScorer.grade_color_match(detected, profile, mode="ciede2000"),
+                          args.runs, before=logic.brand_lab_palette.cache_clear)
+        warm = _median_us(lambda: ColorScorer.grade_color_match(detected, profile, mode="ciede2000"), args.runs)
+        print(f"{size:>12} {rgb:>9.1f} {cold:>9.1f} {warm:>9.1f} {warm / rgb:>8.2f}x")
+
+    from PIL import Image
+    image = Image.new("RGB", (600, 400))
+    for i, color in enumerate(_random_hexes(rng, 6)):
+        image.paste(logic.hex_to_rgb(color), (i * 100, 0, (i + 1) * 100, 400))
+    profile_inputs = {"palette_primary": _random_hexes(rng, 3),
+                      "palette_secondary": _random_hexes(rng, 4),
+                      "palette_accent": _random_hexes(rng, 2)}
+    visual_audit.run_color_compliance(image, profile_inputs)  # warm the dominant-color cache
+
+    print("\nrun_color_compliance end to end, dominant colors cached (median µs per audit)")
+    for mode in ("rgb", "ciede2000"):
+        cost = _median_us(lambda: visual_audit.run_color_compliance(image, profile_inputs, mode=mode), args.runs)
+        print(f"{mode:>12} {cost:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Memory ceiling check for the streaming product_events CSV export.
+
+Seeds a throwaway SQLite database with --events synthetic events, then
+streams db_manager.iter_product_events_csv (optionally through gzip_chunks)
+to a sink while sampling the process RSS after every chunk. Exits non-zero
+if RSS grew by more than --max-rss-growth-mb during the export.
+
+Usage:
+    python benchmark_event_export.py                       # 5M events
+    python benchmark_event_export.py --events 200000 --gzip
+    python benchmark_event_export.py --fetch-size 500 --max-rss-growth-mb 32
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import db_manager as db
+
+EVENT_TYPES = ["module_action", "session_start", "api_cost", "output_feedback", "onboarding_step"]
+SEED_BATCH = 50000
+
+
+def rss_mb():
+    """Current resident set size in MB (Linux /proc), else the peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _synthetic_events(count):
+    base = datetime(2026, 1, 1)
+    for i in range(count):
+        meta = json.dumps({"module": "copy_editor", "estimated_cost_usd": 0.0123, "seq": i})
+        ts = (base + timedelta(seconds=i * 7)).strftime("%Y-%m-%d %H:%M:%S")
+        yield (EVENT_TYPES[i % len(EVENT_TYPES)], f"user{i % 997}", f"org{i % 101}", meta, f"s{i // 20}", ts)
+
+
+def seed(count):
+    conn = db._get_connection()
+    try:
+        events = _synthetic_events(count)
+        while True:
+            batch = [e for _, e in zip(range(SEED_BATCH), events)]
+            if not batch:
+                break
+            conn.executemany("INSERT INTO product_events (event_type, username, org_id, metadata_json, "
+                             "session_id, timestamp) VALUES (?, ?, ?, ?, ?, ?)", batch)
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def export(fetch_size, compress):
+    """Stream the full export, returning (bytes out, chunks, peak RSS MB)."""
+    chunks = db.iter_product_events_csv(fetch_size=fetch_size)
+    if compress:
+        chunks = db.gzip_chunks(chunks)
+    total = count = 0
+    peak = rss_mb()
+    with open(os.devnull, "wb") as sink:
+        for chunk in chunks:
+            data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            sink.write(data)
+            total += len(data)
+            count += 1
+            peak = max(peak, rss_mb())
+    return total, count, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=5_000_000, help="synthetic events to seed")
+    parser.add_argument("--fetch-size", type=int, default=db.EXPORT_FETCH_SIZE, help="rows per fetch")
+    parser.add_argument("--gzip", action="store_true", help="compress the stream")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=64.0,
+                        help="fail if RSS grows by more than this during the export")
+    args = parser.parse_args(argv)
+
+    db.DATABASE_URL = ""
+    tmp = tempfile.mkdtemp(prefix="signet_export_")
+    db.DB_NAME = os.path.join(tmp, "export.db")
+    try:
+        db.init_db()
+        started = time.perf_counter()
+        seed(args.events)
+        print(f"seeded {args.events:,} events in {time.perf_counter() - started:.1f}s")
+
+        baseline = rss_mb()
+        started = time.perf_counter()
+        total, count, peak = export(args.fetch_size, args.gzip)
+        elapsed = time.perf_counter() - started
+        growth = peak - baseline
+        print(f"exported {total / 2**20:,.1f} MB{' gzip' if args.gzip else ''} in {count:,} chunks, "
+              f"{elapsed:.1f}s ({args.events / elapsed:,.0f} rows/s)")
+        print(f"RSS baseline {baseline:.1f} MB, peak {peak:.1f} MB, growth {growth:.1f} MB "
+              f"(ceiling {args.max_rss_growth_mb:.0f} MB)")
+        return 0 if growth <= args.max_rss_growth_mb else 1
+    finally:
+        db.close_pool()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
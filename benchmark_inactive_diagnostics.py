@@ -0,0 +1,234 @@
+"""
+Benchmark db_manager.get_inactive_user_diagnostics against the per-user version it replaced.
+
+Seeds a throwaway SQLite database with --users inactive users spread over
+organizations with several brands each, then reports the number of queries
+issued (calls to db_manager._execute_plain) and the median wall time for the
+old per-user fan-out and the current set-based implementation, and checks
+that both return identical rows.
+
+Usage:
+    python benchmark_inactive_diagnostics.py
+    python benchmark_inactive_diagnostics.py --users 2000 --brands 5 --runs 5
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import db_manager as db
+
+MODULES = ["content_generator", "copy_editor", "social_assistant", "visual_audit"]
+STEPS = ["account_created", "first_brand_created", "first_voice_sample", "first_module_run"]
+
+
+def _per_user_diagnostics(days_threshold=14):
+    """The previous implementation: four extra queries per inactive user."""
+    conn = db._get_connection()
+    try:
+        offset = db._datetime_offset(days_threshold)
+        mod_field = db._json_extract('metadata_json', 'module')
+        step_field = db._json_extract('metadata_json', 'step')
+
+        if db.is_postgres():
+            sql = f"""
+                SELECT u.username, u.created_at,
+                    MAX(pe.timestamp) as last_active,
+                    COUNT(DISTINCT CASE WHEN pe.event_type='module_action' THEN pe.id END) as total_actions
+                FROM users u
+                LEFT JOIN product_events pe ON u.username = pe.username
+                WHERE u.subscription_tier != 'super_admin'
+                GROUP BY u.username, u.created_at
+                HAVING MAX(pe.timestamp) IS NULL OR MAX(pe.timestamp) < {offset}
+            """
+        else:
+            sql = f"""
+                SELECT u.username, u.created_at,
+                    MAX(pe.timestamp) as last_active,
+                    COUNT(DISTINCT CASE WHEN pe.event_type='module_action' THEN pe.id END) as total_actions
+                FROM users u
+                LEFT JOIN product_events pe ON u.username = pe.username
+                WHERE u.subscription_tier != 'super_admin'
+                GROUP BY u.username
+                HAVING last_active IS NULL OR last_active < {offset}
+            """
+
+        users = db._execute_plain(conn, sql).fetchall()
+
+        results = []
+        for u in users:
+            u = db._dict_row(u)
+            username = u['username']
+
+            modules = db._execute_plain(
+                conn, db._q(f"""SELECT DISTINCT {mod_field}
+                            FROM product_events
+                            WHERE username=? AND event_type='module_action'"""),
+                (username,)).fetchall()
+            modules_used = []
+            for m in modules:
+                val = m[list(m.keys())[0]] if isinstance(m, dict) else m[0]
+                if val:
+                    modules_used.append(val)
+            all_modules = {"content_generator", "copy_editor", "social_assistant", "visual_audit"}
+            modules_never = all_modules - set(modules_used)
+
+            steps = db._execute_plain(
+                conn, db._q(f"""SELECT {step_field}
+                            FROM product_events
+                            WHERE username=? AND event_type='onboarding_step'"""),
+                (username,)).fetchall()
+            steps_done = []
+            for s in steps:
+                val = s[list(s.keys())[0]] if isinstance(s, dict) else s[0]
+                if val:
+                    steps_done.append(val)
+
+            org_row = db._execute_plain(
+                conn, db._q("SELECT org_id FROM users WHERE username=?"), (username,)).fetchone()
+            org = username
+            if org_row:
+                org_val = org_row['org_id'] if isinstance(org_row, dict) else org_row[0]
+                org = org_val if org_val else username
+
+            profiles = db._execute_plain(
+                conn, db._q(f"SELECT data FROM profiles WHERE org_id=? AND (is_sample_brand={'FALSE' if db.is_postgres() else '0'} OR is_sample_brand IS NULL)"),
+                (org,)).fetchall()
+
+            max_confidence = 0
+            has_voice = False
+            has_mh = False
+            for p in profiles:
+                try:
+                    raw = p['data'] if isinstance(p, dict) else p[0]
+                    d = json.loads(raw) if isinstance(raw, str) else raw
+                    if isinstance(d, dict):
+                        max_confidence = max(max_confidence, d.get('calibration_score', 0))
+                        inp = d.get('inputs', {})
+                        if len(inp.get('voice_dna', '')) > 20:
+                            has_voice = True
+                        if any(inp.get(k) for k in ['mh_brand_promise', 'mh_pillars_json']):
+                            has_mh = True
+                except (json.JSONDecodeError, TypeError):
+                    pass
+
+            missing = []
+            if not has_voice:
+                missing.append("No voice samples")
+            if not has_mh:
+                missing.append("No message house")
+            for m in sorted(modules_never):
+                missing.append(f"Never tried {m.replace('_', ' ').title()}")
+
+            results.append({
+                "username": username,
+                "last_active": u.get('last_active') or "Never",
+                "total_actions": u.get('total_actions', 0),
+                "confidence": max_confidence,
+                "missing": ", ".join(missing) if missing else "Complete",
+            })
+
+        return results
+    finally:
+        conn.close()
+
+
+def _profile_data(rng):
+    inputs = {"wiz_name": "Brand"}
+    if rng.random() < 0.5:
+        inputs["voice_dna"] = "[ASSET: sample]" + " lorem ipsum" * rng.randint(1, 200)
+    if rng.random() < 0.4:
+        inputs["mh_brand_promise"] = "We make it simple."
+    return json.dumps({"calibration_score": rng.randint(0, 100), "inputs": inputs,
+                       "notes": "x" * rng.randint(500, 5000)})
+
+
+def seed(users, brands, users_per_org=4):
+    """Fill the current DB_NAME with `users` inactive users and their history."""
+    rng = random.Random(22)
+    long_ago = (datetime.now(timezone.utc) - timedelta(days=60)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = db._get_connection()
+    try:
+        for i in range(users):
+            org = f"org{i // users_per_org}"
+            conn.execute("INSERT INTO users (username, email, password_hash, org_id, subscription_tier, "
+                         "subscription_status, created_at) VALUES (?, ?, 'x', ?, 'solo', 'active', ?)",
+                         (f"user{i}", f"user{i}@example.com", org, long_ago))
+            for module in rng.sample(MODULES, rng.randint(0, len(MODULES))):
+                for _ in range(rng.randint(1, 3)):
+                    conn.execute("INSERT INTO product_events (event_type, username, metadata_json, timestamp) "
+                                 "VALUES ('module_action', ?, ?, ?)",
+                                 (f"user{i}", json.dumps({"module": module}), long_ago))
+            for step in STEPS[:rng.randint(1, len(STEPS))]:
+                conn.execute("INSERT INTO product_events (event_type, username, metadata_json, timestamp) "
+                             "VALUES ('onboarding_step', ?, ?, ?)",
+                             (f"user{i}", json.dumps({"step": step}), long_ago))
+        for o in range((users + users_per_org - 1) // users_per_org):
+            for b in range(brands):
+                conn.execute("INSERT INTO profiles (org_id, name, data, created_at) VALUES (?, ?, ?, ?)",
+                             (f"org{o}", f"Brand {b}", _profile_data(rng), long_ago))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _measure(fn, runs):
+    """(queries per call, median seconds, result) with _execute_plain counted."""
+    calls = [0]
+    execute = db._execute_plain
+
+    def counting(*args, **kwargs):
+        calls[0] += 1
+        return execute(*args, **kwargs)
+
+    db._execute_plain = counting
+    try:
+        timings, result = [], None
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+    finally:
+        db._execute_plain = execute
+    return calls[0] // runs, statistics.median(timings), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000, help="inactive users to seed")
+    parser.add_argument("--brands", type=int, default=3, help="brands per organization")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per implementation (median reported)")
+    args = parser.parse_args(argv)
+
+    db.DATABASE_URL = ""
+    tmp = tempfile.mkdtemp(prefix="signet_bench_")
+    db.DB_NAME = os.path.join(tmp, "bench.db")
+    try:
+        db.init_db()
+        seed(args.users, args.brands)
+        db.backfill_profile_summaries()
+        db.backfill_event_columns()
+
+        old_queries, old_time, old_rows = _measure(_per_user_diagnostics, args.runs)
+        new_queries, new_time, new_rows = _measure(db.get_inactive_user_diagnostics, args.runs)
+
+        print(f"{args.users} inactive users, {args.brands} brands per org (median of {args.runs})")
+        print(f"{'implementation':<14} {'queries':>8} {'seconds':>9}")
+        print(f"{'per-user':<14} {old_queries:>8} {old_time:>9.3f}")
+        print(f"{'set-based':<14} {new_queries:>8} {new_time:>9.3f}")
+        print(f"speedup {old_time / new_time if new_time else 0:.1f}x, "
+              f"identical output: {old_rows == new_rows}")
+        return 0 if old_rows == new_rows else 1
+    finally:
+        db.close_pool()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,9 +3,22 @@ from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
 import json
 import os
+import re
 import shutil
 import logging
-from datetime import datetime
+import threading
+import time
+import queue
+import atexit
+import contextvars
+import base64
+import hashlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from content_types import VOICE_CLUSTER_NAMES
 
 logging.basicConfig(level=logging.INFO)
 
@@ -22,6 +35,22 @@ DB_NAME = os.path.join(DB_FOLDER, "signet_studio_v3.db")
 
 ph = PasswordHasher()
 
+# --- CONNECTION POOL CONFIGURATION ---
+# Postgres: connections held open across calls, bounded by DB_POOL_MAX_SIZE.
+# SQLite: one persistent connection per thread (pool sizes don't apply).
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", "30"))
+# Idle connections older than this are pinged with SELECT 1 before reuse
+DB_POOL_PING_AFTER_SECONDS = float(os.environ.get("DB_POOL_PING_AFTER_SECONDS", "30"))
+
+# --- PRODUCT EVENT WRITER CONFIGURATION ---
+# track_event/check_milestone enqueue; a background thread batch-inserts.
+EVENT_WRITER_ASYNC = os.environ.get("EVENT_WRITER_ASYNC", "1") != "0"
+EVENT_QUEUE_MAX = int(os.environ.get("EVENT_QUEUE_MAX", "10000"))
+EVENT_BATCH_SIZE = int(os.environ.get("EVENT_BATCH_SIZE", "50"))
+EVENT_FLUSH_INTERVAL_MS = int(os.environ.get("EVENT_FLUSH_INTERVAL_MS", "500"))
+
 # --- SEAT LIMIT CONFIGURATION ---
 # SUPERSEDED by tier_config.TIER_CONFIG — kept for legacy compatibility only
 SEAT_LIMITS = {
@@ -32,6 +61,9 @@ SEAT_LIMITS = {
     "active": 5  # Fallback for generic active status
 }
 
+# Length of the free trial that starts at signup (get_trial_info)
+TRIAL_DAYS = 14
+
 
 # ── Database abstraction helpers ──────────────────────────────────────────────
 
@@ -40,18 +72,293 @@ def is_postgres():
     return bool(DATABASE_URL)
 
 
+# ── Connection pooling ────────────────────────────────────────────────────────
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT_SECONDS."""
+
+
+def _new_pool_stats(backend):
+    return {
+        "backend": backend,
+        "checkouts": 0,
+        "waits": 0,
+        "in_use": 0,
+        "peak_in_use": 0,
+        "idle": 0,
+        "created": 0,
+        "health_check_failures": 0,
+    }
+
+
+def _connection_is_healthy(conn, idle_seconds):
+    """Checkout health check: reject closed connections, ping long-idle ones."""
+    if getattr(conn, "closed", 0):
+        return False
+    if idle_seconds < DB_POOL_PING_AFTER_SECONDS:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchone()
+        cur.close()
+        return True
+    except Exception:
+        return False
+
+
+class _PooledConnection:
+    """Proxy around a pooled connection. close() returns it to the pool
+    instead of closing it, so existing call sites work unchanged."""
+
+    def __init__(self, raw, release):
+        self._raw = raw
+        self._release = release
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise AttributeError(f"connection already returned to pool ({name})")
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._release(raw)
+
+
+class _ConnectionPool:
+    """Thread-safe bounded pool (psycopg2.pool-style) with checkout metrics.
+
+    Up to max_size connections are checked out at once; further callers wait
+    up to `timeout` seconds. min_size connections are opened eagerly. Returned
+    connections are rolled back so uncommitted work never leaks to the next
+    borrower — the same guarantee a real close() gives.
+    """
+
+    def __init__(self, factory, min_size=1, max_size=10, timeout=30.0):
+        self._factory = factory
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self._idle = []  # [(conn, returned_at_monotonic)]
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.stats = _new_pool_stats("postgres")
+        for _ in range(self.min_size):
+            self._idle.append((self._create(), time.monotonic()))
+
+    def _create(self):
+        conn = self._factory()
+        self.stats["created"] += 1
+        return conn
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self.stats["checkouts"] += 1
+            waited = False
+            while not self._idle and self._in_use >= self.max_size:
+                if not waited:
+                    self.stats["waits"] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.timeout}s "
+                        f"({self.max_size} in use)")
+                self._cond.wait(remaining)
+            conn, returned_at = self._idle.pop() if self._idle else (None, None)
+            self._in_use += 1
+            self.stats["peak_in_use"] = max(self.stats["peak_in_use"], self._in_use)
+
+        # Health check and connect happen outside the lock
+        try:
+            if conn is not None and not _connection_is_healthy(conn, time.monotonic() - returned_at):
+                with self._cond:
+                    self.stats["health_check_failures"] += 1
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._factory()
+                with self._cond:
+                    self.stats["created"] += 1
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn):
+        keep = True
+        try:
+            conn.rollback()
+        except Exception:
+            keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep and not getattr(conn, "closed", 0):
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats["in_use"] = self._in_use
+            stats["idle"] = len(self._idle)
+            stats["max_size"] = self.max_size
+            stats["min_size"] = self.min_size
+        return stats
+
+
+class _ThreadLocalSQLite:
+    """One persistent SQLite connection per thread, reopened if DB_NAME changes.
+
+    Nested checkouts on the same thread share the connection; uncommitted work
+    is only rolled back when the outermost caller releases it.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self.stats = _new_pool_stats("sqlite")
+
+    def getconn(self, path):
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None and getattr(local, "depth", 0) == 0:
+            if local.path != path or not _connection_is_healthy(
+                    conn, time.monotonic() - local.returned_at):
+                if local.path == path:
+                    with self._lock:
+                        self.stats["health_check_failures"] += 1
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+        if conn is None:
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            local.conn, local.path, local.depth = conn, path, 0
+            local.returned_at = time.monotonic()
+            with self._lock:
+                self.stats["created"] += 1
+        local.depth += 1
+        with self._lock:
+            self.stats["checkouts"] += 1
+            if local.depth == 1:
+                self._in_use += 1
+                self.stats["peak_in_use"] = max(self.stats["peak_in_use"], self._in_use)
+        return conn
+
+    def putconn(self, conn):
+        local = self._local
+        if getattr(local, "conn", None) is not conn:
+            # Connection was replaced under us (DB_NAME switch) — just close it
+            conn.close()
+            return
+        local.depth -= 1
+        if local.depth > 0:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            local.conn = None
+        local.returned_at = time.monotonic()
+        with self._lock:
+            self._in_use -= 1
+
+    def closeall(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "depth", 0) == 0:
+            conn.close()
+            self._local.conn = None
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_use"] = self._in_use
+        return stats
+
+
+_pg_pool = None
+_pg_pool_url = None
+_sqlite_pool = _ThreadLocalSQLite()
+_pool_lock = threading.Lock()
+
+
+def _connect_postgres():
+    import psycopg2
+    import psycopg2.extras
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.cursor_factory = psycopg2.extras.RealDictCursor
+    return conn
+
+
+def _get_pg_pool():
+    """Return the process-wide Postgres pool, rebuilding it if DATABASE_URL changed."""
+    global _pg_pool, _pg_pool_url
+    with _pool_lock:
+        if _pg_pool is None or _pg_pool_url != DATABASE_URL:
+            if _pg_pool is not None:
+                _pg_pool.closeall()
+            _pg_pool = _ConnectionPool(
+                _connect_postgres,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT_SECONDS,
+            )
+            _pg_pool_url = DATABASE_URL
+        return _pg_pool
+
+
 def _get_connection():
-    """Return a DB connection — Postgres if DATABASE_URL is set, else SQLite."""
+    """Return a pooled DB connection — Postgres if DATABASE_URL is set, else SQLite.
+
+    Callers still call conn.close(); that returns the connection to the pool.
+    """
     if is_postgres():
-        import psycopg2
-        import psycopg2.extras
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.cursor_factory = psycopg2.extras.RealDictCursor
-        return conn
+        pool = _get_pg_pool()
+        return _PooledConnection(pool.getconn(), pool.putconn)
     else:
-        conn = sqlite3.connect(DB_NAME)
-        conn.row_factory = sqlite3.Row
-        return conn
+        conn = _sqlite_pool.getconn(DB_NAME)
+        return _PooledConnection(conn, _sqlite_pool.putconn)
+
+
+def get_pool_stats():
+    """Returns connection pool metrics for the admin System Health tab."""
+    if is_postgres():
+        return _get_pg_pool().get_stats()
+    return _sqlite_pool.get_stats()
+
+
+def close_pool():
+    """Close idle pooled connections (shutdown / tests)."""
+    global _pg_pool, _pg_pool_url
+    with _pool_lock:
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+            _pg_pool, _pg_pool_url = None, None
+    _sqlite_pool.closeall()
 
 
 def _q(sql):
@@ -194,6 +501,60 @@ def _init_db_postgres(conn):
     ''')
 
 
+# Versioned secondary indexes for the hot query predicates. Append new
+# (version, name, table, columns) entries; each backend applies the ones newer
+# than the recorded schema_index_version and stores the highest it reached.
+INDEX_VERSION_KEY = "schema_index_version"
+INDEX_MIGRATIONS = [
+    (1, "idx_al_org_id", "activity_log", "org_id, id"),                       # get_org_logs
+    (1, "idx_ut_org_month", "usage_tracking", "org_id, billing_month"),        # get_monthly_usage, check_usage_limit
+    (1, "idx_ut_user_month", "usage_tracking", "username, billing_month"),     # get_monthly_usage_user, check_usage_limit
+    (1, "idx_users_org", "users", "org_id"),                                   # check_seat_availability
+    (1, "idx_users_email", "users", "email"),                                  # get_user_by_email
+    (1, "idx_pe_type_user", "product_events", "event_type, username"),         # onboarding / per-user funnels
+    (1, "idx_pe_type_ts", "product_events", "event_type, timestamp"),          # windowed engagement metrics
+    (2, "idx_pe_type_module_ts", "product_events", "event_type, module, timestamp"),  # cost / engagement by module
+    (2, "idx_pe_type_step", "product_events", "event_type, step, username"),   # onboarding funnel, milestones
+]
+
+
+def _apply_index_migrations(conn):
+    """Create any secondary indexes newer than the recorded version."""
+    row = _execute_plain(
+        conn, _q("SELECT value FROM platform_settings WHERE key = ?"), (INDEX_VERSION_KEY,)).fetchone()
+    current = int((row['value'] if isinstance(row, dict) else row[0]) or 0) if row else 0
+    target = max(version for version, _, _, _ in INDEX_MIGRATIONS)
+    if current >= target:
+        return
+
+    for version, name, table, columns in INDEX_MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            _execute_plain(conn, f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.warning(f"Index migration {name} failed: {e}")
+            return  # Leave the version alone so the next start retries
+
+    now = datetime.now().isoformat()
+    if is_postgres():
+        _execute_plain(conn, '''
+            INSERT INTO platform_settings (key, value, updated_at, updated_by)
+            VALUES (%s, %s, %s, 'migration')
+            ON CONFLICT(key) DO UPDATE SET value = %s, updated_at = %s
+        ''', (INDEX_VERSION_KEY, str(target), now, str(target), now))
+    else:
+        conn.execute('''
+            INSERT INTO platform_settings (key, value, updated_at, updated_by)
+            VALUES (?, ?, ?, 'migration')
+            ON CONFLICT(key) DO UPDATE SET value = ?, updated_at = ?
+        ''', (INDEX_VERSION_KEY, str(target), now, str(target), now))
+    conn.commit()
+    logging.info(f"Secondary indexes migrated to version {target}")
+
+
 def run_migrations():
     """Apply schema migrations idempotently. Backs up DB on first run (SQLite only)."""
     conn = _get_connection()
@@ -206,6 +567,38 @@ def run_migrations():
     finally:
         conn.close()
 
+    # One-shot backfill of usage_counters from existing usage_tracking rows
+    if get_platform_setting(_USAGE_COUNTERS_KEY) != "done":
+        rebuilt = rebuild_usage_counters()
+        set_platform_setting(_USAGE_COUNTERS_KEY, "done")
+        logging.info(f"Usage counters backfilled: {rebuilt} rows")
+
+    # One-shot data migration: move inline profile images into profile_assets
+    if get_platform_setting(_ASSET_MIGRATION_KEY) != "done":
+        result = migrate_profile_assets()
+        set_platform_setting(_ASSET_MIGRATION_KEY, "done")
+        if result["profiles_rewritten"]:
+            logging.info(f"Externalized profile images: {result}")
+
+    # One-shot backfill of the typed product_events columns (see track_event)
+    if get_platform_setting(_EVENT_COLUMNS_KEY) != "done":
+        backfilled = backfill_event_columns()
+        set_platform_setting(_EVENT_COLUMNS_KEY, "done")
+        logging.info(f"Product event columns backfilled: {backfilled} rows")
+
+    # One-shot initial fold of existing events into the analytics rollups; the
+    # rollup worker (analytics_worker.py) keeps them current from here on
+    if get_platform_setting(_ROLLUP_INITIAL_KEY) != "done":
+        folded = refresh_analytics_rollups()
+        set_platform_setting(_ROLLUP_INITIAL_KEY, "done")
+        logging.info(f"Analytics rollups initialized: {folded} events folded")
+
+    # One-shot backfill of the profile summary columns (see save_profile)
+    if get_platform_setting(_PROFILE_SUMMARY_KEY) != "done":
+        backfilled = backfill_profile_summaries()
+        set_platform_setting(_PROFILE_SUMMARY_KEY, "done")
+        logging.info(f"Profile summaries backfilled: {backfilled} rows")
+
 
 def _get_existing_columns_pg(conn, table):
     """Get set of column names from a Postgres table."""
@@ -272,6 +665,19 @@ def _run_migrations_postgres(conn):
             conn.commit()
         except Exception:
             conn.rollback()
+    if 'updated_at' not in profile_columns:
+        try:
+            cur.execute("ALTER TABLE profiles ADD COLUMN updated_at TEXT")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+    for col_name, col_def in PROFILE_SUMMARY_COLUMNS:
+        if col_name not in profile_columns:
+            try:
+                cur.execute(f"ALTER TABLE profiles ADD COLUMN {col_name} {col_def.format(false='FALSE')}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
 
     # Create organizations table
     cur.execute('''
@@ -312,6 +718,57 @@ def _run_migrations_postgres(conn):
         except Exception:
             conn.rollback()
 
+    # Cross-process cache invalidations (see publish_change)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS change_versions (
+            id SERIAL PRIMARY KEY,
+            scope TEXT NOT NULL,
+            change_key TEXT,
+            created_at TEXT
+        )
+    ''')
+
+    # Materialized per-month usage totals (see _bump_usage_counters)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS usage_counters (
+            scope TEXT NOT NULL,
+            scope_id TEXT NOT NULL,
+            billing_month TEXT NOT NULL,
+            is_impersonated INTEGER NOT NULL DEFAULT 0,
+            total_weight INTEGER NOT NULL DEFAULT 0,
+            action_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, scope_id, billing_month, is_impersonated)
+        )
+    ''')
+
+    # Daily analytics rollups (see refresh_analytics_rollups)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_user_daily (
+            day TEXT NOT NULL,
+            username TEXT NOT NULL,
+            module_actions INTEGER NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            last_action_at TEXT,
+            PRIMARY KEY (day, username)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_module_daily (
+            day TEXT NOT NULL,
+            module TEXT NOT NULL,
+            username TEXT NOT NULL,
+            actions INTEGER NOT NULL DEFAULT 0,
+            cost_events INTEGER NOT NULL DEFAULT 0,
+            cost_usd DOUBLE PRECISION NOT NULL DEFAULT 0,
+            input_tokens BIGINT NOT NULL DEFAULT 0,
+            output_tokens BIGINT NOT NULL DEFAULT 0,
+            feedback_yes INTEGER NOT NULL DEFAULT 0,
+            feedback_close INTEGER NOT NULL DEFAULT 0,
+            feedback_no INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, module, username)
+        )
+    ''')
+
     # Create admin_audit_log table
     cur.execute('''
         CREATE TABLE IF NOT EXISTS admin_audit_log (
@@ -335,6 +792,17 @@ def _run_migrations_postgres(conn):
         )
     ''')
 
+    # Content-addressed image store for profile VISUAL_REF lines
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS profile_assets (
+            hash TEXT PRIMARY KEY,
+            mime_type TEXT NOT NULL,
+            data BYTEA NOT NULL,
+            size_bytes INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
     # Create product_events table
     cur.execute('''
         CREATE TABLE IF NOT EXISTS product_events (
@@ -348,6 +816,16 @@ def _run_migrations_postgres(conn):
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    conn.commit()
+    event_columns = _get_existing_columns_pg(conn, 'product_events')
+    for col_name, col_def in PRODUCT_EVENT_COLUMNS:
+        if col_name not in event_columns:
+            try:
+                cur.execute(f"ALTER TABLE product_events ADD COLUMN {col_name} "
+                            f"{col_def.format(real='DOUBLE PRECISION')}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
     for idx_sql in [
         "CREATE INDEX IF NOT EXISTS idx_pe_type ON product_events(event_type)",
         "CREATE INDEX IF NOT EXISTS idx_pe_user ON product_events(username)",
@@ -360,6 +838,7 @@ def _run_migrations_postgres(conn):
             conn.rollback()
 
     conn.commit()
+    _apply_index_migrations(conn)
 
 
 def _run_migrations_sqlite(conn):
@@ -417,6 +896,17 @@ def _run_migrations_sqlite(conn):
             conn.execute("ALTER TABLE profiles ADD COLUMN is_sample_brand BOOLEAN DEFAULT 0")
         except sqlite3.OperationalError:
             pass
+    if 'updated_at' not in profile_columns:
+        try:
+            conn.execute("ALTER TABLE profiles ADD COLUMN updated_at TEXT")
+        except sqlite3.OperationalError:
+            pass
+    for col_name, col_def in PROFILE_SUMMARY_COLUMNS:
+        if col_name not in profile_columns:
+            try:
+                conn.execute(f"ALTER TABLE profiles ADD COLUMN {col_name} {col_def.format(false='0')}")
+            except sqlite3.OperationalError:
+                pass
 
     conn.execute('''
         CREATE TABLE IF NOT EXISTS organizations (
@@ -453,6 +943,57 @@ def _run_migrations_sqlite(conn):
         except sqlite3.OperationalError:
             pass
 
+    # Cross-process cache invalidations (see publish_change)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scope TEXT NOT NULL,
+            change_key TEXT,
+            created_at TEXT
+        )
+    ''')
+
+    # Materialized per-month usage totals (see _bump_usage_counters)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_counters (
+            scope TEXT NOT NULL,
+            scope_id TEXT NOT NULL,
+            billing_month TEXT NOT NULL,
+            is_impersonated INTEGER NOT NULL DEFAULT 0,
+            total_weight INTEGER NOT NULL DEFAULT 0,
+            action_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, scope_id, billing_month, is_impersonated)
+        )
+    ''')
+
+    # Daily analytics rollups (see refresh_analytics_rollups)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_user_daily (
+            day TEXT NOT NULL,
+            username TEXT NOT NULL,
+            module_actions INTEGER NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            last_action_at TEXT,
+            PRIMARY KEY (day, username)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_module_daily (
+            day TEXT NOT NULL,
+            module TEXT NOT NULL,
+            username TEXT NOT NULL,
+            actions INTEGER NOT NULL DEFAULT 0,
+            cost_events INTEGER NOT NULL DEFAULT 0,
+            cost_usd REAL NOT NULL DEFAULT 0,
+            input_tokens INTEGER NOT NULL DEFAULT 0,
+            output_tokens INTEGER NOT NULL DEFAULT 0,
+            feedback_yes INTEGER NOT NULL DEFAULT 0,
+            feedback_close INTEGER NOT NULL DEFAULT 0,
+            feedback_no INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, module, username)
+        )
+    ''')
+
     conn.execute('''
         CREATE TABLE IF NOT EXISTS admin_audit_log (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -474,6 +1015,17 @@ def _run_migrations_sqlite(conn):
         )
     ''')
 
+    # Content-addressed image store for profile VISUAL_REF lines
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS profile_assets (
+            hash TEXT PRIMARY KEY,
+            mime_type TEXT NOT NULL,
+            data BLOB NOT NULL,
+            size_bytes INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
     conn.execute('''
         CREATE TABLE IF NOT EXISTS product_events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -486,6 +1038,14 @@ def _run_migrations_sqlite(conn):
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    cursor = conn.execute("PRAGMA table_info(product_events)")
+    event_columns = {row[1] if not isinstance(row, dict) else row['name'] for row in cursor.fetchall()}
+    for col_name, col_def in PRODUCT_EVENT_COLUMNS:
+        if col_name not in event_columns:
+            try:
+                conn.execute(f"ALTER TABLE product_events ADD COLUMN {col_name} {col_def.format(real='REAL')}")
+            except sqlite3.OperationalError:
+                pass
     for idx_sql in [
         "CREATE INDEX IF NOT EXISTS idx_pe_type ON product_events(event_type)",
         "CREATE INDEX IF NOT EXISTS idx_pe_user ON product_events(username)",
@@ -498,6 +1058,7 @@ def _run_migrations_sqlite(conn):
             pass
 
     conn.commit()
+    _apply_index_migrations(conn)
 
     # One-time data migration for existing users
     if first_migration:
@@ -559,7 +1120,9 @@ def create_user(username, email, password, org_id=None, is_admin=False):
             INSERT INTO users (username, email, password_hash, org_id, is_admin, created_at)
             VALUES (?, ?, ?, ?, ?, ?)
         '''), (username, email, hashed, org_id, is_admin, datetime.now().isoformat()))
+        _publish_change(conn, "tier", username)
         conn.commit()
+        _invalidate_user_cache(username)
         return True
     except (sqlite3.IntegrityError if not is_postgres() else Exception) as e:
         if is_postgres():
@@ -634,6 +1197,258 @@ def get_users_by_org(org_id):
 
 
 # --- 3. STUDIO PROFILE MANAGEMENT (Org-Based) ---
+
+# Callables run after profile data is written (save_profile, asset migration).
+# Caches derived from profiles register here so this module stays free of
+# imports from the prompt layer.
+_profile_saved_hooks = []
+
+
+def register_profile_saved_hook(hook):
+    """Run hook() after every profile write; registering twice is a no-op."""
+    if hook not in _profile_saved_hooks:
+        _profile_saved_hooks.append(hook)
+
+
+def _notify_profile_saved():
+    for hook in list(_profile_saved_hooks):
+        try:
+            hook()
+        except Exception:
+            logging.exception(f"Profile saved hook {hook!r} failed")
+
+
+# Profile images live in profile_assets keyed by SHA-256; profile JSON only
+# carries "[VISUAL_REF: asset:<hash>]" lines. Inline data-URI refs written by
+# older code (or still in a session's copy of a profile) are externalized on
+# save, so identical uploads across brands are stored once.
+ASSET_REF_PREFIX = "asset:"
+ASSET_CACHE_MAX = int(os.environ.get("ASSET_CACHE_MAX", "64"))
+_ASSET_MIGRATION_KEY = "profile_assets_migrated"
+_INLINE_REF_RE = re.compile(
+    r"^\[VISUAL_REF:\s*data:(image/[\w.+-]+);base64,([A-Za-z0-9+/=]+)\s*\]\s*$", re.MULTILINE)
+_asset_cache = OrderedDict()
+_asset_cache_lock = threading.Lock()
+
+
+def _store_asset(conn, data, mime_type):
+    """Insert a blob if its hash is new. Returns the hash."""
+    digest = hashlib.sha256(data).hexdigest()
+    if is_postgres():
+        _execute_plain(conn, '''
+            INSERT INTO profile_assets (hash, mime_type, data, size_bytes)
+            VALUES (%s, %s, %s, %s) ON CONFLICT (hash) DO NOTHING
+        ''', (digest, mime_type, data, len(data)))
+    else:
+        conn.execute('''
+            INSERT OR IGNORE INTO profile_assets (hash, mime_type, data, size_bytes)
+            VALUES (?, ?, ?, ?)
+        ''', (digest, mime_type, data, len(data)))
+    return digest
+
+
+def store_asset(data, mime_type="image/png"):
+    """Store image bytes in the asset table; returns the "asset:<hash>" ref."""
+    conn = _get_connection()
+    try:
+        digest = _store_asset(conn, data, mime_type)
+        conn.commit()
+        return ASSET_REF_PREFIX + digest
+    finally:
+        conn.close()
+
+
+def _externalize_text(conn, text):
+    """Replace inline base64 VISUAL_REF lines with asset refs. Returns (text, count)."""
+    if not text or ("[VISUAL_REF: data:" not in text and "[VISUAL_REF:data:" not in text):
+        return text, 0
+    count = 0
+
+    def _swap(match):
+        nonlocal count
+        try:
+            data = base64.b64decode(match.group(2), validate=True)
+        except ValueError:
+            return match.group(0)  # Corrupt payload — leave the line as it was
+        count += 1
+        return f"[VISUAL_REF: {ASSET_REF_PREFIX}{_store_asset(conn, data, match.group(1))}]"
+
+    return _INLINE_REF_RE.sub(_swap, text), count
+
+
+def _externalize_profile(conn, profile_data):
+    """Copy of profile_data with inline images in any inputs text moved to the store."""
+    inputs = profile_data.get("inputs") if isinstance(profile_data, dict) else None
+    if not isinstance(inputs, dict):
+        return profile_data, 0
+    new_inputs, total = {}, 0
+    for key, value in inputs.items():
+        if isinstance(value, str):
+            value, n = _externalize_text(conn, value)
+            total += n
+        new_inputs[key] = value
+    if not total:
+        return profile_data, 0
+    return {**profile_data, "inputs": new_inputs}, total
+
+
+def get_asset(asset_hash):
+    """Returns (mime_type, bytes) for a stored asset, or None. Recently used assets are cached."""
+    with _asset_cache_lock:
+        cached = _asset_cache.get(asset_hash)
+        if cached is not None:
+            _asset_cache.move_to_end(asset_hash)
+            return cached
+    conn = _get_connection()
+    try:
+        row = _execute_plain(
+            conn, _q("SELECT mime_type, data FROM profile_assets WHERE hash = ?"), (asset_hash,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    mime = row['mime_type'] if isinstance(row, dict) else row[0]
+    data = row['data'] if isinstance(row, dict) else row[1]
+    asset = (mime, bytes(data))
+    with _asset_cache_lock:
+        _asset_cache[asset_hash] = asset
+        while len(_asset_cache) > ASSET_CACHE_MAX:
+            _asset_cache.popitem(last=False)
+    return asset
+
+
+def resolve_visual_ref(ref):
+    """Turn a VISUAL_REF payload (asset ref or inline data URI) into a data URI.
+
+    Accepts either the whole "[VISUAL_REF: ...]" line or just its payload.
+    Returns None when the asset is missing or the ref is malformed.
+    """
+    if not ref:
+        return None
+    ref = ref.strip()
+    if ref.startswith("[VISUAL_REF:"):
+        ref = ref[len("[VISUAL_REF:"):].rstrip("]").strip()
+    if ref.startswith("data:image"):
+        return ref
+    if ref.startswith(ASSET_REF_PREFIX):
+        asset = get_asset(ref[len(ASSET_REF_PREFIX):])
+        if asset:
+            mime, data = asset
+            return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+    return None
+
+
+def migrate_profile_assets():
+    """Rewrite every stored profile so inline images become asset refs.
+
+    Safe to re-run; returns counts and total profile bytes before/after.
+    """
+    conn = _get_connection()
+    result = {"profiles_rewritten": 0, "images_externalized": 0, "bytes_before": 0, "bytes_after": 0}
+    try:
+        rows = _execute_plain(conn, "SELECT id, data FROM profiles").fetchall()
+        for row in rows:
+            row_id = row['id'] if isinstance(row, dict) else row[0]
+            raw = row['data'] if isinstance(row, dict) else row[1]
+            if not raw:
+                continue
+            result["bytes_before"] += len(raw)
+            try:
+                profile_data = json.loads(raw)
+            except (TypeError, ValueError):
+                result["bytes_after"] += len(raw)
+                continue
+            new_data, n = _externalize_profile(conn, profile_data)
+            if not n:
+                result["bytes_after"] += len(raw)
+                continue
+            new_raw = json.dumps(new_data)
+            _execute_plain(conn, _q("UPDATE profiles SET data = ?, data_bytes = ? WHERE id = ?"),
+                           (new_raw, len(new_raw), row_id))
+            result["profiles_rewritten"] += 1
+            result["images_externalized"] += n
+            result["bytes_after"] += len(new_raw)
+        conn.commit()
+    finally:
+        conn.close()
+    _notify_profile_saved()
+    return result
+
+
+# --- PROFILE SUMMARY COLUMNS ---
+# Analytics and admin views only need a brand's calibration score and which
+# sections are filled in. Those are written alongside `data` on every save so
+# readers aggregate plain columns instead of decoding each profile's JSON.
+
+PROFILE_SUMMARY_COLUMNS = [
+    ("calibration_score", "INTEGER DEFAULT 0"),
+    ("strategy_fields", "INTEGER DEFAULT 0"),
+    ("voice_samples", "INTEGER DEFAULT 0"),
+    ("voice_cluster_counts", "TEXT DEFAULT NULL"),
+    ("has_voice", "BOOLEAN DEFAULT {false}"),
+    ("has_message_house", "BOOLEAN DEFAULT {false}"),
+    ("has_visual", "BOOLEAN DEFAULT {false}"),
+    ("has_social", "BOOLEAN DEFAULT {false}"),
+    ("data_bytes", "INTEGER DEFAULT 0"),
+]
+_SUMMARY_NAMES = [name for name, _ in PROFILE_SUMMARY_COLUMNS]
+_PROFILE_SUMMARY_KEY = "profile_summaries_backfilled"
+
+
+def _has_samples(blob):
+    return len(blob) > 20 or '[ASSET:' in blob
+
+
+def profile_summary(profile_data, data_json):
+    """Summary column values for a profile, in PROFILE_SUMMARY_COLUMNS order."""
+    if not isinstance(profile_data, dict):
+        profile_data = {}
+    inputs = profile_data.get('inputs')
+    if not isinstance(inputs, dict):
+        inputs = {}
+    try:
+        score = int(float(profile_data.get('calibration_score') or 0))
+    except (TypeError, ValueError):
+        score = 0
+    voice = str(inputs.get('voice_dna') or '')
+    # Same per-cluster count as prompt_builder.get_cluster_status
+    voice_upper = voice.upper()
+    clusters = {name: voice_upper.count(f"CLUSTER: {name.upper()}") for name in VOICE_CLUSTER_NAMES}
+    return (
+        score,
+        sum(1 for k in ['wiz_name', 'wiz_mission', 'wiz_values', 'wiz_archetype'] if inputs.get(k)),
+        voice.count('[ASSET:'),
+        json.dumps(clusters),
+        _has_samples(voice),
+        any(bool(inputs.get(k)) for k in ['mh_brand_promise', 'mh_pillars_json', 'mh_boilerplate']),
+        _has_samples(str(inputs.get('visual_dna') or '')),
+        _has_samples(str(inputs.get('social_dna') or '')),
+        len(data_json or ''),
+    )
+
+
+def backfill_profile_summaries():
+    """Recompute summary columns for every stored profile. Returns rows updated."""
+    assignments = ", ".join(f"{name} = ?" for name in _SUMMARY_NAMES)
+    conn = _get_connection()
+    updated = 0
+    try:
+        rows = _execute_plain(conn, "SELECT id, data FROM profiles").fetchall()
+        for row in rows:
+            d = _dict_row(row)
+            try:
+                profile_data = json.loads(d['data']) if d['data'] else {}
+            except (TypeError, ValueError):
+                profile_data = {}
+            _execute_plain(conn, _q(f"UPDATE profiles SET {assignments} WHERE id = ?"),
+                           (*profile_summary(profile_data, d['data']), d['id']))
+            updated += 1
+        conn.commit()
+    finally:
+        conn.close()
+    return updated
+
+
 def save_profile(user_id, profile_name, profile_data):
     if not profile_name or not profile_name.strip():
         return False
@@ -641,24 +1456,32 @@ def save_profile(user_id, profile_name, profile_data):
     conn = _get_connection()
     try:
         org_id = _resolve_org_id(conn, user_id)
+        profile_data, _ = _externalize_profile(conn, profile_data)
         data_json = json.dumps(profile_data)
+        summary = profile_summary(profile_data, data_json)
+        summary_cols = ", ".join(_SUMMARY_NAMES)
+        summary_marks = ", ".join("?" * len(_SUMMARY_NAMES))
+
+        now = datetime.now().isoformat()
 
         if is_postgres():
-            _execute_plain(conn, '''
-                INSERT INTO profiles (org_id, name, data, created_at, updated_by)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (org_id, name) DO UPDATE SET data = %s, updated_by = %s
-            ''', (org_id, profile_name, data_json, datetime.now().isoformat(), user_id,
-                  data_json, user_id))
+            summary_updates = ", ".join(f"{name} = excluded.{name}" for name in _SUMMARY_NAMES)
+            _execute_plain(conn, _q(f'''
+                INSERT INTO profiles (org_id, name, data, created_at, updated_by, updated_at, {summary_cols})
+                VALUES (?, ?, ?, ?, ?, ?, {summary_marks})
+                ON CONFLICT (org_id, name) DO UPDATE SET data = excluded.data, updated_by = excluded.updated_by,
+                    updated_at = excluded.updated_at, {summary_updates}
+            '''), (org_id, profile_name, data_json, now, user_id, now, *summary))
         else:
-            conn.execute('''
-                INSERT OR REPLACE INTO profiles (org_id, name, data, created_at, updated_by)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (org_id, profile_name, data_json, datetime.now().isoformat(), user_id))
+            conn.execute(f'''
+                INSERT OR REPLACE INTO profiles (org_id, name, data, created_at, updated_by, updated_at, {summary_cols})
+                VALUES (?, ?, ?, ?, ?, ?, {summary_marks})
+            ''', (org_id, profile_name, data_json, now, user_id, now, *summary))
 
         conn.commit()
     finally:
         conn.close()
+    _notify_profile_saved()
 
 
 def get_profiles(username):
@@ -681,6 +1504,143 @@ def get_profiles(username):
         conn.close()
 
 
+# --- LAZY PROFILE LOADING ---
+# get_profiles() decodes every brand in the org. The app instead keeps a
+# LazyProfiles mapping in session state: names and summary fields come from
+# a projected index query, and full payloads are decoded on first access.
+
+PROFILE_SESSION_CACHE_MAX = int(os.environ.get("PROFILE_SESSION_CACHE_MAX", "8"))
+
+
+def get_profile_index(username):
+    """Lightweight listing of an org's profiles without decoding `data`.
+
+    Returns a list of dicts with name, id, calibration_score, is_sample_brand,
+    updated_at and data_bytes, in the same order get_profiles() yields names.
+    """
+    conn = _get_connection()
+    try:
+        org_id = _resolve_org_id(conn, username)
+        rows = _execute_plain(conn, _q('''
+            SELECT id, name, calibration_score, is_sample_brand,
+                   COALESCE(updated_at, created_at) AS updated_at, data_bytes
+            FROM profiles WHERE org_id = ? ORDER BY id
+        '''), (org_id,)).fetchall()
+
+        index = []
+        for row in rows:
+            if not isinstance(row, dict):
+                row = dict(zip(("id", "name", "calibration_score", "is_sample_brand",
+                                "updated_at", "data_bytes"), row))
+            try:
+                score = int(float(row["calibration_score"] or 0))
+            except (TypeError, ValueError):
+                score = 0
+            index.append({
+                "name": row["name"],
+                "id": row["id"],
+                "calibration_score": score,
+                "is_sample_brand": bool(row["is_sample_brand"]),
+                "updated_at": row["updated_at"],
+                "data_bytes": row["data_bytes"] or 0,
+            })
+        return index
+    finally:
+        conn.close()
+
+
+def get_profile(username, profile_name):
+    """Decode a single profile's full payload. Returns None if missing or unreadable."""
+    conn = _get_connection()
+    try:
+        org_id = _resolve_org_id(conn, username)
+        row = _execute_plain(
+            conn, _q("SELECT data FROM profiles WHERE org_id = ? AND name = ?"),
+            (org_id, profile_name)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    try:
+        return json.loads(row['data'] if isinstance(row, dict) else row[0])
+    except Exception:
+        return None
+
+
+class LazyProfiles(MutableMapping):
+    """Dict-like view of an org's profiles that decodes payloads on demand.
+
+    Iteration, len() and `in` only touch the index. Item access loads the
+    profile and keeps it in a small per-session LRU; assignments (made by the
+    app right before save_profile) go straight into that LRU.
+    """
+
+    def __init__(self, username, index=None, cache_size=None):
+        self.username = username
+        entries = index if index is not None else get_profile_index(username)
+        self._index = OrderedDict((e["name"], e) for e in entries)
+        self._cache = OrderedDict()
+        self._cache_size = max(1, cache_size or PROFILE_SESSION_CACHE_MAX)
+        self.hits = 0
+        self.loads = 0
+
+    def meta(self, name):
+        """Index entry for a profile (no decoding), or None."""
+        return self._index.get(name)
+
+    def _remember(self, name, value):
+        self._cache[name] = value
+        self._cache.move_to_end(name)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def __getitem__(self, name):
+        if name not in self._index:
+            raise KeyError(name)
+        if name in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(name)
+            return self._cache[name]
+        value = get_profile(self.username, name)
+        if value is None:
+            # Deleted or renamed by another org member, or the payload no longer
+            # decodes: forget it so iteration and `in` stop offering it.
+            del self._index[name]
+            raise KeyError(name)
+        self.loads += 1
+        self._remember(name, value)
+        return value
+
+    def __setitem__(self, name, value):
+        if name not in self._index:
+            self._index[name] = {"name": name, "id": None, "calibration_score": 0,
+                                 "is_sample_brand": False, "updated_at": None, "data_bytes": 0}
+        if isinstance(value, dict):
+            self._index[name]["calibration_score"] = value.get("calibration_score", 0)
+        self._remember(name, value)
+
+    def __delitem__(self, name):
+        del self._index[name]
+        self._cache.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return f"LazyProfiles({self.username!r}, {len(self._index)} profiles, {len(self._cache)} loaded)"
+
+
+def get_profiles_lazy(username):
+    """LazyProfiles for the org — the session-state replacement for get_profiles()."""
+    return LazyProfiles(username)
+
+
 def delete_profile(username, profile_name):
     conn = _get_connection()
     try:
@@ -718,9 +1678,11 @@ def load_sample_brand(username):
         data_json = json.dumps(SAMPLE_BRAND["profile_data"])
         _sample_true = "TRUE" if is_postgres() else "1"
         _execute_plain(conn, _q(f'''
-            INSERT INTO profiles (org_id, name, data, created_at, updated_by, is_sample_brand)
-            VALUES (?, ?, ?, ?, ?, {_sample_true})
-        '''), (org_id, profile_name, data_json, datetime.now().isoformat(), username))
+            INSERT INTO profiles (org_id, name, data, created_at, updated_by, is_sample_brand,
+                                  {", ".join(_SUMMARY_NAMES)})
+            VALUES (?, ?, ?, ?, ?, {_sample_true}, {", ".join("?" * len(_SUMMARY_NAMES))})
+        '''), (org_id, profile_name, data_json, datetime.now().isoformat(), username,
+              *profile_summary(SAMPLE_BRAND["profile_data"], data_json)))
         conn.commit()
         return True
     finally:
@@ -821,7 +1783,9 @@ def update_user_status(username, new_status):
     conn = _get_connection()
     try:
         _execute_plain(conn, _q("UPDATE users SET subscription_status = ? WHERE username = ?"), (new_status, username))
+        _publish_change(conn, "tier", username)
         conn.commit()
+        _invalidate_user_cache(username)
     finally:
         conn.close()
 
@@ -841,33 +1805,208 @@ def get_user_status(username):
 
 # --- 6. TIER & USAGE (new) ---
 
+# --- CHANGE VERSIONS ---
+# Append-only log of "this key changed" notices. Writers publish inside their
+# own transaction; process-local caches (e.g. the shared tier cache) poll for
+# ids above the last one they saw. The id is the version. On Postgres a writer
+# holding a lower id can commit after a higher one has been read, so pollers
+# also re-read notices from the last CHANGE_POLL_LAG_SECONDS.
+
+CHANGE_LOG_RETENTION_SECONDS = 24 * 3600
+CHANGE_POLL_LAG_SECONDS = int(os.environ.get("CHANGE_POLL_LAG_SECONDS", "30"))
+_local_change_count = 0  # Lets in-process pollers skip their rate limit after a local write
+
+
+def _publish_change(conn, scope, key=None):
+    """Record a change notice in the caller's transaction."""
+    global _local_change_count
+    _local_change_count += 1
+    now = datetime.now()
+    _execute_plain(conn, _q("INSERT INTO change_versions (scope, change_key, created_at) VALUES (?, ?, ?)"),
+                   (scope, key, now.isoformat()))
+    cutoff = datetime.fromtimestamp(now.timestamp() - CHANGE_LOG_RETENTION_SECONDS).isoformat()
+    _execute_plain(conn, _q("DELETE FROM change_versions WHERE created_at < ?"), (cutoff,))
+
+
+def publish_change(scope, key=None):
+    """Publish a change notice for `scope` (key=None means "everything in scope")."""
+    conn = _get_connection()
+    try:
+        _publish_change(conn, scope, key)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def local_change_count():
+    """Number of change notices published by this process (monotonic)."""
+    return _local_change_count
+
+
+def get_changes_since(scope, last_id=None, lag_seconds=None):
+    """Returns (latest_id, [keys changed after last_id]) for a scope.
+
+    With last_id=None only the current high-water mark is returned, so a new
+    poller starts from "now" rather than replaying history. A None key in the
+    list means the whole scope changed. Notices created within the last
+    CHANGE_POLL_LAG_SECONDS (or lag_seconds; 0 disables) are returned again even
+    at or below last_id (a late commit may hold a lower id), so callers must
+    treat repeats as harmless.
+    """
+    conn = _get_connection()
+    try:
+        if last_id is None:
+            latest = _fetchone_val(_execute_plain(conn, "SELECT COALESCE(MAX(id), 0) FROM change_versions"), 0)
+            return latest, []
+        lag = CHANGE_POLL_LAG_SECONDS if lag_seconds is None else lag_seconds
+        if lag:
+            recent = (datetime.now() - timedelta(seconds=lag)).isoformat()
+            rows = _execute_plain(conn, _q(
+                "SELECT id, scope, change_key FROM change_versions WHERE id > ? OR created_at >= ? ORDER BY id"),
+                (last_id, recent)).fetchall()
+        else:
+            rows = _execute_plain(
+                conn, _q("SELECT id, scope, change_key FROM change_versions WHERE id > ? ORDER BY id"),
+                (last_id,)).fetchall()
+    finally:
+        conn.close()
+    latest, keys = last_id, []
+    for row in rows:
+        row_id = row['id'] if isinstance(row, dict) else row[0]
+        row_scope = row['scope'] if isinstance(row, dict) else row[1]
+        latest = max(latest, row_id)
+        if row_scope == scope:
+            keys.append(row['change_key'] if isinstance(row, dict) else row[2])
+    return latest, keys
+
+
+# --- REQUEST-SCOPED USER CACHE ---
+# A single Streamlit rerun or webhook request resolves the same user several
+# times (tier, usage cap, brand limit, trial info). Inside a request scope
+# get_user_full() serves a snapshot after the first SELECT; every writer to
+# the users table drops the affected entry. Outside a scope nothing is cached.
+
+_user_request_cache = contextvars.ContextVar("user_request_cache", default=None)
+
+
+def begin_request_cache():
+    """Start a fresh user snapshot cache for the current context (e.g. each rerun)."""
+    return _user_request_cache.set({})
+
+
+def end_request_cache(token):
+    """Restore the context to how it was before begin_request_cache()."""
+    _user_request_cache.reset(token)
+
+
+@contextmanager
+def request_cache():
+    """`with db.request_cache():` — user snapshots shared for the block's duration."""
+    token = begin_request_cache()
+    try:
+        yield
+    finally:
+        end_request_cache(token)
+
+
+def _invalidate_user_cache(username=None):
+    """Drop one user's snapshot (or all of them) from the active request scope."""
+    cache = _user_request_cache.get()
+    if cache is None:
+        return
+    if username is None:
+        cache.clear()
+    else:
+        cache.pop(username, None)
+
+
 def get_user_full(username):
     """Returns all user fields as a dict, or None if user not found."""
+    cache = _user_request_cache.get()
+    if cache is not None and username in cache:
+        cached = cache[username]
+        return dict(cached) if cached is not None else None
+
     conn = _get_connection()
     try:
         result = _execute_plain(
             conn, _q("SELECT * FROM users WHERE username = ?"), (username,)).fetchone()
-        return _dict_row(result)
+        user = _dict_row(result)
+    finally:
+        conn.close()
+    if cache is not None:
+        cache[username] = dict(user) if user is not None else None
+    return user
+
+
+def _set_user_subscription(conn, username, tier, status, ls_sub_id=None, ls_variant_id=None, publish=True):
+    _execute_plain(conn, _q('''
+        UPDATE users SET
+            subscription_tier = ?,
+            subscription_status = ?,
+            lemon_squeezy_subscription_id = ?,
+            lemon_squeezy_variant_id = ?,
+            last_subscription_sync = ?
+        WHERE username = ?
+    '''), (tier, status, ls_sub_id, ls_variant_id, datetime.now().isoformat(), username))
+    if publish:
+        _publish_change(conn, "tier", username)
+
+
+def set_user_subscription(username, tier, status, ls_sub_id=None, ls_variant_id=None, publish=True):
+    """Updates subscription_tier, subscription_status, LS fields, and last_subscription_sync.
+
+    publish=False skips the tier change notice (caller knows tier and status
+    are unchanged, so no cached tier needs evicting).
+    """
+    conn = _get_connection()
+    try:
+        _set_user_subscription(conn, username, tier, status, ls_sub_id, ls_variant_id, publish)
+        conn.commit()
+        _invalidate_user_cache(username)
     finally:
         conn.close()
 
 
-def set_user_subscription(username, tier, status, ls_sub_id=None, ls_variant_id=None):
-    """Updates subscription_tier, subscription_status, LS fields, and last_subscription_sync."""
+def get_subscription_sync_candidates():
+    """Users eligible for Lemon Squeezy reconciliation (fields needed to diff only)."""
     conn = _get_connection()
     try:
-        _execute_plain(conn, _q('''
-            UPDATE users SET
-                subscription_tier = ?,
-                subscription_status = ?,
-                lemon_squeezy_subscription_id = ?,
-                lemon_squeezy_variant_id = ?,
-                last_subscription_sync = ?
-            WHERE username = ?
-        '''), (tier, status, ls_sub_id, ls_variant_id, datetime.now().isoformat(), username))
+        rows = _execute_plain(conn, '''
+            SELECT username, email, subscription_tier, subscription_status,
+                   lemon_squeezy_subscription_id, lemon_squeezy_variant_id,
+                   comp_expires_at, subscription_override_until, trial_start_date, trial_expired
+            FROM users WHERE email IS NOT NULL AND email <> ''
+        ''').fetchall()
+        return [_dict_row(r) for r in rows]
+    finally:
+        conn.close()
+
+
+def apply_subscription_sync(changes, unchanged=()):
+    """Apply a reconciliation diff in one transaction.
+
+    changes: iterable of (username, tier, status, ls_sub_id, ls_variant_id),
+    written through set_user_subscription's UPDATE (and tier change notices).
+    unchanged: usernames confirmed current; only last_subscription_sync moves.
+    """
+    changes, unchanged = list(changes), list(unchanged)
+    now = datetime.now().isoformat()
+    conn = _get_connection()
+    try:
+        for username, tier, status, ls_sub_id, ls_variant_id in changes:
+            _set_user_subscription(conn, username, tier, status, ls_sub_id, ls_variant_id)
+        for username in unchanged:
+            _execute_plain(conn, _q("UPDATE users SET last_subscription_sync = ? WHERE username = ?"),
+                           (now, username))
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
+    for username in [c[0] for c in changes] + unchanged:
+        _invalidate_user_cache(username)
 
 
 def get_org_tier(org_id):
@@ -889,19 +2028,121 @@ def get_org_tier(org_id):
         conn.close()
 
 
-def count_user_brands(org_id, exclude_sample=True):
-    """Count profiles belonging to an org, optionally excluding sample brands."""
+def count_brands_by_org(exclude_sample=True):
+    """{org_id: brand count} for every org in one query, optionally excluding sample brands."""
+    conn = _get_connection()
+    try:
+        where = ""
+        if exclude_sample:
+            _false_val = "FALSE" if is_postgres() else "0"
+            where = f"WHERE is_sample_brand = {_false_val} OR is_sample_brand IS NULL"
+        rows = _execute_plain(
+            conn, f"SELECT org_id, COUNT(*) as cnt FROM profiles {where} GROUP BY org_id").fetchall()
+        return {_dict_row(r)['org_id']: _dict_row(r)['cnt'] for r in rows}
+    finally:
+        conn.close()
+
+
+def count_user_brands(org_id, exclude_sample=True):
+    """Count profiles belonging to an org, optionally excluding sample brands."""
+    conn = _get_connection()
+    try:
+        if exclude_sample:
+            _false_val = "FALSE" if is_postgres() else "0"
+            count = _fetchone_val(_execute_plain(
+                conn, _q(f"SELECT COUNT(*) FROM profiles WHERE org_id = ? AND (is_sample_brand = {_false_val} OR is_sample_brand IS NULL)"),
+                (org_id,)), 0)
+        else:
+            count = _fetchone_val(_execute_plain(
+                conn, _q("SELECT COUNT(*) FROM profiles WHERE org_id = ?"), (org_id,)), 0)
+        return count
+    finally:
+        conn.close()
+
+
+# --- USAGE COUNTERS ---
+# usage_counters keeps one running total per (scope, scope_id, billing_month,
+# is_impersonated), bumped in the same transaction as each usage_tracking
+# insert, so soft-cap checks read a single row instead of summing the month.
+# scope is 'user' (keyed by username) or 'org' (keyed by org_id).
+
+_USAGE_COUNTERS_KEY = "usage_counters_backfilled"
+
+
+def _bump_usage_counters(conn, username, org_id, action_weight, billing_month, impersonated=False):
+    """UPSERT the user and org counters for one recorded action."""
+    weight = action_weight if action_weight is not None else 0
+    scopes = [("user", username)] + ([("org", org_id)] if org_id else [])
+    for scope, scope_id in scopes:
+        _execute_plain(conn, _q('''
+            INSERT INTO usage_counters (scope, scope_id, billing_month, is_impersonated, total_weight, action_count)
+            VALUES (?, ?, ?, ?, ?, 1)
+            ON CONFLICT (scope, scope_id, billing_month, is_impersonated) DO UPDATE SET
+                total_weight = usage_counters.total_weight + excluded.total_weight,
+                action_count = usage_counters.action_count + 1
+        '''), (scope, scope_id, billing_month, 1 if impersonated else 0, weight))
+
+
+_COUNTER_SCOPES = {"user": "username", "org": "org_id"}
+
+
+def _insert_usage_counters(conn, scope, where, params):
+    """INSERT counter rows for one scope, summed from usage_tracking rows matching where."""
+    key_col = _COUNTER_SCOPES[scope]
+    _execute_plain(conn, _q(f'''
+        INSERT INTO usage_counters (scope, scope_id, billing_month, is_impersonated, total_weight, action_count)
+        SELECT '{scope}', {key_col}, billing_month,
+               CASE WHEN is_impersonated THEN 1 ELSE 0 END,
+               COALESCE(SUM(action_weight), 0), COUNT(*)
+        FROM usage_tracking
+        WHERE {key_col} IS NOT NULL AND {key_col} <> ''{where}
+        GROUP BY {key_col}, billing_month, CASE WHEN is_impersonated THEN 1 ELSE 0 END
+    '''), params or None)
+
+
+def _rebuild_usage_counters(conn, billing_month=None):
+    """Recompute counters from usage_tracking inside the caller's transaction."""
+    month_filter = " AND billing_month = ?" if billing_month else ""
+    params = (billing_month,) if billing_month else ()
+    _execute_plain(conn, _q("DELETE FROM usage_counters WHERE 1 = 1" + month_filter), params or None)
+    for scope in _COUNTER_SCOPES:
+        _insert_usage_counters(conn, scope, month_filter, params)
+
+
+def _rebuild_scope_counters(conn, scope, scope_id):
+    """Recompute every month's counters for one user or org (caller's transaction)."""
+    _execute_plain(conn, _q("DELETE FROM usage_counters WHERE scope = ? AND scope_id = ?"), (scope, scope_id))
+    _insert_usage_counters(conn, scope, f" AND {_COUNTER_SCOPES[scope]} = ?", (scope_id,))
+
+
+def rebuild_usage_counters(billing_month=None):
+    """Repair drift by recomputing usage_counters from usage_tracking.
+
+    Rebuilds one billing month when given, otherwise every month.
+    Returns the number of counter rows written.
+    """
+    conn = _get_connection()
+    try:
+        _rebuild_usage_counters(conn, billing_month)
+        month_filter = " WHERE billing_month = ?" if billing_month else ""
+        count = _fetchone_val(_execute_plain(
+            conn, _q("SELECT COUNT(*) FROM usage_counters" + month_filter),
+            (billing_month,) if billing_month else None), 0)
+        conn.commit()
+        return count
+    finally:
+        conn.close()
+
+
+def get_usage_counter(scope, scope_id, billing_month, include_impersonated=False):
+    """Returns the month's total action_weight for a 'user' or 'org' scope."""
+    imp_filter = "" if include_impersonated else " AND is_impersonated = 0"
     conn = _get_connection()
     try:
-        if exclude_sample:
-            _false_val = "FALSE" if is_postgres() else "0"
-            count = _fetchone_val(_execute_plain(
-                conn, _q(f"SELECT COUNT(*) FROM profiles WHERE org_id = ? AND (is_sample_brand = {_false_val} OR is_sample_brand IS NULL)"),
-                (org_id,)), 0)
-        else:
-            count = _fetchone_val(_execute_plain(
-                conn, _q("SELECT COUNT(*) FROM profiles WHERE org_id = ?"), (org_id,)), 0)
-        return count
+        return _fetchone_val(_execute_plain(
+            conn, _q("SELECT COALESCE(SUM(total_weight), 0) FROM usage_counters "
+                     "WHERE scope = ? AND scope_id = ? AND billing_month = ?" + imp_filter),
+            (scope, scope_id, billing_month)), 0)
     finally:
         conn.close()
 
@@ -914,6 +2155,7 @@ def record_usage_action(username, org_id, module, action_weight, billing_month,
             INSERT INTO usage_tracking (username, org_id, module, action_weight, billing_month, action_detail)
             VALUES (?, ?, ?, ?, ?, ?)
         '''), (username, org_id, module, action_weight, billing_month, action_detail))
+        _bump_usage_counters(conn, username, org_id, action_weight, billing_month)
         conn.commit()
     finally:
         conn.close()
@@ -921,24 +2163,12 @@ def record_usage_action(username, org_id, module, action_weight, billing_month,
 
 def get_monthly_usage(org_id, billing_month):
     """Returns total action_weight for an org in a billing month (agency/enterprise)."""
-    conn = _get_connection()
-    try:
-        return _fetchone_val(_execute_plain(
-            conn, _q("SELECT COALESCE(SUM(action_weight), 0) FROM usage_tracking WHERE org_id = ? AND billing_month = ?"),
-            (org_id, billing_month)), 0)
-    finally:
-        conn.close()
+    return get_usage_counter("org", org_id, billing_month, include_impersonated=True)
 
 
 def get_monthly_usage_user(username, billing_month):
     """Returns total action_weight for a solo user in a billing month."""
-    conn = _get_connection()
-    try:
-        return _fetchone_val(_execute_plain(
-            conn, _q("SELECT COALESCE(SUM(action_weight), 0) FROM usage_tracking WHERE username = ? AND billing_month = ?"),
-            (username, billing_month)), 0)
-    finally:
-        conn.close()
+    return get_usage_counter("user", username, billing_month, include_impersonated=True)
 
 
 def create_organization(org_id, org_name, tier, owner_username):
@@ -982,6 +2212,7 @@ def remove_org_member(username):
             conn, _q("UPDATE users SET org_id = NULL, org_role = 'member' WHERE username = ?"),
             (username,))
         conn.commit()
+        _invalidate_user_cache(username)
     finally:
         conn.close()
 
@@ -1054,7 +2285,9 @@ def update_user_fields(username, **fields):
     conn = _get_connection()
     try:
         _execute_plain(conn, _q(f"UPDATE users SET {set_clause} WHERE username = ?"), values)
+        _publish_change(conn, "tier", username)
         conn.commit()
+        _invalidate_user_cache(username)
         return True
     finally:
         conn.close()
@@ -1067,6 +2300,7 @@ def reset_user_password(username, new_password):
     try:
         _execute_plain(conn, _q("UPDATE users SET password_hash = ? WHERE username = ?"), (hashed, username))
         conn.commit()
+        _invalidate_user_cache(username)
         return True
     finally:
         conn.close()
@@ -1143,37 +2377,33 @@ def set_trial_start(username):
         _execute_plain(conn, _q(
             "UPDATE users SET trial_start_date = ?, subscription_status = 'active' WHERE username = ?"
         ), (datetime.now().isoformat(), username))
+        _publish_change(conn, "tier", username)
         conn.commit()
+        _invalidate_user_cache(username)
     finally:
         conn.close()
 
 
 def get_trial_info(username):
     """Returns dict with trial_start_date, trial_expired, days_remaining."""
-    conn = _get_connection()
+    row = get_user_full(username)
+    if not row:
+        return None
+    tsd = row.get('trial_start_date')
+    te = row.get('trial_expired')
+    if not tsd:
+        return {"trial_start_date": None, "trial_expired": bool(te), "days_remaining": 0}
     try:
-        row = _execute_plain(conn, _q(
-            "SELECT trial_start_date, trial_expired FROM users WHERE username = ?"
-        ), (username,)).fetchone()
-        if not row:
-            return None
-        tsd = row['trial_start_date'] if isinstance(row, dict) else row[0]
-        te = row['trial_expired'] if isinstance(row, dict) else row[1]
-        if not tsd:
-            return {"trial_start_date": None, "trial_expired": bool(te), "days_remaining": 0}
-        try:
-            start = datetime.fromisoformat(str(tsd).replace('Z', ''))
-            elapsed = (datetime.now() - start).days
-            remaining = max(0, 14 - elapsed)
-            return {
-                "trial_start_date": str(tsd),
-                "trial_expired": bool(te) or remaining <= 0,
-                "days_remaining": remaining,
-            }
-        except (ValueError, TypeError):
-            return {"trial_start_date": None, "trial_expired": bool(te), "days_remaining": 0}
-    finally:
-        conn.close()
+        start = datetime.fromisoformat(str(tsd).replace('Z', ''))
+        elapsed = (datetime.now() - start).days
+        remaining = max(0, TRIAL_DAYS - elapsed)
+        return {
+            "trial_start_date": str(tsd),
+            "trial_expired": bool(te) or remaining <= 0,
+            "days_remaining": remaining,
+        }
+    except (ValueError, TypeError):
+        return {"trial_start_date": None, "trial_expired": bool(te), "days_remaining": 0}
 
 
 def expire_trial(username):
@@ -1184,7 +2414,9 @@ def expire_trial(username):
         _execute_plain(conn, _q(
             f"UPDATE users SET trial_expired = {_used_true}, subscription_status = 'inactive' WHERE username = ?"
         ), (username,))
+        _publish_change(conn, "tier", username)
         conn.commit()
+        _invalidate_user_cache(username)
     finally:
         conn.close()
 
@@ -1218,6 +2450,7 @@ def suspend_user(username, reason, admin_username):
             f"UPDATE users SET is_suspended = {_suspended_true}, suspended_at = ?, suspended_reason = ?, suspended_by = ? WHERE username = ?"),
             (datetime.now().isoformat(), reason, admin_username, username))
         conn.commit()
+        _invalidate_user_cache(username)
         return True
     finally:
         conn.close()
@@ -1232,6 +2465,7 @@ def unsuspend_user(username):
             f"UPDATE users SET is_suspended = {_suspended_false}, suspended_at = NULL, suspended_reason = NULL, suspended_by = NULL WHERE username = ?"),
             (username,))
         conn.commit()
+        _invalidate_user_cache(username)
         return True
     finally:
         conn.close()
@@ -1318,9 +2552,18 @@ def delete_user_full(username):
         else:
             _execute_plain(conn, _q("DELETE FROM profiles WHERE org_id = ?"), (username,))
 
+        # The user's rows also fed the counters of every org they recorded under
+        usage_orgs = [r['org_id'] if isinstance(r, dict) else r[0] for r in _execute_plain(
+            conn, _q("SELECT DISTINCT org_id FROM usage_tracking "
+                     "WHERE username = ? AND org_id IS NOT NULL AND org_id <> ''"), (username,)).fetchall()]
         _execute_plain(conn, _q("DELETE FROM usage_tracking WHERE username = ?"), (username,))
+        _execute_plain(conn, _q("DELETE FROM usage_counters WHERE scope = 'user' AND scope_id = ?"), (username,))
+        for usage_org in usage_orgs:
+            _rebuild_scope_counters(conn, "org", usage_org)
         _execute_plain(conn, _q("DELETE FROM users WHERE username = ?"), (username,))
+        _publish_change(conn, "tier", username)
         conn.commit()
+        _invalidate_user_cache(username)
         return {"deleted": True, "reason": "OK", "org_cleaned": org_id}
     finally:
         conn.close()
@@ -1343,6 +2586,7 @@ def delete_organization_full(org_id):
         _execute_plain(conn, _q("UPDATE users SET org_id = NULL, org_role = 'member' WHERE org_id = ?"), (org_id,))
         _execute_plain(conn, _q("DELETE FROM organizations WHERE org_id = ?"), (org_id,))
         conn.commit()
+        _invalidate_user_cache()
         return {"deleted": True, "member_count": member_count, "brands_reassigned_to": owner}
     finally:
         conn.close()
@@ -1497,6 +2741,7 @@ def record_usage_action_impersonated(username, org_id, module, action_weight, bi
             INSERT INTO usage_tracking (username, org_id, module, action_weight, billing_month, is_impersonated, action_detail)
             VALUES (?, ?, ?, ?, ?, {_imp_true}, ?)
         '''), (username, org_id, module, action_weight, billing_month, action_detail))
+        _bump_usage_counters(conn, username, org_id, action_weight, billing_month, impersonated=True)
         conn.commit()
     finally:
         conn.close()
@@ -1509,6 +2754,7 @@ def update_last_login(username):
         _execute_plain(conn, _q("UPDATE users SET last_login = ? WHERE username = ?"),
                        (datetime.now().isoformat(), username))
         conn.commit()
+        _invalidate_user_cache(username)
     finally:
         conn.close()
 
@@ -1517,8 +2763,8 @@ def get_table_row_counts():
     """Returns dict of table_name -> row_count for admin health check."""
     conn = _get_connection()
     try:
-        tables = ['users', 'profiles', 'usage_tracking', 'organizations',
-                  'activity_log', 'admin_audit_log', 'platform_settings', 'product_events']
+        tables = ['users', 'profiles', 'profile_assets', 'usage_tracking', 'usage_counters', 'organizations',
+                  'activity_log', 'admin_audit_log', 'platform_settings', 'product_events', 'change_versions']
         counts = {}
         for t in tables:
             try:
@@ -1542,30 +2788,345 @@ _API_PRICING = {
 }
 
 
-def estimate_api_cost(input_tokens, output_tokens, model="claude-opus-4-6"):
-    """Estimate USD cost from Anthropic API token usage."""
+# Prompt caching: 5-minute cache writes bill at 1.25x base input, reads at 0.1x
+_CACHE_WRITE_MULTIPLIER = 1.25
+_CACHE_READ_MULTIPLIER = 0.10
+
+
+def estimate_api_cost(input_tokens, output_tokens, model="claude-opus-4-6",
+                      cache_creation_input_tokens=0, cache_read_input_tokens=0):
+    """Estimate USD cost from Anthropic API token usage.
+
+    input_tokens is the uncached input only (as the API reports it); cache
+    writes and reads are priced separately.
+    """
     pricing = _API_PRICING.get(model, _API_PRICING["claude-opus-4-6"])
-    cost = (input_tokens / 1_000_000 * pricing["input_per_m"]) + \
+    input_per_token = pricing["input_per_m"] / 1_000_000
+    cost = (input_tokens * input_per_token) + \
+           ((cache_creation_input_tokens or 0) * input_per_token * _CACHE_WRITE_MULTIPLIER) + \
+           ((cache_read_input_tokens or 0) * input_per_token * _CACHE_READ_MULTIPLIER) + \
            (output_tokens / 1_000_000 * pricing["output_per_m"])
     return round(cost, 6)
 
 
+# Every event_type the app records (track_event / check_milestone call sites),
+# for export filters. Keep in step when adding a new event.
+PRODUCT_EVENT_TYPES = (
+    "api_cost", "brand_created", "brand_deleted", "calibration_change", "module_action",
+    "onboarding_step", "output_feedback", "page_view", "sample_deleted", "sample_uploaded",
+    "session_start", "strategy_updated", "subscription_cancelled", "subscription_changed",
+    "user_registered",
+)
+
+# Typed copies of the metadata_json keys analytics filter and aggregate on,
+# filled at insert time so queries use plain (indexable) columns instead of
+# parsing JSON per row. confidence holds engine_confidence (feedback and
+# module events); new_score holds the calibration score on calibration_change.
+PRODUCT_EVENT_COLUMNS = [
+    ("module", "TEXT"),
+    ("model", "TEXT"),
+    ("input_tokens", "INTEGER"),
+    ("output_tokens", "INTEGER"),
+    ("cost_usd", "{real}"),
+    ("step", "TEXT"),
+    ("rating", "TEXT"),
+    ("confidence", "{real}"),
+    ("new_score", "{real}"),
+]
+_EVENT_COLUMN_NAMES = [name for name, _ in PRODUCT_EVENT_COLUMNS]
+_EVENT_COLUMNS_KEY = "product_event_columns_backfilled"
+
+_EVENT_INSERT_SQL = f"""INSERT INTO product_events
+    (event_type, username, org_id, brand_id, metadata_json, session_id, timestamp,
+     {", ".join(_EVENT_COLUMN_NAMES)})
+    VALUES (?, ?, ?, ?, ?, ?, ?, {", ".join("?" * len(_EVENT_COLUMN_NAMES))})"""
+
+
+def _as_number(value, cast):
+    if value is None or value == "":
+        return None
+    try:
+        return cast(float(value)) if cast is int else cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_text(value):
+    return None if value is None or value == "" else str(value)
+
+
+def event_columns(metadata):
+    """Typed column values for an event's metadata, in PRODUCT_EVENT_COLUMNS order."""
+    if not isinstance(metadata, dict):
+        return (None,) * len(_EVENT_COLUMN_NAMES)
+    return (
+        _as_text(metadata.get("module")),
+        _as_text(metadata.get("model")),
+        _as_number(metadata.get("input_tokens"), int),
+        _as_number(metadata.get("output_tokens"), int),
+        _as_number(metadata.get("estimated_cost_usd"), float),
+        _as_text(metadata.get("step")),
+        _as_text(metadata.get("rating")),
+        _as_number(metadata.get("engine_confidence"), float),
+        _as_number(metadata.get("new_score"), float),
+    )
+
+
+def backfill_event_columns(batch_size=5000):
+    """Fill typed columns from metadata_json for events that have none set. Returns rows updated."""
+    all_null = " AND ".join(f"{name} IS NULL" for name in _EVENT_COLUMN_NAMES)
+    assignments = ", ".join(f"{name} = ?" for name in _EVENT_COLUMN_NAMES)
+    updated, last_id = 0, 0
+    conn = _get_connection()
+    try:
+        while True:
+            rows = _execute_plain(conn, _q(f"""
+                SELECT id, metadata_json FROM product_events
+                WHERE id > ? AND metadata_json IS NOT NULL AND {all_null}
+                ORDER BY id LIMIT ?
+            """), (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            params = []
+            for row in rows:
+                d = _dict_row(row)
+                last_id = d['id']
+                try:
+                    values = event_columns(json.loads(d['metadata_json']))
+                except (TypeError, ValueError):
+                    continue
+                if any(v is not None for v in values):
+                    params.append((*values, d['id']))
+            if params:
+                sql = _q(f"UPDATE product_events SET {assignments} WHERE id = ?")
+                if is_postgres():
+                    conn.cursor().executemany(sql, params)
+                else:
+                    conn.executemany(sql, params)
+                conn.commit()
+                updated += len(params)
+            if len(rows) < batch_size:
+                break
+    finally:
+        conn.close()
+    return updated
+
+
+def _utc_timestamp():
+    """Timestamp in the same UTC format CURRENT_TIMESTAMP produces."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class _EventWriter:
+    """Background sink for product_events.
+
+    Events go into a bounded in-process queue; a daemon thread drains it and
+    writes batches of up to EVENT_BATCH_SIZE rows with executemany, at least
+    every EVENT_FLUSH_INTERVAL_MS. Onboarding milestones are de-duplicated
+    against a per-user set of completed steps, seeded from the DB the first
+    time the worker sees that user. A full queue drops events (counted in
+    stats) rather than blocking the page render.
+    """
+
+    _MILESTONE = "milestone"
+    _FLUSH = "flush"
+    _STOP = "stop"
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=EVENT_QUEUE_MAX)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._steps_done = {}  # username -> set of step names (seeded users only)
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "dropped": 0, "failed": 0}
+
+    # -- producer side (request path) --
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="product-event-writer", daemon=True)
+                self._thread.start()
+
+    def _put(self, item):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+            with self._lock:
+                self.stats["enqueued"] += 1
+        except queue.Full:
+            with self._lock:
+                self.stats["dropped"] += 1
+            logging.warning("Product event queue full — dropping event")
+
+    def enqueue_event(self, row):
+        self._put(("event", row))
+
+    def milestone_known(self, username, step_name):
+        with self._lock:
+            return step_name in self._steps_done.get(username, ())
+
+    def enqueue_milestone(self, username, step_name, row):
+        self._put((self._MILESTONE, (username, step_name, row)))
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far is written. Returns True if drained."""
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        done = threading.Event()
+        try:
+            self._queue.put((self._FLUSH, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def shutdown(self, timeout=5.0):
+        """Drain the queue and stop the worker (registered with atexit)."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put((self._STOP, None), timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def forget_milestones(self):
+        with self._lock:
+            self._steps_done.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["queued"] = self._queue.qsize()
+        stats["async"] = EVENT_WRITER_ASYNC
+        return stats
+
+    # -- consumer side (worker thread) --
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, signals, stop = [], [], False
+            deadline = time.monotonic() + EVENT_FLUSH_INTERVAL_MS / 1000.0
+            while True:
+                kind, payload = item
+                if kind == self._FLUSH:
+                    signals.append(payload)
+                    break
+                if kind == self._STOP:
+                    stop = True
+                    # Drain whatever is already queued, then exit
+                    while True:
+                        try:
+                            kind, payload = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if kind == self._FLUSH:
+                            signals.append(payload)
+                        elif kind != self._STOP:
+                            batch.append((kind, payload))
+                    break
+                batch.append(item)
+                if len(batch) >= EVENT_BATCH_SIZE:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self.write_batch(batch)
+            for sig in signals:
+                sig.set()
+            if stop:
+                return
+
+    def _seed_steps(self, conn, username):
+        """Load a user's completed onboarding steps once per process."""
+        with self._lock:
+            if username in self._steps_done:
+                return
+        rows = _execute_plain(conn, _q(
+            "SELECT step, CASE WHEN step IS NULL THEN metadata_json END AS metadata_json "
+            "FROM product_events WHERE event_type='onboarding_step' AND username=?"),
+            (username,)).fetchall()
+        steps = set()
+        for r in rows:
+            step, raw = (r['step'], r['metadata_json']) if isinstance(r, dict) else (r[0], r[1])
+            if step is None and raw:
+                # Row written before the typed step column existed
+                try:
+                    step = json.loads(raw).get("step")
+                except (json.JSONDecodeError, TypeError, AttributeError):
+                    step = None
+            if step:
+                steps.add(step)
+        with self._lock:
+            self._steps_done.setdefault(username, set()).update(steps)
+
+    def write_batch(self, batch):
+        """Insert a batch of ("event", row) / ("milestone", ...) items in one transaction."""
+        claimed = []  # milestones marked done in this batch — undone on failure
+        try:
+            conn = _get_connection()
+            try:
+                rows = []
+                for kind, payload in batch:
+                    if kind == self._MILESTONE:
+                        username, step_name, row = payload
+                        self._seed_steps(conn, username)
+                        with self._lock:
+                            done = self._steps_done.setdefault(username, set())
+                            if step_name in done:
+                                continue
+                            done.add(step_name)
+                        claimed.append((username, step_name))
+                        rows.append(row)
+                    else:
+                        rows.append(payload)
+                if rows:
+                    cur = conn.cursor()
+                    if is_postgres():
+                        from psycopg2.extras import execute_values
+                        execute_values(cur, _EVENT_INSERT_SQL.split("VALUES")[0] + "VALUES %s", rows)
+                    else:
+                        cur.executemany(_EVENT_INSERT_SQL, rows)
+                    conn.commit()
+            finally:
+                conn.close()
+            with self._lock:
+                self.stats["written"] += len(rows)
+                self.stats["batches"] += 1
+        except Exception as e:
+            with self._lock:
+                self.stats["failed"] += len(batch)
+                for username, step_name in claimed:
+                    self._steps_done.get(username, set()).discard(step_name)
+            logging.warning(f"Event batch write failed ({len(batch)} events): {e}")
+
+
+_event_writer = _EventWriter()
+atexit.register(_event_writer.shutdown)
+
+
 def track_event(event_type, username, metadata=None, brand_id=None,
                 session_id=None, org_id=None):
-    """Record a product analytics event. Fails silently — tracking never breaks the app."""
+    """Record a product analytics event. Fails silently — tracking never breaks the app.
+
+    Queued for the background writer; call flush_events() to wait for it.
+    """
     try:
-        conn = _get_connection()
-        try:
-            _execute_plain(conn, _q(
-                """INSERT INTO product_events
-                   (event_type, username, org_id, brand_id, metadata_json, session_id)
-                   VALUES (?, ?, ?, ?, ?, ?)"""),
-                (event_type, username, org_id, brand_id,
-                 json.dumps(metadata) if metadata else None,
-                 session_id))
-            conn.commit()
-        finally:
-            conn.close()
+        row = (event_type, username, org_id, brand_id,
+               json.dumps(metadata) if metadata else None,
+               session_id, _utc_timestamp(), *event_columns(metadata))
+        if EVENT_WRITER_ASYNC:
+            _event_writer.enqueue_event(row)
+        else:
+            _event_writer.write_batch([("event", row)])
     except Exception as e:
         logging.warning(f"Event tracking failed ({event_type}): {e}")
 
@@ -1573,26 +3134,287 @@ def track_event(event_type, username, metadata=None, brand_id=None,
 def check_milestone(username, step_name, session_id=None, org_id=None):
     """Fire onboarding milestone only if not already recorded for this user."""
     try:
+        if _event_writer.milestone_known(username, step_name):
+            return
+        metadata = {"step": step_name}
+        row = ("onboarding_step", username, org_id, None,
+               json.dumps(metadata), session_id, _utc_timestamp(), *event_columns(metadata))
+        item = (username, step_name, row)
+        if EVENT_WRITER_ASYNC:
+            _event_writer.enqueue_milestone(*item)
+        else:
+            _event_writer.write_batch([("milestone", item)])
+    except Exception:
+        pass
+
+
+def flush_events(timeout=5.0):
+    """Wait until queued product events are written. Returns True if fully drained."""
+    return _event_writer.flush(timeout)
+
+
+def get_event_writer_stats():
+    """Returns background event writer counters for the admin System Health tab."""
+    return _event_writer.get_stats()
+
+
+# ── Analytics rollups ─────────────────────────────────────────────────────────
+# analytics_user_daily (day, username) and analytics_module_daily (day, module,
+# username) hold per-day aggregates of product_events. refresh_analytics_rollups
+# folds in only events past a watermark (the last processed id), so its cost
+# tracks new events, not table size. Dashboard readers take closed days from the
+# rollups and aggregate just today's events (plus any the job has not reached
+# yet) from product_events — see _rollup_source. run_migrations does the initial
+# fold; analytics_worker.py (started by start.sh) refreshes on an interval.
+#
+# Ids are not committed in order when several processes write events (a SERIAL
+# id taken by a slow transaction can appear after higher ids), so the watermark
+# only advances over events older than ANALYTICS_ROLLUP_LAG_SECONDS. Anything
+# newer stays past the watermark and is read raw until a later refresh.
+
+ANALYTICS_ROLLUP_BATCH = int(os.environ.get("ANALYTICS_ROLLUP_BATCH", "5000"))
+ANALYTICS_ROLLUP_LAG_SECONDS = int(os.environ.get("ANALYTICS_ROLLUP_LAG_SECONDS", "300"))
+ROLLUP_WATERMARK_KEY = "analytics_rollup_watermark"
+_ROLLUP_INITIAL_KEY = "analytics_rollups_initialized"
+_ROLLUP_USER_EVENTS = ("module_action", "session_start")
+_ROLLUP_MODULE_EVENTS = ("module_action", "api_cost", "output_feedback")
+_ROLLUP_USER_COLS = ("module_actions", "sessions", "last_action_at")
+_ROLLUP_MODULE_COLS = ("actions", "cost_events", "cost_usd", "input_tokens", "output_tokens",
+                       "feedback_yes", "feedback_close", "feedback_no")
+_rollup_lock = threading.Lock()
+
+
+def _event_day(ts):
+    """'YYYY-MM-DD' for a product_events timestamp (str on SQLite, datetime on Postgres)."""
+    return ts.strftime("%Y-%m-%d") if isinstance(ts, datetime) else str(ts)[:10]
+
+
+def _event_ts_text(ts):
+    return ts.strftime("%Y-%m-%d %H:%M:%S") if isinstance(ts, datetime) else str(ts)
+
+
+def _fold_rollup_events(rows):
+    """Aggregate raw event rows into {(day, username): {...}} and {(day, module, username): {...}}."""
+    users, modules = {}, {}
+    for row in rows:
+        d = _dict_row(row)
+        etype, username, ts = d["event_type"], d["username"] or "", d["timestamp"]
+        if ts is None:
+            continue
+        day = _event_day(ts)
+
+        if etype in _ROLLUP_USER_EVENTS:
+            u = users.setdefault((day, username), {"module_actions": 0, "sessions": 0, "last_action_at": None})
+            if etype == "session_start":
+                u["sessions"] += 1
+            else:
+                u["module_actions"] += 1
+                ts_text = _event_ts_text(ts)
+                if u["last_action_at"] is None or ts_text > u["last_action_at"]:
+                    u["last_action_at"] = ts_text
+
+        if etype in _ROLLUP_MODULE_EVENTS:
+            key = (day, d["module"] or "", username)
+            m = modules.setdefault(key, dict.fromkeys(_ROLLUP_MODULE_COLS, 0))
+            if etype == "module_action":
+                m["actions"] += 1
+            elif etype == "api_cost":
+                m["cost_events"] += 1
+                m["cost_usd"] += d["cost_usd"] or 0.0
+                m["input_tokens"] += d["input_tokens"] or 0
+                m["output_tokens"] += d["output_tokens"] or 0
+            elif d["rating"] in ("yes", "close", "no"):
+                m["feedback_" + d["rating"]] += 1
+    return users, modules
+
+
+def _apply_rollup_batch(conn, watermark, batch_size):
+    """Fold one batch past `watermark` into the rollups. Returns (events, new_watermark).
+
+    The batch stops at the first event newer than the safety lag, so the
+    watermark never passes an id that a still-open transaction may commit.
+    """
+    event_types = _ROLLUP_USER_EVENTS + tuple(t for t in _ROLLUP_MODULE_EVENTS if t not in _ROLLUP_USER_EVENTS)
+    rows = _execute_plain(conn, _q(f'''
+        SELECT id, event_type, username, timestamp, module, rating, cost_usd, input_tokens, output_tokens
+        FROM product_events
+        WHERE id > ? AND event_type IN ({", ".join("?" * len(event_types))})
+        ORDER BY id LIMIT ?
+    '''), (watermark, *event_types, batch_size)).fetchall()
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=ANALYTICS_ROLLUP_LAG_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+    for i, row in enumerate(rows):
+        ts = _dict_row(row)["timestamp"]
+        if ts is not None and _event_ts_text(ts) > cutoff:
+            rows = rows[:i]
+            break
+    if not rows:
+        return 0, watermark
+    new_watermark = _dict_row(rows[-1])["id"]
+    users, modules = _fold_rollup_events(rows)
+
+    for (day, username), u in users.items():
+        _execute_plain(conn, _q('''
+            INSERT INTO analytics_user_daily (day, username, module_actions, sessions, last_action_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (day, username) DO UPDATE SET
+                module_actions = analytics_user_daily.module_actions + excluded.module_actions,
+                sessions = analytics_user_daily.sessions + excluded.sessions,
+                last_action_at = CASE
+                    WHEN analytics_user_daily.last_action_at IS NULL
+                         OR excluded.last_action_at > analytics_user_daily.last_action_at
+                    THEN excluded.last_action_at ELSE analytics_user_daily.last_action_at END
+        '''), (day, username, u["module_actions"], u["sessions"], u["last_action_at"]))
+
+    updates = ", ".join(f"{c} = analytics_module_daily.{c} + excluded.{c}" for c in _ROLLUP_MODULE_COLS)
+    for (day, module, username), m in modules.items():
+        _execute_plain(conn, _q(f'''
+            INSERT INTO analytics_module_daily (day, module, username, {", ".join(_ROLLUP_MODULE_COLS)})
+            VALUES (?, ?, ?, {", ".join("?" * len(_ROLLUP_MODULE_COLS))})
+            ON CONFLICT (day, module, username) DO UPDATE SET {updates}
+        '''), (day, module, username, *(m[c] for c in _ROLLUP_MODULE_COLS)))
+
+    # Compare-and-set the watermark so a concurrent refresh in another
+    # process cannot fold the same events twice
+    now = datetime.now().isoformat()
+    if watermark:
+        moved = _execute_plain(conn, _q(
+            "UPDATE platform_settings SET value = ?, updated_at = ?, updated_by = 'analytics_rollup' "
+            "WHERE key = ? AND value = ?"), (str(new_watermark), now, ROLLUP_WATERMARK_KEY, str(watermark)))
+        if moved.rowcount != 1:
+            raise RuntimeError("analytics rollup watermark moved concurrently")
+    else:
+        _execute_plain(conn, _q(
+            "INSERT INTO platform_settings (key, value, updated_at, updated_by) "
+            "VALUES (?, ?, ?, 'analytics_rollup')"), (ROLLUP_WATERMARK_KEY, str(new_watermark), now))
+    return len(rows), new_watermark
+
+
+def get_rollup_watermark():
+    """Id of the last product_events row folded into the rollups (0 = none)."""
+    value = get_platform_setting(ROLLUP_WATERMARK_KEY)
+    try:
+        return int(value) if value else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+def refresh_analytics_rollups(batch_size=None, max_batches=None):
+    """Fold product_events past the watermark into the daily rollups.
+
+    Each batch commits with its watermark, so an interrupted run resumes where
+    it stopped. Returns the number of events processed.
+    """
+    batch_size = batch_size or ANALYTICS_ROLLUP_BATCH
+    processed = batches = 0
+    with _rollup_lock:
+        watermark = get_rollup_watermark()
+        while max_batches is None or batches < max_batches:
+            conn = _get_connection()
+            try:
+                count, watermark = _apply_rollup_batch(conn, watermark, batch_size)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logging.warning(f"Analytics rollup refresh stopped: {e}")
+                break
+            finally:
+                conn.close()
+            processed += count
+            batches += 1
+            if count < batch_size:
+                break
+    return processed
+
+
+def rebuild_analytics_rollups():
+    """Drop all rollup rows and the watermark, then refold every event."""
+    with _rollup_lock:
         conn = _get_connection()
         try:
-            like_query = "SELECT 1 FROM product_events WHERE event_type='onboarding_step' AND username=? AND metadata_json LIKE ?"
-            if is_postgres():
-                like_query = like_query.replace("LIKE", "ILIKE")
-            existing = _execute_plain(
-                conn, _q(like_query),
-                (username, f'%"{step_name}"%')).fetchone()
-            if not existing:
-                _execute_plain(conn, _q(
-                    """INSERT INTO product_events
-                       (event_type, username, org_id, metadata_json, session_id)
-                       VALUES (?, ?, ?, ?, ?)"""),
-                    ("onboarding_step", username, org_id,
-                     json.dumps({"step": step_name}), session_id))
-                conn.commit()
+            _execute_plain(conn, "DELETE FROM analytics_user_daily")
+            _execute_plain(conn, "DELETE FROM analytics_module_daily")
+            _execute_plain(conn, _q("DELETE FROM platform_settings WHERE key = ?"), (ROLLUP_WATERMARK_KEY,))
+            conn.commit()
         finally:
             conn.close()
-    except Exception:
-        pass
+    return refresh_analytics_rollups()
+
+
+def _rollup_day_bounds(first_day, last_day):
+    """(first, end_exclusive, today, include_today) as 'YYYY-MM-DD' strings, UTC."""
+    today = datetime.now(timezone.utc).date()
+    first = first_day or "0000-01-01"
+    if last_day is None or last_day >= today.isoformat():
+        return first, today.isoformat(), today.isoformat(), True
+    end = (datetime.strptime(last_day, "%Y-%m-%d").date() + timedelta(days=1)).isoformat()
+    return first, end, today.isoformat(), False
+
+
+def _rollup_source(kind, first_day=None, last_day=None):
+    """(sql, params) for a derived table of rollup-shaped rows over days
+    first_day..last_day ('YYYY-MM-DD', inclusive; None = open-ended).
+
+    kind 'user' yields (day, username, module_actions, sessions, last_action_at);
+    'module' yields (day, module, username, actions, cost_events, cost_usd,
+    input_tokens, output_tokens, feedback_yes/close/no). Closed days come from
+    the rollup table; today and any events past the watermark (which always
+    includes the refresh's safety-lag window) are aggregated from
+    product_events in the same statement, so nothing is counted twice.
+    """
+    first, end, today, include_today = _rollup_day_bounds(first_day, last_day)
+    if is_postgres():
+        day_expr = "TO_CHAR(timestamp, 'YYYY-MM-DD')"
+        ts_expr = "TO_CHAR(timestamp, 'YYYY-MM-DD HH24:MI:SS')"
+    else:
+        day_expr, ts_expr = "substr(timestamp, 1, 10)", "timestamp"
+
+    if kind == "user":
+        table, keys, event_types = "analytics_user_daily", ("username",), _ROLLUP_USER_EVENTS
+        key_exprs = ("username",)
+        aggs = [
+            "SUM(CASE WHEN event_type = 'module_action' THEN 1 ELSE 0 END) AS module_actions",
+            "SUM(CASE WHEN event_type = 'session_start' THEN 1 ELSE 0 END) AS sessions",
+            f"MAX(CASE WHEN event_type = 'module_action' THEN {ts_expr} END) AS last_action_at",
+        ]
+        cols = _ROLLUP_USER_COLS
+    else:
+        table, keys, event_types = "analytics_module_daily", ("module", "username"), _ROLLUP_MODULE_EVENTS
+        key_exprs = ("COALESCE(module, '')", "username")
+
+        def _cost_sum(column):
+            return f"SUM(CASE WHEN event_type = 'api_cost' THEN COALESCE({column}, 0) ELSE 0 END) AS {column}"
+
+        aggs = [
+            "SUM(CASE WHEN event_type = 'module_action' THEN 1 ELSE 0 END) AS actions",
+            "SUM(CASE WHEN event_type = 'api_cost' THEN 1 ELSE 0 END) AS cost_events",
+            _cost_sum("cost_usd"), _cost_sum("input_tokens"), _cost_sum("output_tokens"),
+        ] + [f"SUM(CASE WHEN event_type = 'output_feedback' AND rating = '{r}' THEN 1 ELSE 0 END) AS feedback_{r}"
+             for r in ("yes", "close", "no")]
+        cols = _ROLLUP_MODULE_COLS
+
+    key_select = ", ".join(f"{e} AS {k}" for e, k in zip(key_exprs, keys))
+    type_filter = ", ".join(f"'{t}'" for t in event_types)
+
+    def _raw(where):
+        return f"""SELECT {day_expr} AS day, {key_select}, {", ".join(aggs)}
+                   FROM product_events WHERE event_type IN ({type_filter}) AND {where}
+                   GROUP BY {day_expr}, {", ".join(key_exprs)}"""
+
+    watermark = ("(SELECT COALESCE(MAX(CAST(value AS INTEGER)), 0) FROM platform_settings "
+                 f"WHERE key = '{ROLLUP_WATERMARK_KEY}')")
+    parts = [
+        f"SELECT day, {', '.join(keys)}, {', '.join(cols)} FROM {table} WHERE day >= ? AND day < ?",
+        _raw(f"id > {watermark} AND timestamp >= ? AND timestamp < ?"),
+    ]
+    params = [first, end, first, end]
+    if include_today:
+        parts.append(_raw("timestamp >= ?"))
+        params.append(today)
+    return "(" + " UNION ALL ".join(parts) + ") rollup", tuple(params)
+
+
+def _utc_day(days_ago=0):
+    return (datetime.now(timezone.utc).date() - timedelta(days=days_ago)).isoformat()
 
 
 # ── Analytics query functions ─────────────────────────────────────────────────
@@ -1605,13 +3427,12 @@ def _datetime_offset(days):
 
 
 def get_active_users(days=7):
-    """Returns count of users with at least 1 module_action in last N days."""
+    """Returns count of users with at least 1 module_action in the last N days."""
     conn = _get_connection()
     try:
-        sql = f"""SELECT COUNT(DISTINCT username) FROM product_events
-                  WHERE event_type='module_action'
-                  AND timestamp >= {_datetime_offset(days)}"""
-        return _fetchone_val(_execute_plain(conn, sql), 0)
+        source, params = _rollup_source("user", first_day=_utc_day(days - 1))
+        sql = f"SELECT COUNT(DISTINCT username) FROM {source} WHERE module_actions > 0"
+        return _fetchone_val(_execute_plain(conn, _q(sql), params), 0)
     finally:
         conn.close()
 
@@ -1620,12 +3441,12 @@ def get_user_sessions_per_week(days=28):
     """Returns avg sessions per active user per week over last N days."""
     conn = _get_connection()
     try:
-        sql = f"""SELECT username, COUNT(DISTINCT session_id) as sessions
-                  FROM product_events
-                  WHERE event_type='session_start'
-                  AND timestamp >= {_datetime_offset(days)}
-                  GROUP BY username"""
-        rows = _execute_plain(conn, sql).fetchall()
+        source, params = _rollup_source("user", first_day=_utc_day(days - 1))
+        sql = f"""SELECT username, SUM(sessions) as sessions
+                  FROM {source}
+                  GROUP BY username
+                  HAVING SUM(sessions) > 0"""
+        rows = _execute_plain(conn, _q(sql), params).fetchall()
         if not rows:
             return 0.0
         weeks = max(days / 7, 1)
@@ -1640,39 +3461,34 @@ def get_user_return_table():
     """Returns per-user retention data for the return table."""
     conn = _get_connection()
     try:
+        source, params = _rollup_source("user")
         if is_postgres():
-            sql = """
-                SELECT
-                    u.username,
-                    u.created_at as signed_up,
-                    u.subscription_tier,
-                    MAX(pe.timestamp) as last_active,
-                    COUNT(DISTINCT CASE WHEN pe.event_type='module_action' THEN pe.id END) as total_actions,
-                    COUNT(DISTINCT EXTRACT(WEEK FROM pe.timestamp::timestamp)) as weeks_active
-                FROM users u
-                LEFT JOIN product_events pe ON u.username = pe.username
-                    AND pe.event_type = 'module_action'
-                WHERE u.subscription_tier != 'super_admin'
-                GROUP BY u.username, u.created_at, u.subscription_tier
-                ORDER BY MAX(pe.timestamp) DESC NULLS LAST
-            """
+            week_expr = "EXTRACT(WEEK FROM day::date)"
+            order_null = " NULLS LAST"
         else:
-            sql = """
-                SELECT
-                    u.username,
-                    u.created_at as signed_up,
-                    u.subscription_tier,
-                    MAX(pe.timestamp) as last_active,
-                    COUNT(DISTINCT CASE WHEN pe.event_type='module_action' THEN pe.id END) as total_actions,
-                    COUNT(DISTINCT strftime('%W', pe.timestamp)) as weeks_active
-                FROM users u
-                LEFT JOIN product_events pe ON u.username = pe.username
-                    AND pe.event_type = 'module_action'
-                WHERE u.subscription_tier != 'super_admin'
-                GROUP BY u.username
-                ORDER BY MAX(pe.timestamp) DESC
-            """
-        rows = _execute_plain(conn, sql).fetchall()
+            week_expr = "strftime('%W', day)"
+            order_null = ""
+        sql = f"""
+            SELECT
+                u.username,
+                u.created_at as signed_up,
+                u.subscription_tier,
+                MAX(a.last_action_at) as last_active,
+                COALESCE(SUM(a.module_actions), 0) as total_actions,
+                COUNT(DISTINCT {week_expr}) as weeks_active
+            FROM users u
+            LEFT JOIN (
+                SELECT day, username, SUM(module_actions) as module_actions,
+                       MAX(last_action_at) as last_action_at
+                FROM {source}
+                GROUP BY day, username
+                HAVING SUM(module_actions) > 0
+            ) a ON u.username = a.username
+            WHERE u.subscription_tier != 'super_admin'
+            GROUP BY u.username, u.created_at, u.subscription_tier
+            ORDER BY MAX(a.last_action_at) DESC{order_null}
+        """
+        rows = _execute_plain(conn, _q(sql), params).fetchall()
         return [_dict_row(r) for r in rows]
     finally:
         conn.close()
@@ -1689,56 +3505,41 @@ def get_module_engagement():
     """Returns module engagement data for the analytics dashboard."""
     conn = _get_connection()
     try:
-        mod = _json_extract('metadata_json', 'module')
+        source, params = _rollup_source("module")
         sql = f"""
             SELECT
-                {mod} as module,
-                COUNT(*) as total_actions,
-                COUNT(DISTINCT username) as unique_users
-            FROM product_events
-            WHERE event_type = 'module_action'
-            AND {mod} IS NOT NULL
-            GROUP BY {mod}
+                module,
+                SUM(actions) as total_actions,
+                COUNT(DISTINCT CASE WHEN actions > 0 THEN username END) as unique_users
+            FROM {source}
+            WHERE module != ''
+            GROUP BY module
+            HAVING SUM(actions) > 0
             ORDER BY total_actions DESC
         """
-        rows = _execute_plain(conn, sql).fetchall()
+        rows = _execute_plain(conn, _q(sql), params).fetchall()
         return [_dict_row(r) for r in rows]
     finally:
         conn.close()
 
 
 def get_module_engagement_week(weeks_ago=0):
-    """Returns module action counts for a specific week."""
+    """Returns module action counts for a specific week (7 days, week 0 ends today)."""
     conn = _get_connection()
     try:
-        mod = _json_extract('metadata_json', 'module')
-        start_days = (weeks_ago + 1) * 7
-        end_days = weeks_ago * 7
-        if is_postgres():
-            sql = f"""
-                SELECT {mod} as module, COUNT(*) as actions
-                FROM product_events
-                WHERE event_type = 'module_action'
-                AND timestamp >= NOW() - INTERVAL '{start_days} days'
-                AND timestamp < NOW() - INTERVAL '{end_days} days'
-                GROUP BY {mod}
-            """
-        else:
-            sql = f"""
-                SELECT {mod} as module, COUNT(*) as actions
-                FROM product_events
-                WHERE event_type = 'module_action'
-                AND timestamp >= datetime('now', '-{start_days} days')
-                AND timestamp < datetime('now', '-{end_days} days')
-                GROUP BY {mod}
-            """
-        rows = _execute_plain(conn, sql).fetchall()
+        source, params = _rollup_source("module", first_day=_utc_day((weeks_ago + 1) * 7 - 1),
+                                        last_day=_utc_day(weeks_ago * 7))
+        sql = f"""
+            SELECT module, SUM(actions) as actions
+            FROM {source}
+            GROUP BY module
+            HAVING SUM(actions) > 0
+        """
+        rows = _execute_plain(conn, _q(sql), params).fetchall()
         result = {}
         for r in rows:
-            if isinstance(r, dict):
-                result[r['module']] = r['actions']
-            else:
-                result[r[0]] = r[1]
+            d = _dict_row(r)
+            result[d['module'] or None] = d['actions']
         return result
     finally:
         conn.close()
@@ -1782,50 +3583,31 @@ def get_api_costs(days=30):
     """Returns API cost data for the last N days."""
     conn = _get_connection()
     try:
-        cost_field = _json_extract('metadata_json', 'estimated_cost_usd')
-        mod_field = _json_extract('metadata_json', 'module')
-        offset = _datetime_offset(days)
-
-        if is_postgres():
-            date_expr = "DATE(timestamp)::text"
-        else:
-            date_expr = "DATE(timestamp)"
-
-        total = _execute_plain(conn, f"""
-            SELECT COALESCE(SUM(CAST({cost_field} AS FLOAT)), 0) as total_cost,
-                   COUNT(*) as total_actions
-            FROM product_events
-            WHERE event_type = 'api_cost'
-            AND timestamp >= {offset}
-        """).fetchone()
-
-        per_module = _execute_plain(conn, f"""
-            SELECT {mod_field} as module,
-                   SUM(CAST({cost_field} AS FLOAT)) as cost,
-                   COUNT(*) as actions
-            FROM product_events
-            WHERE event_type = 'api_cost'
-            AND timestamp >= {offset}
-            GROUP BY {mod_field}
-            ORDER BY cost DESC
-        """).fetchall()
-
-        daily = _execute_plain(conn, f"""
-            SELECT {date_expr} as day,
-                   SUM(CAST({cost_field} AS FLOAT)) as cost
-            FROM product_events
-            WHERE event_type = 'api_cost'
-            AND timestamp >= {offset}
-            GROUP BY {date_expr}
-            ORDER BY {date_expr}
-        """).fetchall()
+        source, params = _rollup_source("module", first_day=_utc_day(days - 1))
+        rows = _execute_plain(conn, _q(f"""
+            SELECT day, module, SUM(cost_usd) as cost, SUM(cost_events) as actions
+            FROM {source}
+            GROUP BY day, module
+            HAVING SUM(cost_events) > 0
+        """), params).fetchall()
+
+        per_module, daily = {}, {}
+        total_cost, total_actions = 0.0, 0
+        for r in rows:
+            d = _dict_row(r)
+            cost, actions = float(d['cost'] or 0), int(d['actions'] or 0)
+            total_cost += cost
+            total_actions += actions
+            m = per_module.setdefault(d['module'] or None, {"module": d['module'] or None, "cost": 0.0, "actions": 0})
+            m["cost"] += cost
+            m["actions"] += actions
+            daily[d['day']] = daily.get(d['day'], 0.0) + cost
 
-        total_row = _dict_row(total) if total else {}
         return {
-            "total_cost": total_row.get('total_cost', 0) or 0,
-            "total_actions": total_row.get('total_actions', 0) or 0,
-            "per_module": [_dict_row(r) for r in per_module],
-            "daily": [_dict_row(r) for r in daily],
+            "total_cost": total_cost,
+            "total_actions": total_actions,
+            "per_module": sorted(per_module.values(), key=lambda m: m["cost"], reverse=True),
+            "daily": [{"day": day, "cost": cost} for day, cost in sorted(daily.items())],
         }
     finally:
         conn.close()
@@ -1833,14 +3615,7 @@ def get_api_costs(days=30):
 
 def get_active_user_count(days=30):
     """Returns count of distinct active users (with module_action) in last N days."""
-    conn = _get_connection()
-    try:
-        sql = f"""SELECT COUNT(DISTINCT username) FROM product_events
-                  WHERE event_type='module_action'
-                  AND timestamp >= {_datetime_offset(days)}"""
-        return _fetchone_val(_execute_plain(conn, sql), 0)
-    finally:
-        conn.close()
+    return get_active_users(days)
 
 
 def get_calibration_distribution():
@@ -1849,28 +3624,26 @@ def get_calibration_distribution():
     try:
         _false_val = "FALSE" if is_postgres() else "0"
         rows = _execute_plain(conn, f"""
-            SELECT data FROM profiles
+            SELECT COALESCE(calibration_score, 0) as score, COUNT(*) as cnt FROM profiles
             WHERE is_sample_brand = {_false_val} OR is_sample_brand IS NULL
+            GROUP BY COALESCE(calibration_score, 0)
+            ORDER BY score
         """).fetchall()
 
         buckets = {"0-25": 0, "26-50": 0, "51-75": 0, "76-100": 0}
         scores = []
         for row in rows:
-            try:
-                raw = row['data'] if isinstance(row, dict) else row[0]
-                data = json.loads(raw) if isinstance(raw, str) else raw
-                score = data.get('calibration_score', 0) if isinstance(data, dict) else 0
-                scores.append(score)
-                if score <= 25:
-                    buckets["0-25"] += 1
-                elif score <= 50:
-                    buckets["26-50"] += 1
-                elif score <= 75:
-                    buckets["51-75"] += 1
-                else:
-                    buckets["76-100"] += 1
-            except (json.JSONDecodeError, TypeError):
-                buckets["0-25"] += 1
+            d = _dict_row(row)
+            score, cnt = d['score'], d['cnt']
+            scores.extend([score] * cnt)
+            if score <= 25:
+                buckets["0-25"] += cnt
+            elif score <= 50:
+                buckets["26-50"] += cnt
+            elif score <= 75:
+                buckets["51-75"] += cnt
+            else:
+                buckets["76-100"] += cnt
         return buckets, scores
     finally:
         conn.close()
@@ -1880,12 +3653,11 @@ def get_avg_calibration_trend(weeks=8):
     """Returns weekly average calibration score from calibration_change events."""
     conn = _get_connection()
     try:
-        new_score = _json_extract('metadata_json', 'new_score')
         days = weeks * 7
         if is_postgres():
             sql = f"""
                 SELECT TO_CHAR(timestamp::timestamp, 'IYYY-"W"IW') as week,
-                       AVG(CAST({new_score} AS FLOAT)) as avg_score
+                       AVG(new_score) as avg_score
                 FROM product_events
                 WHERE event_type = 'calibration_change'
                 AND timestamp >= NOW() - INTERVAL '{days} days'
@@ -1895,7 +3667,7 @@ def get_avg_calibration_trend(weeks=8):
         else:
             sql = f"""
                 SELECT strftime('%Y-W%W', timestamp) as week,
-                       AVG({new_score}) as avg_score
+                       AVG(new_score) as avg_score
                 FROM product_events
                 WHERE event_type = 'calibration_change'
                 AND timestamp >= datetime('now', '-{days} days')
@@ -1913,56 +3685,26 @@ def get_profile_completion_stats():
     conn = _get_connection()
     try:
         _false_val = "FALSE" if is_postgres() else "0"
-        rows = _execute_plain(conn, f"""
-            SELECT data FROM profiles
-            WHERE is_sample_brand = {_false_val} OR is_sample_brand IS NULL
-        """).fetchall()
 
-        total = len(rows)
+        def _count(condition):
+            return f"SUM(CASE WHEN {condition} THEN 1 ELSE 0 END)"
+
+        row = _execute_plain(conn, f"""
+            SELECT COUNT(*) as total,
+                   {_count("strategy_fields >= 3")} as strategy_fields,
+                   {_count("has_voice")} as voice_samples,
+                   {_count("has_voice AND voice_samples >= 3")} as voice_3plus,
+                   {_count("has_message_house")} as message_house,
+                   {_count("has_visual")} as visual_identity,
+                   {_count("has_social")} as social_samples
+            FROM profiles
+            WHERE is_sample_brand = {_false_val} OR is_sample_brand IS NULL
+        """).fetchone()
+        stats = _dict_row(row)
+        total = stats.pop('total') or 0
         if total == 0:
             return {}
-
-        stats = {
-            "strategy_fields": 0,
-            "voice_samples": 0,
-            "voice_3plus": 0,
-            "message_house": 0,
-            "visual_identity": 0,
-            "social_samples": 0,
-        }
-
-        for row in rows:
-            try:
-                raw = row['data'] if isinstance(row, dict) else row[0]
-                data = json.loads(raw) if isinstance(raw, str) else raw
-                if not isinstance(data, dict):
-                    continue
-                inputs = data.get('inputs', {})
-
-                strat_count = sum(1 for k in ['wiz_name', 'wiz_mission', 'wiz_values', 'wiz_archetype']
-                                  if inputs.get(k))
-                if strat_count >= 3:
-                    stats["strategy_fields"] += 1
-
-                if len(inputs.get('voice_dna', '')) > 20 or '[ASSET:' in inputs.get('voice_dna', ''):
-                    stats["voice_samples"] += 1
-                    voice_count = inputs.get('voice_dna', '').count('[ASSET:')
-                    if voice_count >= 3:
-                        stats["voice_3plus"] += 1
-
-                if any(inputs.get(k) for k in ['mh_brand_promise', 'mh_pillars_json', 'mh_boilerplate']):
-                    stats["message_house"] += 1
-
-                if len(inputs.get('visual_dna', '')) > 20 or '[ASSET:' in inputs.get('visual_dna', ''):
-                    stats["visual_identity"] += 1
-
-                if len(inputs.get('social_dna', '')) > 20 or '[ASSET:' in inputs.get('social_dna', ''):
-                    stats["social_samples"] += 1
-
-            except (json.JSONDecodeError, TypeError):
-                pass
-
-        return {k: round(v / total * 100) for k, v in stats.items()} if total > 0 else stats
+        return {k: round((v or 0) / total * 100) for k, v in stats.items()}
     finally:
         conn.close()
 
@@ -1979,14 +3721,13 @@ def get_onboarding_funnel():
             "first_module_run", "message_house_started",
             "calibration_crossed_60", "calibration_crossed_90"
         ]
-        funnel = {}
-        like_kw = "ILIKE" if is_postgres() else "LIKE"
-        for step in steps:
-            count = _fetchone_val(_execute_plain(
-                conn, _q(f"SELECT COUNT(DISTINCT username) FROM product_events "
-                         f"WHERE event_type='onboarding_step' AND metadata_json {like_kw} ?"),
-                (f'%"{step}"%',)), 0)
-            funnel[step] = count
+        rows = _execute_plain(conn, _q(f"""
+            SELECT step, COUNT(DISTINCT username) as users FROM product_events
+            WHERE event_type = 'onboarding_step' AND step IN ({", ".join("?" * len(steps))})
+            GROUP BY step
+        """), tuple(steps)).fetchall()
+        counts = {_dict_row(r)['step']: _dict_row(r)['users'] for r in rows}
+        funnel = {step: counts.get(step, 0) for step in steps}
 
         return funnel, total_users
     finally:
@@ -1994,94 +3735,66 @@ def get_onboarding_funnel():
 
 
 def get_inactive_user_diagnostics(days_threshold=14):
-    """Returns diagnostics for users inactive for N+ days."""
+    """Returns diagnostics for users inactive for N+ days.
+
+    Three queries regardless of user count: the inactive users (with org),
+    the distinct modules each user has run, and per-org brand readiness
+    aggregated over the profile summary columns.
+    """
     conn = _get_connection()
     try:
         offset = _datetime_offset(days_threshold)
-        mod_field = _json_extract('metadata_json', 'module')
-        step_field = _json_extract('metadata_json', 'step')
 
         if is_postgres():
-            sql = f"""
-                SELECT u.username, u.created_at,
-                    MAX(pe.timestamp) as last_active,
-                    COUNT(DISTINCT CASE WHEN pe.event_type='module_action' THEN pe.id END) as total_actions
-                FROM users u
-                LEFT JOIN product_events pe ON u.username = pe.username
-                WHERE u.subscription_tier != 'super_admin'
-                GROUP BY u.username, u.created_at
-                HAVING MAX(pe.timestamp) IS NULL OR MAX(pe.timestamp) < {offset}
-            """
+            having = f"MAX(pe.timestamp) IS NULL OR MAX(pe.timestamp) < {offset}"
         else:
-            sql = f"""
-                SELECT u.username, u.created_at,
-                    MAX(pe.timestamp) as last_active,
-                    COUNT(DISTINCT CASE WHEN pe.event_type='module_action' THEN pe.id END) as total_actions
-                FROM users u
-                LEFT JOIN product_events pe ON u.username = pe.username
-                WHERE u.subscription_tier != 'super_admin'
-                GROUP BY u.username
-                HAVING last_active IS NULL OR last_active < {offset}
-            """
-
-        users = _execute_plain(conn, sql).fetchall()
+            having = f"last_active IS NULL OR last_active < {offset}"
+        users = _execute_plain(conn, f"""
+            SELECT u.username, u.created_at, u.org_id,
+                MAX(pe.timestamp) as last_active,
+                COUNT(DISTINCT CASE WHEN pe.event_type='module_action' THEN pe.id END) as total_actions
+            FROM users u
+            LEFT JOIN product_events pe ON u.username = pe.username
+            WHERE u.subscription_tier != 'super_admin'
+            GROUP BY u.username, u.created_at, u.org_id
+            HAVING {having}
+        """).fetchall()
+        users = [_dict_row(u) for u in users]
+        if not users:
+            return []
+        inactive = {u['username'] for u in users}
+
+        modules_used = {}
+        for row in _execute_plain(conn, """
+            SELECT DISTINCT username, module
+            FROM product_events
+            WHERE event_type='module_action'
+        """).fetchall():
+            d = _dict_row(row)
+            if d['username'] in inactive and d['module']:
+                modules_used.setdefault(d['username'], set()).add(d['module'])
+
+        orgs = {u['org_id'] or u['username'] for u in users}
+        readiness = {}
+        for row in _execute_plain(conn, f"""
+            SELECT org_id,
+                   MAX(COALESCE(calibration_score, 0)) as confidence,
+                   MAX(CASE WHEN has_voice THEN 1 ELSE 0 END) as has_voice,
+                   MAX(CASE WHEN has_message_house THEN 1 ELSE 0 END) as has_mh
+            FROM profiles
+            WHERE is_sample_brand = {'FALSE' if is_postgres() else '0'} OR is_sample_brand IS NULL
+            GROUP BY org_id
+        """).fetchall():
+            d = _dict_row(row)
+            if d['org_id'] in orgs:
+                readiness[d['org_id']] = (max(d['confidence'] or 0, 0), bool(d['has_voice']), bool(d['has_mh']))
 
+        all_modules = {"content_generator", "copy_editor", "social_assistant", "visual_audit"}
         results = []
         for u in users:
-            u = _dict_row(u)
             username = u['username']
-
-            modules = _execute_plain(
-                conn, _q(f"""SELECT DISTINCT {mod_field}
-                            FROM product_events
-                            WHERE username=? AND event_type='module_action'"""),
-                (username,)).fetchall()
-            modules_used = []
-            for m in modules:
-                val = m[list(m.keys())[0]] if isinstance(m, dict) else m[0]
-                if val:
-                    modules_used.append(val)
-            all_modules = {"content_generator", "copy_editor", "social_assistant", "visual_audit"}
-            modules_never = all_modules - set(modules_used)
-
-            steps = _execute_plain(
-                conn, _q(f"""SELECT {step_field}
-                            FROM product_events
-                            WHERE username=? AND event_type='onboarding_step'"""),
-                (username,)).fetchall()
-            steps_done = []
-            for s in steps:
-                val = s[list(s.keys())[0]] if isinstance(s, dict) else s[0]
-                if val:
-                    steps_done.append(val)
-
-            org_row = _execute_plain(
-                conn, _q("SELECT org_id FROM users WHERE username=?"), (username,)).fetchone()
-            org = username
-            if org_row:
-                org_val = org_row['org_id'] if isinstance(org_row, dict) else org_row[0]
-                org = org_val if org_val else username
-
-            profiles = _execute_plain(
-                conn, _q(f"SELECT data FROM profiles WHERE org_id=? AND (is_sample_brand={'FALSE' if is_postgres() else '0'} OR is_sample_brand IS NULL)"),
-                (org,)).fetchall()
-
-            max_confidence = 0
-            has_voice = False
-            has_mh = False
-            for p in profiles:
-                try:
-                    raw = p['data'] if isinstance(p, dict) else p[0]
-                    d = json.loads(raw) if isinstance(raw, str) else raw
-                    if isinstance(d, dict):
-                        max_confidence = max(max_confidence, d.get('calibration_score', 0))
-                        inp = d.get('inputs', {})
-                        if len(inp.get('voice_dna', '')) > 20:
-                            has_voice = True
-                        if any(inp.get(k) for k in ['mh_brand_promise', 'mh_pillars_json']):
-                            has_mh = True
-                except (json.JSONDecodeError, TypeError):
-                    pass
+            max_confidence, has_voice, has_mh = readiness.get(u['org_id'] or username, (0, False, False))
+            modules_never = all_modules - modules_used.get(username, set())
 
             missing = []
             if not has_voice:
@@ -2177,28 +3890,19 @@ def get_feedback_summary():
     """Returns overall feedback counts: {yes, close, no, total, total_actions}."""
     conn = _get_connection()
     try:
-        rating = _json_extract('metadata_json', 'rating')
-        sql = f"""
-            SELECT {rating} as rating, COUNT(*) as cnt
-            FROM product_events
-            WHERE event_type = 'output_feedback'
-            GROUP BY {rating}
-        """
-        rows = _execute_plain(conn, sql).fetchall()
-        counts = {"yes": 0, "close": 0, "no": 0}
-        for r in rows:
-            d = _dict_row(r)
-            k = d.get('rating', '')
-            if k in counts:
-                counts[k] = d.get('cnt', 0)
+        source, params = _rollup_source("module")
+        row = _execute_plain(conn, _q(f"""
+            SELECT COALESCE(SUM(feedback_yes), 0) as feedback_yes,
+                   COALESCE(SUM(feedback_close), 0) as feedback_close,
+                   COALESCE(SUM(feedback_no), 0) as feedback_no,
+                   COALESCE(SUM(actions), 0) as total_actions
+            FROM {source}
+        """), params).fetchone()
+        d = _dict_row(row) or {}
+        counts = {k: int(d.get("feedback_" + k) or 0) for k in ("yes", "close", "no")}
         counts['total'] = counts['yes'] + counts['close'] + counts['no']
-
         # Total module actions for feedback rate
-        total_actions = _fetchone_val(
-            _execute_plain(conn, "SELECT COUNT(*) FROM product_events WHERE event_type = 'module_action'"),
-            0
-        )
-        counts['total_actions'] = total_actions
+        counts['total_actions'] = int(d.get('total_actions') or 0)
         return counts
     finally:
         conn.close()
@@ -2208,48 +3912,25 @@ def get_feedback_by_module():
     """Returns feedback breakdown per module."""
     conn = _get_connection()
     try:
-        mod = _json_extract('metadata_json', 'module')
-        rating = _json_extract('metadata_json', 'rating')
-        sql = f"""
-            SELECT {mod} as module, {rating} as rating, COUNT(*) as cnt
-            FROM product_events
-            WHERE event_type = 'output_feedback'
-            GROUP BY {mod}, {rating}
-        """
-        rows = _execute_plain(conn, sql).fetchall()
-        modules = {}
+        source, params = _rollup_source("module")
+        rows = _execute_plain(conn, _q(f"""
+            SELECT module,
+                   SUM(feedback_yes) as feedback_yes, SUM(feedback_close) as feedback_close, SUM(feedback_no) as feedback_no,
+                   SUM(actions) as total_actions
+            FROM {source}
+            GROUP BY module
+            HAVING SUM(feedback_yes + feedback_close + feedback_no) > 0
+        """), params).fetchall()
+        result = []
         for r in rows:
             d = _dict_row(r)
-            m = d.get('module', '')
-            rt = d.get('rating', '')
-            if m not in modules:
-                modules[m] = {"yes": 0, "close": 0, "no": 0}
-            if rt in modules[m]:
-                modules[m][rt] = d.get('cnt', 0)
-
-        # Get total actions per module for feedback rate
-        mod2 = _json_extract('metadata_json', 'module')
-        sql2 = f"""
-            SELECT {mod2} as module, COUNT(*) as cnt
-            FROM product_events
-            WHERE event_type = 'module_action'
-            GROUP BY {mod2}
-        """
-        action_rows = _execute_plain(conn, sql2).fetchall()
-        action_counts = {}
-        for r in action_rows:
-            d = _dict_row(r)
-            action_counts[d.get('module', '')] = d.get('cnt', 0)
-
-        result = []
-        for m, counts in modules.items():
-            total = counts['yes'] + counts['close'] + counts['no']
-            actions = action_counts.get(m, 0)
+            counts = {k: int(d.get("feedback_" + k) or 0) for k in ("yes", "close", "no")}
             result.append({
-                "module": m,
+                "module": d['module'] or None,
                 "yes": counts['yes'], "close": counts['close'], "no": counts['no'],
-                "total": total,
-                "total_actions": actions,
+                "total": counts['yes'] + counts['close'] + counts['no'],
+                # Total actions per module for feedback rate
+                "total_actions": int(d.get('total_actions') or 0),
             })
         return result
     finally:
@@ -2260,15 +3941,12 @@ def get_feedback_by_confidence():
     """Returns feedback grouped by engine confidence tiers (0-25, 26-50, 51-75, 76-100)."""
     conn = _get_connection()
     try:
-        conf = _json_extract('metadata_json', 'engine_confidence')
-        rating = _json_extract('metadata_json', 'rating')
-        sql = f"""
-            SELECT {conf} as confidence, {rating} as rating, COUNT(*) as cnt
+        rows = _execute_plain(conn, """
+            SELECT confidence, rating, COUNT(*) as cnt
             FROM product_events
             WHERE event_type = 'output_feedback'
-            GROUP BY {conf}, {rating}
-        """
-        rows = _execute_plain(conn, sql).fetchall()
+            GROUP BY confidence, rating
+        """).fetchall()
 
         buckets = {
             "0-25": {"yes": 0, "close": 0, "no": 0},
@@ -2304,62 +3982,153 @@ def get_feedback_by_confidence():
 
 
 def get_feedback_weekly(weeks=8):
-    """Returns weekly feedback counts for trend analysis."""
+    """Returns weekly feedback counts for trend analysis (7-day buckets, week 0 ends today)."""
     conn = _get_connection()
     try:
-        rating = _json_extract('metadata_json', 'rating')
-        results = []
-        for w in range(weeks):
-            if is_postgres():
-                start = f"NOW() - INTERVAL '{(w+1)*7} days'"
-                end = f"NOW() - INTERVAL '{w*7} days'"
-            else:
-                start = f"datetime('now', '-{(w+1)*7} days')"
-                end = f"datetime('now', '-{w*7} days')"
-            sql = f"""
-                SELECT {rating} as rating, COUNT(*) as cnt
-                FROM product_events
-                WHERE event_type = 'output_feedback'
-                AND timestamp >= {start} AND timestamp < {end}
-                GROUP BY {rating}
-            """
-            rows = _execute_plain(conn, sql).fetchall()
-            week_data = {"week": w, "yes": 0, "close": 0, "no": 0}
-            for r in rows:
-                d = _dict_row(r)
-                rt = d.get('rating', '')
-                if rt in week_data:
-                    week_data[rt] = d.get('cnt', 0)
+        source, params = _rollup_source("module", first_day=_utc_day(weeks * 7 - 1))
+        rows = _execute_plain(conn, _q(f"""
+            SELECT day, SUM(feedback_yes) as feedback_yes, SUM(feedback_close) as feedback_close, SUM(feedback_no) as feedback_no
+            FROM {source}
+            GROUP BY day
+        """), params).fetchall()
+        results = [{"week": w, "yes": 0, "close": 0, "no": 0} for w in range(weeks)]
+        today = datetime.now(timezone.utc).date()
+        for r in rows:
+            d = _dict_row(r)
+            w = (today - datetime.strptime(d['day'], "%Y-%m-%d").date()).days // 7
+            if 0 <= w < weeks:
+                for k in ("yes", "close", "no"):
+                    results[w][k] += int(d.get("feedback_" + k) or 0)
+        for week_data in results:
             week_data['total'] = week_data['yes'] + week_data['close'] + week_data['no']
-            results.append(week_data)
         return list(reversed(results))  # oldest first
     finally:
         conn.close()
 
 
-def get_product_events_csv():
-    """Returns all product_events as CSV string for export."""
+# ── Streaming exports ─────────────────────────────────────────────────────────
+# Exports read through a server-side cursor on Postgres (fetchmany on SQLite)
+# and yield CSV text one batch at a time, so memory stays flat however many
+# rows match. gzip_chunks compresses the stream on the fly.
+
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", "2000"))
+
+
+def iter_query_rows(sql, params=None, fetch_size=None):
+    """Yield (column names, list of row tuples) batches of up to fetch_size rows.
+
+    The first batch is always yielded, possibly empty, so callers can write a
+    header for queries that match nothing.
+    """
+    fetch_size = fetch_size or EXPORT_FETCH_SIZE
     conn = _get_connection()
     try:
-        rows = _execute_plain(conn, "SELECT * FROM product_events ORDER BY timestamp DESC").fetchall()
+        if is_postgres():
+            import psycopg2.extensions
+            # Named cursor = server-side; plain tuples instead of the pool's RealDictCursor
+            cur = conn.cursor(name=f"export_{threading.get_ident()}_{time.monotonic_ns()}",
+                              cursor_factory=psycopg2.extensions.cursor)
+            cur.itersize = fetch_size
+            cur.execute(sql, params)
+        else:
+            cur = conn.execute(sql, params or ())
+        try:
+            batch = cur.fetchmany(fetch_size)
+            columns = [d[0] for d in cur.description]
+            while True:
+                yield columns, [tuple(r) for r in batch]
+                if len(batch) < fetch_size:
+                    break
+                batch = cur.fetchmany(fetch_size)
+                if not batch:
+                    break
+        finally:
+            cur.close()
+    finally:
+        conn.close()
 
-        if not rows:
-            return "id,event_type,username,org_id,brand_id,metadata_json,session_id,timestamp\n"
 
-        import csv
-        import io
+def iter_csv(sql, params=None, fetch_size=None, row_fn=None, header=None):
+    """Yield CSV text chunks: the header, then one chunk per fetched batch."""
+    import csv
+    import io
+    wrote_header = False
+    for columns, rows in iter_query_rows(sql, params, fetch_size):
         output = io.StringIO()
         writer = csv.writer(output)
-        first = _dict_row(rows[0])
-        writer.writerow(first.keys())
-        for row in rows:
-            d = _dict_row(row)
-            writer.writerow(d.values())
-        return output.getvalue()
+        if not wrote_header:
+            writer.writerow(header or columns)
+            wrote_header = True
+        writer.writerows(map(row_fn, rows) if row_fn else rows)
+        if output.tell():
+            yield output.getvalue()
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of text (or bytes) chunks, yielding compressed bytes."""
+    import zlib
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_product_events_csv(start=None, end=None, event_types=None, fetch_size=None):
+    """Stream product_events as CSV chunks, newest first.
+
+    start/end are 'YYYY-MM-DD' (or datetime) bounds on timestamp, end exclusive;
+    event_types restricts to those types.
+    """
+    clauses, params = [], []
+    if start:
+        clauses.append("timestamp >= ?")
+        params.append(start.strftime("%Y-%m-%d %H:%M:%S") if isinstance(start, datetime) else str(start))
+    if end:
+        clauses.append("timestamp < ?")
+        params.append(end.strftime("%Y-%m-%d %H:%M:%S") if isinstance(end, datetime) else str(end))
+    if event_types:
+        clauses.append(f"event_type IN ({', '.join('?' * len(event_types))})")
+        params.extend(event_types)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = _q(f"SELECT * FROM product_events{where} ORDER BY timestamp DESC")
+    return iter_csv(sql, tuple(params), fetch_size)
+
+
+def get_product_events_csv(start=None, end=None, event_types=None):
+    """Returns product_events as one CSV string. Prefer iter_product_events_csv for large exports."""
+    return "".join(iter_product_events_csv(start, end, event_types))
+
+
+_USER_USAGE_SQL = """
+    SELECT u.username, u.email, u.subscription_tier, u.org_id, u.subscription_status,
+           COALESCE(SUM(c.total_weight), 0) AS actions_this_month
+    FROM users u
+    LEFT JOIN usage_counters c ON c.scope = 'user' AND c.scope_id = u.username AND c.billing_month = ?
+    GROUP BY u.username, u.email, u.subscription_tier, u.org_id, u.subscription_status, u.created_at
+    ORDER BY u.created_at DESC
+"""
+
+
+def get_monthly_usage_by_user(billing_month):
+    """{username: month's total action_weight} for every user in one query."""
+    conn = _get_connection()
+    try:
+        rows = _execute_plain(conn, _q(_USER_USAGE_SQL), (billing_month,)).fetchall()
+        return {_dict_row(r)['username']: _dict_row(r)['actions_this_month'] for r in rows}
     finally:
         conn.close()
 
 
+def iter_user_export_csv(billing_month, fetch_size=None):
+    """Stream the admin user export (with the month's usage) as CSV chunks."""
+    return iter_csv(
+        _q(_USER_USAGE_SQL), (billing_month,), fetch_size,
+        row_fn=lambda r: (r[0], r[1], r[2], r[3] or 'Solo', r[4], r[5]),
+        header=["username", "email", "tier", "org", "status", "actions_this_month"])
+
+
 def create_user_admin(username, email, password, tier='solo', org_id=None, org_role='member'):
     """Admin user creation — bypasses seat limits."""
     hashed = ph.hash(password)
@@ -2371,7 +4140,9 @@ def create_user_admin(username, email, password, tier='solo', org_id=None, org_r
             VALUES (?, ?, ?, ?, ?, ?, 'active', ?, ?)
         '''), (username, email, hashed, org_id, True if org_role == 'owner' else False,
               tier, org_role, datetime.now().isoformat()))
+        _publish_change(conn, "tier", username)
         conn.commit()
+        _invalidate_user_cache(username)
         return True
     except (sqlite3.IntegrityError if not is_postgres() else Exception) as e:
         if is_postgres():
@@ -0,0 +1,389 @@
+"""
+llm_gateway.py — Single choke point for Anthropic Messages API calls.
+
+Every Claude request in the process goes through one LLMGateway so that
+bursts from many Streamlit sessions are coordinated instead of each call
+site retrying on its own:
+
+    * a process-wide concurrency limit (LLM_MAX_CONCURRENCY), shared by
+      blocking, streaming and async calls
+    * token buckets for requests, input tokens and output tokens per minute
+      (LLM_REQUESTS_PER_MINUTE, LLM_INPUT_TOKENS_PER_MINUTE,
+      LLM_OUTPUT_TOKENS_PER_MINUTE; 0 disables a bucket)
+    * jittered exponential backoff that honours retry-after, pausing the
+      whole gateway rather than just the caller that was throttled
+    * queue-wait / retry metrics for the admin panel
+
+Usage:
+    import llm_gateway
+    resp = llm_gateway.call(client, model=..., max_tokens=..., system=..., messages=[...])
+    for event in llm_gateway.stream(client, ...): ...
+    resp = await llm_gateway.acall(async_client, ...)
+
+The gateway never changes the request; errors that survive the retries are
+re-raised unchanged so callers keep their own user-facing messages.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIG ---
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", "1000"))
+LLM_INPUT_TOKENS_PER_MINUTE = int(os.environ.get("LLM_INPUT_TOKENS_PER_MINUTE", "450000"))
+LLM_OUTPUT_TOKENS_PER_MINUTE = int(os.environ.get("LLM_OUTPUT_TOKENS_PER_MINUTE", "90000"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get("LLM_BACKOFF_BASE_SECONDS", "2"))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get("LLM_BACKOFF_MAX_SECONDS", "30"))
+
+IMAGE_TOKEN_ESTIMATE = 1600  # Upper bound for a ~1.15MP image after API resizing
+CHARS_PER_TOKEN = 4
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+_RETRYABLE_NAMES = {"APIConnectionError", "APITimeoutError", "ConnectionError", "TimeoutError"}
+
+
+class TokenBucket:
+    """Per-minute token bucket. Reservations may overdraw; the debt is the wait."""
+
+    def __init__(self, per_minute: int, clock=time.monotonic):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self._clock = clock
+        self._tokens = float(per_minute)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.per_minute, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` now; returns seconds the caller must wait before using it."""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._tokens -= min(amount, self.per_minute)
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, delta: float) -> None:
+        """Charge (positive) or refund (negative) once the real usage is known."""
+        if not self.enabled or not delta:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.per_minute, self._tokens - delta)
+
+
+def estimate_input_tokens(request: dict) -> int:
+    """Rough input size for admission: text chars / 4 plus a flat cost per image."""
+    chars, images = 0, 0
+
+    def _walk(content):
+        nonlocal chars, images
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for block in content:
+                _walk(block)
+        elif isinstance(content, dict):
+            if content.get("type") == "image":
+                images += 1
+            elif "text" in content:
+                chars += len(str(content["text"]))
+            elif "content" in content:
+                _walk(content["content"])
+
+    _walk(request.get("system", ""))
+    for message in request.get("messages", []):
+        _walk(message.get("content", ""))
+    return chars // CHARS_PER_TOKEN + images * IMAGE_TOKEN_ESTIMATE
+
+
+def _status_code(exc: Exception) -> int | None:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def _retry_after(exc: Exception) -> float | None:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    """Concurrency + rate limits + retries around client.messages.create."""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 input_tokens_per_minute: int = LLM_INPUT_TOKENS_PER_MINUTE,
+                 output_tokens_per_minute: int = LLM_OUTPUT_TOKENS_PER_MINUTE,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE_SECONDS,
+                 backoff_max: float = LLM_BACKOFF_MAX_SECONDS,
+                 clock=time.monotonic, sleep=time.sleep, rng: random.Random | None = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._requests = TokenBucket(requests_per_minute, clock)
+        self._input = TokenBucket(input_tokens_per_minute, clock)
+        self._output = TokenBucket(output_tokens_per_minute, clock)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=512)
+        self._stats = {"calls": 0, "errors": 0, "retries": 0, "rate_limited": 0,
+                       "in_flight": 0, "queue_wait_total": 0.0, "queue_wait_max": 0.0}
+
+    # --- admission ---
+
+    def _admission_delay(self, est_input: int, est_output: int) -> float:
+        """Reserve one request plus estimated tokens; returns the wait owed."""
+        delay = max(self._requests.reserve(1), self._input.reserve(est_input),
+                    self._output.reserve(est_output))
+        pause = self._paused_until - self._clock()
+        return max(delay, pause, 0.0)
+
+    def _record_wait(self, waited: float) -> None:
+        with self._lock:
+            self._waits.append(waited)
+            self._stats["queue_wait_total"] += waited
+            self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], waited)
+
+    def _enter(self) -> None:
+        with self._lock:
+            self._stats["in_flight"] += 1
+
+    def _exit(self) -> None:
+        with self._lock:
+            self._stats["in_flight"] -= 1
+
+    def _settle(self, response, est_input: int, est_output: int) -> None:
+        """Replace the token estimates with the usage the API reported."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        actual_in = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+        self._input.adjust(actual_in - est_input)
+        self._output.adjust((getattr(usage, "output_tokens", 0) or 0) - est_output)
+
+    def _refund(self, est_input: int, est_output: int) -> None:
+        """A failed attempt consumed no tokens; give the estimates back."""
+        self._input.adjust(-est_input)
+        self._output.adjust(-est_output)
+
+    # --- retries ---
+
+    def _retry_delay(self, exc: Exception, attempt: int) -> float | None:
+        """Seconds to wait before retrying `exc`, or None if it should surface now."""
+        if attempt >= self.max_retries:
+            return None
+        if "credit balance is too low" in str(exc).lower():
+            return None
+        status = _status_code(exc)
+        if status is None:
+            if type(exc).__name__ not in _RETRYABLE_NAMES:
+                return None
+        elif status not in RETRYABLE_STATUS:
+            return None
+
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            delay = min(retry_after, self.backoff_max)
+            # Throttling applies to the whole org key: hold every caller, not just this one
+            with self._lock:
+                self._paused_until = max(self._paused_until, self._clock() + delay)
+            return delay
+        return self._rng.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _note_retry(self, exc: Exception, attempt: int, delay: float) -> None:
+        with self._lock:
+            self._stats["retries"] += 1
+            if _status_code(exc) in (429, 529):
+                self._stats["rate_limited"] += 1
+        logger.warning("LLM call failed (attempt %d), retrying in %.1fs: %s", attempt + 1, delay, exc)
+
+    # --- sync facade ---
+
+    def call(self, client, **request):
+        """Blocking client.messages.create(**request) under the gateway's limits."""
+        est_input, est_output = estimate_input_tokens(request), int(request.get("max_tokens", 1024))
+        with self._lock:
+            self._stats["calls"] += 1
+        attempt = 0
+        while True:
+            queued = self._clock()
+            delay = self._admission_delay(est_input, est_output)
+            if delay > 0:
+                self._sleep(delay)
+            self._slots.acquire()
+            self._record_wait(self._clock() - queued)
+            self._enter()
+            try:
+                response = client.messages.create(**request)
+            except Exception as exc:
+                self._refund(est_input, est_output)
+                failure, retry = exc, self._retry_delay(exc, attempt)
+                if retry is None:
+                    with self._lock:
+                        self._stats["errors"] += 1
+                    raise
+            else:
+                self._settle(response, est_input, est_output)
+                return response
+            finally:
+                self._exit()
+                self._slots.release()
+            # Back off without holding a slot so other callers keep flowing
+            self._note_retry(failure, attempt, retry)
+            self._sleep(retry)
+            attempt += 1
+
+    # --- streaming facade ---
+
+    def stream(self, client, **request):
+        """Yield raw events from client.messages.stream(**request) under the gateway's limits.
+
+        The slot is held until the stream is exhausted or closed. Failures are
+        retried only before the first event; after that the caller has already
+        rendered partial output, so the error surfaces unchanged.
+        """
+        est_input, est_output = estimate_input_tokens(request), int(request.get("max_tokens", 1024))
+        with self._lock:
+            self._stats["calls"] += 1
+        attempt = 0
+        while True:
+            queued = self._clock()
+            delay = self._admission_delay(est_input, est_output)
+            if delay > 0:
+                self._sleep(delay)
+            self._slots.acquire()
+            self._record_wait(self._clock() - queued)
+            self._enter()
+            streamed = False
+            try:
+                with client.messages.stream(**request) as events:
+                    for event in events:
+                        streamed = True
+                        yield event
+                    response = events.get_final_message()
+            except Exception as exc:
+                retry = None
+                if not streamed:
+                    self._refund(est_input, est_output)
+                    retry = self._retry_delay(exc, attempt)
+                failure = exc
+                if retry is None:
+                    with self._lock:
+                        self._stats["errors"] += 1
+                    raise
+            else:
+                self._settle(response, est_input, est_output)
+                return
+            finally:
+                self._exit()
+                self._slots.release()
+            self._note_retry(failure, attempt, retry)
+            self._sleep(retry)
+            attempt += 1
+
+    # --- async facade ---
+
+    async def acall(self, client, **request):
+        """Awaitable variant; accepts an async client or runs a sync one in a thread."""
+        est_input, est_output = estimate_input_tokens(request), int(request.get("max_tokens", 1024))
+        create = client.messages.create
+        is_async = inspect.iscoroutinefunction(create)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._stats["calls"] += 1
+        attempt = 0
+        while True:
+            queued = self._clock()
+            delay = self._admission_delay(est_input, est_output)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Shares the process-wide semaphore with sync callers without blocking the loop
+            poll = 0.005
+            while not self._slots.acquire(blocking=False):
+                await asyncio.sleep(poll)
+                poll = min(poll * 2, 0.1)
+            self._record_wait(self._clock() - queued)
+            self._enter()
+            try:
+                if is_async:
+                    response = await create(**request)
+                else:
+                    response = await loop.run_in_executor(None, functools.partial(create, **request))
+            except Exception as exc:
+                self._refund(est_input, est_output)
+                failure, retry = exc, self._retry_delay(exc, attempt)
+                if retry is None:
+                    with self._lock:
+                        self._stats["errors"] += 1
+                    raise
+            else:
+                self._settle(response, est_input, est_output)
+                return response
+            finally:
+                self._exit()
+                self._slots.release()
+            self._note_retry(failure, attempt, retry)
+            await asyncio.sleep(retry)
+            attempt += 1
+
+    # --- metrics ---
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            waits = sorted(self._waits)
+        stats["max_concurrency"] = self.max_concurrency
+        stats["queue_wait_p50"] = waits[len(waits) // 2] if waits else 0.0
+        stats["queue_wait_p95"] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        stats["queue_wait_avg"] = stats["queue_wait_total"] / len(waits) if waits else 0.0
+        return stats
+
+
+# Process-wide instance used by logic.py and visual_audit.py
+GATEWAY = LLMGateway()
+
+
+def call(client, **request):
+    return GATEWAY.call(client, **request)
+
+
+def stream(client, **request):
+    return GATEWAY.stream(client, **request)
+
+
+async def acall(client, **request):
+    return await GATEWAY.acall(client, **request)
+
+
+def get_stats() -> dict:
+    return GATEWAY.get_stats()
@@ -8,12 +8,16 @@ Each section header IS an investor question.
 import streamlit as st
 import pandas as pd
 import json
+import logging
 from datetime import datetime, timedelta
 
 import db_manager as db
 from tier_config import TIER_CONFIG
 import brand_ui
 
+# Rollup batches folded per dashboard render (ANALYTICS_ROLLUP_BATCH events each)
+PAGE_ROLLUP_MAX_BATCHES = 2
+
 # ── Castellan palette constants ───────────────────────────────────────────────
 GOLD = "#ab8f59"
 TEAL = "#24363b"
@@ -174,6 +178,14 @@ def render_product_analytics():
 
     st.markdown('<div class="analytics-section">', unsafe_allow_html=True)
 
+    # analytics_worker.py keeps the rollups current; this is only a bounded
+    # top-up so events since its last pass are folded before the sections
+    # below read closed days from the rollups (and the rest raw).
+    try:
+        db.refresh_analytics_rollups(max_batches=PAGE_ROLLUP_MAX_BATCHES)
+    except Exception as e:
+        logging.warning(f"Analytics rollup refresh failed: {e}")
+
     _section_1_who_is_using()
     _section_2_do_they_come_back()
     _section_3_what_do_they_do()
@@ -783,14 +795,26 @@ def _section_exports():
 
     with c2:
         st.markdown("### Raw Events Export")
-        st.caption("Full product_events dump for due diligence.")
+        st.caption("product_events dump for due diligence. Leave filters empty for everything. "
+                   "Rows are read in batches, but the finished file is held in memory for the "
+                   "download, so narrow the dates or types on very large exports.")
+        date_range = st.date_input("Date range", value=(), key="pa_export_dates")
+        event_types = st.multiselect("Event types", db.PRODUCT_EVENT_TYPES, key="pa_export_types")
+        compress = st.checkbox("Compress (gzip)", value=True, key="pa_export_gzip")
         if st.button("Export Raw Events (CSV)", key="pa_export_csv"):
-            csv_data = db.get_product_events_csv()
+            start = date_range[0] if len(date_range) > 0 else None
+            end = date_range[1] + timedelta(days=1) if len(date_range) > 1 else None
+            chunks = db.iter_product_events_csv(start=start, end=end, event_types=event_types or None)
+            file_name = f"signet_product_events_{datetime.now().strftime('%Y%m%d')}.csv"
+            if compress:
+                data, file_name, mime = b"".join(db.gzip_chunks(chunks)), file_name + ".gz", "application/gzip"
+            else:
+                data, mime = "".join(chunks), "text/csv"
             st.download_button(
                 "Download CSV",
-                csv_data,
-                file_name=f"signet_product_events_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv",
+                data,
+                file_name=file_name,
+                mime=mime,
                 key="pa_download_csv"
             )
 
@@ -5,12 +5,18 @@ All AI modules call build_brand_context() or build_social_context() instead
 of assembling brand data independently. Handles voice cluster filtering,
 calibration status injection, and graceful degradation notices.
 
-Pure functions only (stdlib: json, re). No Streamlit, no Anthropic.
+Pure functions only (stdlib). No Streamlit, no Anthropic. The one piece of
+state is a memo of assembled contexts keyed by profile content fingerprint
+(see build_brand_context / invalidate_brand_context_cache).
 """
 from __future__ import annotations
 
+import hashlib
 import json
+import os
 import re
+import threading
+from collections import OrderedDict
 
 from content_types import VOICE_CLUSTER_NAMES, CONTENT_TYPES
 
@@ -40,6 +46,10 @@ _MH_FIELDS = [
 ]
 
 
+# Memoized brand contexts (and parsed voice clusters) kept in memory
+BRAND_CONTEXT_CACHE_MAX = int(os.environ.get("BRAND_CONTEXT_CACHE_MAX", "128"))
+
+
 # ---------------------------------------------------------------------------
 # Internal helpers
 # ---------------------------------------------------------------------------
@@ -141,6 +151,75 @@ def get_cluster_status(voice_dna: str) -> dict:
     return result
 
 
+# ---------------------------------------------------------------------------
+# Context memo — keyed by profile content, so edits never serve stale text
+# ---------------------------------------------------------------------------
+
+_context_cache: OrderedDict = OrderedDict()  # (fingerprint, filter, samples) -> str
+_voice_cache: OrderedDict = OrderedDict()    # voice_dna hash -> parsed voice data
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def profile_fingerprint(brand_data: dict) -> str:
+    """SHA-256 of the profile inputs that feed build_brand_context.
+
+    voice_dna (often megabytes of base64 image refs) is hashed directly
+    instead of going through JSON serialisation.
+    """
+    inputs = brand_data.get("inputs", {}) or {}
+    voice_dna = inputs.get("voice_dna", "")
+    rest = {k: v for k, v in inputs.items() if k != "voice_dna"}
+    h = hashlib.sha256(json.dumps(rest, sort_keys=True, default=str).encode())
+    h.update(b"\0")
+    h.update(str(voice_dna or "").encode())
+    return h.hexdigest()
+
+
+def _cache_put(cache: OrderedDict, key, value) -> None:
+    with _cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > BRAND_CONTEXT_CACHE_MAX:
+            cache.popitem(last=False)
+
+
+def _analyze_voice(voice_dna: str) -> dict:
+    """Cluster statuses, parsed cluster map and cleaned blob — parsed once per voice_dna."""
+    key = hashlib.sha256(voice_dna.encode()).hexdigest()
+    with _cache_lock:
+        cached = _voice_cache.get(key)
+        if cached is not None:
+            _voice_cache.move_to_end(key)
+            return cached
+    analysis = {
+        "statuses": get_cluster_status(voice_dna),
+        "clusters": parse_voice_clusters(voice_dna),
+        "cleaned": _clean_dna(voice_dna),
+    }
+    _cache_put(_voice_cache, key, analysis)
+    return analysis
+
+
+def get_brand_context_cache_stats() -> dict:
+    """Hit/miss counters for the brand context memo."""
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["entries"] = len(_context_cache)
+        stats["voice_entries"] = len(_voice_cache)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
+
+
+def invalidate_brand_context_cache() -> None:
+    """Drop memoized contexts — called when a profile is saved."""
+    with _cache_lock:
+        _context_cache.clear()
+        _voice_cache.clear()
+        _cache_stats["invalidations"] += 1
+
+
 # ---------------------------------------------------------------------------
 # Message House builder (moved from app.py — verbatim logic)
 # ---------------------------------------------------------------------------
@@ -303,7 +382,31 @@ def build_brand_context(
 
     Returns:
         Formatted brand context string ready for injection into prompts.
+
+    Results are memoized by (profile_fingerprint, cluster_filter,
+    include_voice_samples); the parsed voice clusters are shared across
+    filters, so a voice_dna blob is parsed once per content version.
     """
+    key = (profile_fingerprint(brand_data), cluster_filter, include_voice_samples)
+    with _cache_lock:
+        cached = _context_cache.get(key)
+        if cached is not None:
+            _context_cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+            return cached
+        _cache_stats["misses"] += 1
+
+    context = _assemble_brand_context(brand_data, include_voice_samples, cluster_filter)
+    _cache_put(_context_cache, key, context)
+    return context
+
+
+def _assemble_brand_context(
+    brand_data: dict,
+    include_voice_samples: bool,
+    cluster_filter: str | None,
+) -> str:
+    """Uncached body of build_brand_context."""
     inputs = brand_data.get("inputs", {})
     sections = []
 
@@ -344,20 +447,17 @@ def build_brand_context(
         sections.append(mh_block)
 
     # --- Voice samples ---
-    if include_voice_samples:
-        voice_dna = inputs.get("voice_dna", "").strip()
-        if voice_dna:
-            cluster_statuses = get_cluster_status(voice_dna)
-            voice_section = _build_voice_section(
-                voice_dna, cluster_filter, cluster_statuses
-            )
-            if voice_section:
-                sections.append(voice_section)
+    voice_dna = inputs.get("voice_dna", "").strip()
+    voice = _analyze_voice(voice_dna)
+    if include_voice_samples and voice_dna:
+        voice_section = _build_voice_section(
+            voice_dna, cluster_filter, voice["statuses"], voice=voice
+        )
+        if voice_section:
+            sections.append(voice_section)
 
     # --- Data completeness ---
-    voice_dna_raw = inputs.get("voice_dna", "").strip()
-    cluster_statuses = get_cluster_status(voice_dna_raw)
-    completeness = _build_completeness_block(inputs, cluster_filter, cluster_statuses)
+    completeness = _build_completeness_block(inputs, cluster_filter, voice["statuses"])
     sections.append(completeness)
 
     sections.append("=== END BRAND PROFILE ===")
@@ -369,17 +469,22 @@ def _build_voice_section(
     voice_dna: str,
     cluster_filter: str | None,
     cluster_statuses: dict,
+    voice: dict | None = None,
 ) -> str:
-    """Build the voice samples section with optional cluster filtering."""
+    """Build the voice samples section with optional cluster filtering.
+
+    `voice` is the _analyze_voice result for voice_dna, when already parsed.
+    """
     if not voice_dna:
         return ""
+    if voice is None:
+        voice = {"clusters": parse_voice_clusters(voice_dna), "cleaned": _clean_dna(voice_dna)}
 
     if cluster_filter:
         cs = cluster_statuses.get(cluster_filter, {"count": 0, "status": "EMPTY"})
         if cs["count"] > 0:
             # Filter to just this cluster's samples
-            clusters = parse_voice_clusters(voice_dna)
-            samples = clusters.get(cluster_filter, [])
+            samples = voice["clusters"].get(cluster_filter, [])
             if samples:
                 header = (
                     f"=== VOICE REFERENCE SAMPLES ({cluster_filter} cluster) ==="
@@ -389,7 +494,7 @@ def _build_voice_section(
                 return f"{header}\n\n{body}\n\n{footer}"
 
         # Cluster is empty — fall back to all available samples
-        cleaned = _clean_dna(voice_dna)
+        cleaned = voice["cleaned"]
         if cleaned.strip():
             header = (
                 "=== VOICE REFERENCE SAMPLES (all available clusters) ===\n"
@@ -402,7 +507,7 @@ def _build_voice_section(
         return ""
 
     # No filter — include everything (cleaned)
-    cleaned = _clean_dna(voice_dna)
+    cleaned = voice["cleaned"]
     if cleaned.strip():
         header = "=== VOICE REFERENCE SAMPLES ==="
         footer = "=== END VOICE SAMPLES ==="
@@ -468,9 +573,9 @@ def build_social_context(brand_data: dict) -> str:
 
     # --- Brand Marketing voice samples (secondary tone reference) ---
     voice_dna = inputs.get("voice_dna", "").strip()
+    voice = _analyze_voice(voice_dna)
     if voice_dna:
-        clusters = parse_voice_clusters(voice_dna)
-        bm_samples = clusters.get("Brand Marketing", [])
+        bm_samples = voice["clusters"].get("Brand Marketing", [])
         if bm_samples:
             sections.append(
                 "=== BRAND VOICE REFERENCE (Brand Marketing cluster) ===\n\n"
@@ -479,7 +584,7 @@ def build_social_context(brand_data: dict) -> str:
             )
 
     # --- Data completeness ---
-    cluster_statuses = get_cluster_status(voice_dna)
+    cluster_statuses = voice["statuses"]
     # Social-specific notices
     completeness_lines = ["\n=== DATA COMPLETENESS ==="]
 
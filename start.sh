@@ -4,5 +4,11 @@
 echo "Starting Lemon Squeezy webhook handler on port 8001..."
 uvicorn webhook_handler:app --host 0.0.0.0 --port 8001 &
 
+echo "Starting Lemon Squeezy reconciliation worker..."
+python subscription_sync.py &
+
+echo "Starting analytics rollup worker..."
+python analytics_worker.py &
+
 echo "Starting Streamlit on port 8501..."
 streamlit run app.py --server.port 8501 --server.address 0.0.0.0
@@ -3,6 +3,7 @@ subscription_manager.py — Tier resolution, usage metering, and access checks.
 
 Public API (import subscription_manager as sub_manager):
     sub_manager.resolve_user_tier(username)         → tier config dict
+    sub_manager.invalidate_tier_cache(username)     → None (evicts in every process)
     sub_manager.sync_user_status(username, email)   → same (backward-compat alias)
     sub_manager.check_brand_limit(username)         → {"allowed": bool, "current": int, "max": int}
     sub_manager.check_seat_limit(org_id)            → {"allowed": bool, "current": int, "max": int}
@@ -14,14 +15,17 @@ from __future__ import annotations
 
 import logging
 import os
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import requests
 import streamlit as st
 
 import db_manager as db
-from tier_config import TIER_CONFIG, PROTECTED_TIERS, get_tier_from_variant_id
+from tier_config import TIER_CONFIG, PROTECTED_TIERS, LS_STATUS_MAP, get_tier_from_variant_id
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +33,8 @@ logger = logging.getLogger(__name__)
 LS_API_KEY = os.environ.get("LEMONSQUEEZY_API_KEY", "")
 LS_STORE_ID = os.environ.get("LEMONSQUEEZY_STORE_ID", "291028")
 LS_CACHE_TTL_SECONDS = 3600  # 60 minutes
+TIER_CACHE_MAX = int(os.environ.get("TIER_CACHE_MAX", "1024"))
+TIER_INVALIDATION_POLL_SECONDS = float(os.environ.get("TIER_INVALIDATION_POLL_SECONDS", "5"))
 
 _LS_HEADERS = {
     "Accept": "application/vnd.api+json",
@@ -37,19 +43,6 @@ _LS_HEADERS = {
 }
 
 
-# ── Lemon Squeezy status → subscription_status mapping ──────────────────────
-
-_LS_STATUS_MAP = {
-    "active":    "active",
-    "on_trial":  "active",
-    "past_due":  "past_due",
-    "cancelled": "cancelled",
-    "expired":   "cancelled",
-    "unpaid":    "cancelled",
-    "paused":    "inactive",
-}
-
-
 def _poll_ls_for_email(email: str) -> tuple[str | None, str | None, str | None]:
     """
     Poll Lemon Squeezy API for the most recent subscription by email.
@@ -81,7 +74,7 @@ def _poll_ls_for_email(email: str) -> tuple[str | None, str | None, str | None]:
         sub_id = str(latest.get("id", ""))
 
         tier_key = get_tier_from_variant_id(variant_id) or "solo"
-        mapped_status = _LS_STATUS_MAP.get(ls_status, "inactive")
+        mapped_status = LS_STATUS_MAP.get(ls_status, "inactive")
 
         return tier_key, mapped_status, sub_id
 
@@ -90,29 +83,162 @@ def _poll_ls_for_email(email: str) -> tuple[str | None, str | None, str | None]:
         return None, None, None
 
 
+# ── Shared tier cache ────────────────────────────────────────────────────────
+# Process-wide (all Streamlit sessions) TTL + LRU cache of resolved tiers.
+# Entries past the TTL are served stale while a worker thread re-resolves
+# them, so the Lemon Squeezy poll never runs in the render path. Writers in
+# db_manager publish "tier" change notices (webhook included); every
+# TIER_INVALIDATION_POLL_SECONDS the cache reads new notices and evicts.
+
+_tier_cache: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()
+_tier_cache_lock = threading.Lock()
+_tier_cache_stats = {"hits": 0, "misses": 0, "stale": 0, "invalidations": 0, "background_refreshes": 0}
+_tier_change_id: int | None = None
+_tier_last_poll = 0.0
+_tier_seen_local_changes = -1
+_tier_refreshing: set[str] = set()
+_tier_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tier-refresh")
+
+
+def _sync_tier_invalidations(force: bool = False) -> None:
+    """Evict cache entries named by change notices published since the last poll."""
+    global _tier_change_id, _tier_last_poll, _tier_seen_local_changes
+    now = time.time()
+    local_changes = db.local_change_count()
+    # Writes made by this process are visible immediately; others within the poll interval
+    if (not force and local_changes == _tier_seen_local_changes
+            and now - _tier_last_poll < TIER_INVALIDATION_POLL_SECONDS):
+        return
+    _tier_last_poll = now
+    _tier_seen_local_changes = local_changes
+    try:
+        latest, keys = db.get_changes_since("tier", _tier_change_id)
+    except Exception as e:
+        logger.warning(f"Tier invalidation poll failed: {e}")
+        return
+    with _tier_cache_lock:
+        if _tier_change_id is None:
+            _tier_cache.clear()  # Nothing seen before the baseline can be trusted
+        for key in keys:
+            if key is None:
+                _tier_cache.clear()
+            else:
+                _tier_cache.pop(key, None)
+        _tier_cache_stats["invalidations"] += len(keys)
+        _tier_change_id = latest
+
+
+def _tier_cache_put(username: str, result: dict) -> None:
+    with _tier_cache_lock:
+        _tier_cache[username] = (dict(result), time.time())
+        _tier_cache.move_to_end(username)
+        while len(_tier_cache) > TIER_CACHE_MAX:
+            _tier_cache.popitem(last=False)
+
+
+def _refresh_tier(username: str) -> None:
+    """Worker: re-resolve synchronously (may poll LS) and store the result.
+
+    If a tier notice for the user lands while resolving (this refresh's own
+    write, or a webhook racing it), the result may predate it: the entry is
+    dropped instead, and the next lookup re-resolves from the users row. Only
+    ids past the baseline count here; the regular poll re-reads the lag window.
+    """
+    try:
+        baseline, _ = db.get_changes_since("tier")
+        result = _resolve_user_tier_uncached(username, poll_in_background=False)
+        _, keys = db.get_changes_since("tier", baseline, lag_seconds=0)
+        if username in keys or None in keys:
+            with _tier_cache_lock:
+                _tier_cache.pop(username, None)
+        else:
+            _tier_cache_put(username, result)
+        _tier_cache_stats["background_refreshes"] += 1
+    except Exception as e:
+        logger.warning(f"Background tier refresh failed for {username!r}: {e}")
+    finally:
+        with _tier_cache_lock:
+            _tier_refreshing.discard(username)
+
+
+def _schedule_tier_refresh(username: str) -> None:
+    """Queue one background refresh per user; duplicates are dropped."""
+    with _tier_cache_lock:
+        if username in _tier_refreshing:
+            return
+        _tier_refreshing.add(username)
+    _tier_executor.submit(_refresh_tier, username)
+
+
+def invalidate_tier_cache(username: str | None = None) -> None:
+    """Drop a user's cached tier (or all) here and in every other process."""
+    with _tier_cache_lock:
+        if username is None:
+            _tier_cache.clear()
+        else:
+            _tier_cache.pop(username, None)
+    db.publish_change("tier", username)
+
+
+def get_tier_cache_stats() -> dict:
+    """Counters for the admin panel."""
+    with _tier_cache_lock:
+        stats = dict(_tier_cache_stats)
+        stats["entries"] = len(_tier_cache)
+        stats["refreshing"] = len(_tier_refreshing)
+    lookups = stats["hits"] + stats["stale"] + stats["misses"]
+    stats["hit_rate"] = (stats["hits"] + stats["stale"]) / lookups if lookups else 0.0
+    return stats
+
+
 # ── Core tier resolution ─────────────────────────────────────────────────────
 
-def resolve_user_tier(username: str) -> dict:
+def resolve_user_tier(username: str, force_refresh: bool = False) -> dict:
     """
     Resolves and returns the full tier config dict for a user.
 
-    Resolution order:
-    1. Protected tiers (retainer, super_admin) → bypass LS entirely
-    2. Session cache (within TTL) → use cached tier
-    3. DB cache (last_subscription_sync within 60 min) → use DB tier
-    4. Poll Lemon Squeezy → update DB + session + return fresh tier
+    Served from the shared tier cache when possible; an expired entry is
+    returned as-is while a background refresh runs. force_refresh bypasses
+    the cache and polls Lemon Squeezy synchronously (manual "sync" buttons).
 
     Always returns a TIER_CONFIG dict augmented with:
         "_tier_key": str
         "_subscription_status": str
     """
-    # Check session cache first
-    cached_at = st.session_state.get("_tier_resolved_at", 0)
-    if time.time() - cached_at < LS_CACHE_TTL_SECONDS:
-        cached = st.session_state.get("tier")
-        if cached and "_tier_key" in cached:
-            return cached
+    _sync_tier_invalidations()
+
+    if not force_refresh:
+        with _tier_cache_lock:
+            entry = _tier_cache.get(username)
+            if entry is not None:
+                _tier_cache.move_to_end(username)
+        if entry is not None:
+            result, resolved_at = entry
+            if time.time() - resolved_at < LS_CACHE_TTL_SECONDS:
+                _tier_cache_stats["hits"] += 1
+            else:
+                _tier_cache_stats["stale"] += 1
+                _schedule_tier_refresh(username)
+            return dict(result)
 
+    _tier_cache_stats["misses"] += 1
+    result = _resolve_user_tier_uncached(username, poll_in_background=not force_refresh)
+    _tier_cache_put(username, result)
+    return result
+
+
+def _resolve_user_tier_uncached(username: str, poll_in_background: bool = True) -> dict:
+    """
+    Resolves the tier from the users table, polling Lemon Squeezy when stale.
+
+    Resolution order:
+    1. Protected tiers (retainer, super_admin) → bypass LS entirely
+    2. Comp access / override / trial → derived from the user row
+    3. DB cache (last_subscription_sync within 60 min) → use DB tier
+    4. Poll Lemon Squeezy → update DB + return fresh tier. With
+       poll_in_background the poll is handed to a worker thread and the DB
+       tier is returned immediately.
+    """
     user = db.get_user_full(username)
     if not user:
         logger.warning(f"resolve_user_tier: user {username!r} not found")
@@ -177,10 +303,15 @@ def resolve_user_tier(username: str) -> dict:
 
     # 3. Poll Lemon Squeezy
     email = user.get("email", "")
+    if poll_in_background and LS_API_KEY:
+        _schedule_tier_refresh(username)
+        return _build_tier_result(tier_key, sub_status)
     ls_tier_key, ls_status, ls_sub_id = _poll_ls_for_email(email)
 
     if ls_tier_key and ls_status:
-        db.set_user_subscription(username, ls_tier_key, ls_status, ls_sub_id)
+        # Same tier and status: record the sync without a tier change notice
+        changed = (ls_tier_key, ls_status) != (tier_key, sub_status)
+        db.set_user_subscription(username, ls_tier_key, ls_status, ls_sub_id, publish=changed)
         return _build_tier_result(ls_tier_key, ls_status)
 
     # LS poll failed — return DB values as-is
@@ -408,22 +539,11 @@ def check_usage_limit(username: str) -> dict:
     org_id = user.get("org_id") or username
     billing_month = datetime.now().strftime("%Y-%m")
 
-    # Exclude impersonated actions from soft cap calculation
-    conn = db._get_connection()
-    try:
-        _imp_filter = "is_impersonated = FALSE OR is_impersonated IS NULL" if db.is_postgres() else "is_impersonated = 0 OR is_impersonated IS NULL"
-        if tier_key == "solo":
-            used = db._fetchone_val(db._execute_plain(
-                conn, db._q(f"SELECT COALESCE(SUM(action_weight), 0) FROM usage_tracking "
-                            f"WHERE username = ? AND billing_month = ? AND ({_imp_filter})"),
-                (username, billing_month)), 0)
-        else:
-            used = db._fetchone_val(db._execute_plain(
-                conn, db._q(f"SELECT COALESCE(SUM(action_weight), 0) FROM usage_tracking "
-                            f"WHERE org_id = ? AND billing_month = ? AND ({_imp_filter})"),
-                (org_id, billing_month)), 0)
-    finally:
-        conn.close()
+    # Single-row counter read; impersonated actions are excluded from the soft cap
+    if tier_key == "solo":
+        used = db.get_usage_counter("user", username, billing_month)
+    else:
+        used = db.get_usage_counter("org", org_id, billing_month)
 
     pct = (used / limit * 100) if limit > 0 else 0.0
 
@@ -0,0 +1,257 @@
+"""
+subscription_sync.py — Scheduled Lemon Squeezy → users reconciliation.
+
+Pages through every subscription in the store over one pooled HTTP session,
+diffs the latest subscription per email against the users table and applies
+all changes in a single transaction. Interactive page loads then find a fresh
+last_subscription_sync and never poll Lemon Squeezy themselves.
+
+Run alongside Streamlit via start.sh:
+    python subscription_sync.py                  # loop every LS_RECONCILE_INTERVAL_SECONDS
+    python subscription_sync.py --once           # single pass (cron)
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import db_manager as db
+from tier_config import PROTECTED_TIERS, LS_STATUS_MAP, get_tier_from_variant_id
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIG ---
+LS_API_KEY = os.environ.get("LEMONSQUEEZY_API_KEY", "")
+LS_STORE_ID = os.environ.get("LEMONSQUEEZY_STORE_ID", "291028")
+LS_API_BASE = os.environ.get("LEMONSQUEEZY_API_BASE", "https://api.lemonsqueezy.com/v1")
+LS_RECONCILE_INTERVAL_SECONDS = int(os.environ.get("LS_RECONCILE_INTERVAL_SECONDS", "900"))
+LS_PAGE_SIZE = 100
+MAX_PAGES = 1000
+RUN_STATS_KEY = "ls_reconcile_last_run"
+
+
+def make_session(api_key: str = None) -> requests.Session:
+    """Keep-alive session with retries on throttling and transient 5xx."""
+    session = requests.Session()
+    session.headers.update({
+        "Accept": "application/vnd.api+json",
+        "Content-Type": "application/vnd.api+json",
+        "Authorization": f"Bearer {api_key if api_key is not None else LS_API_KEY}",
+    })
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_store_subscriptions(session: requests.Session, base_url: str = None, store_id: str = None,
+                              stats: dict = None):
+    """Yield every subscription object in the store, one page at a time."""
+    url = f"{(base_url or LS_API_BASE).rstrip('/')}/subscriptions"
+    page = 1
+    while True:
+        if page > MAX_PAGES:
+            # Stopping here would reconcile against a partial store
+            raise RuntimeError(f"LS subscriptions exceed MAX_PAGES ({MAX_PAGES} pages of {LS_PAGE_SIZE})")
+        resp = session.get(url, params={
+            "filter[store_id]": store_id or LS_STORE_ID,
+            "page[number]": page,
+            "page[size]": LS_PAGE_SIZE,
+        }, timeout=30)
+        if resp.status_code != 200:
+            raise RuntimeError(f"LS API returned {resp.status_code} on page {page}")
+        body = resp.json()
+        data = body.get("data", [])
+        if stats is not None:
+            stats["pages"] += 1
+        yield from data
+
+        last_page = body.get("meta", {}).get("page", {}).get("lastPage")
+        has_next = page < last_page if last_page else bool(body.get("links", {}).get("next"))
+        if not data or not has_next:
+            return
+        page += 1
+
+
+def latest_by_email(subscriptions) -> dict:
+    """Most recently created subscription per (lower-cased) customer email."""
+    latest = {}
+    for sub in subscriptions:
+        attrs = sub.get("attributes", {})
+        email = (attrs.get("user_email") or "").strip().lower()
+        if not email:
+            continue
+        current = latest.get(email)
+        if current is None or (attrs.get("created_at") or "") >= (current["attributes"].get("created_at") or ""):
+            latest[email] = sub
+    return latest
+
+
+def _as_datetime(value):
+    """datetime from a DB value (datetime or ISO string); None if unparseable."""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", ""))
+    except (ValueError, TypeError):
+        return None
+
+
+def skip_reason(user: dict, now: datetime = None) -> str | None:
+    """Why resolve_user_tier would not use LS for this user, or None.
+
+    Mirrors its precedence: protected tier, active comp access, active
+    subscription override, then a running trial without a paid subscription.
+    """
+    now = now or datetime.now()
+    if (user.get("subscription_tier") or "solo") in PROTECTED_TIERS:
+        return "protected"
+    for reason, column in (("comp", "comp_expires_at"), ("override", "subscription_override_until")):
+        until = _as_datetime(user.get(column)) if user.get(column) else None
+        if until and until > now:
+            return reason
+    started = _as_datetime(user.get("trial_start_date")) if user.get("trial_start_date") else None
+    if (started and not user.get("trial_expired") and not user.get("lemon_squeezy_subscription_id")
+            and (now - started).days < db.TRIAL_DAYS):
+        return "trial"
+    return None
+
+
+def plan_changes(users: list[dict], latest: dict) -> tuple[list, list, dict]:
+    """Diff users against LS. Returns (changes, unchanged usernames, counts)."""
+    changes, unchanged = [], []
+    counts = {"users_matched": 0, "skipped_protected": 0, "skipped_comp": 0,
+              "skipped_override": 0, "skipped_trial": 0}
+    now = datetime.now()
+    for user in users:
+        sub = latest.get((user.get("email") or "").strip().lower())
+        if sub is None:
+            continue
+        counts["users_matched"] += 1
+        reason = skip_reason(user, now)
+        if reason:
+            counts[f"skipped_{reason}"] += 1
+            continue
+
+        attrs = sub.get("attributes", {})
+        variant_id = attrs.get("variant_id")
+        target = (
+            get_tier_from_variant_id(variant_id) or "solo",
+            LS_STATUS_MAP.get(attrs.get("status", ""), "inactive"),
+            str(sub.get("id", "")),
+            str(variant_id) if variant_id is not None else None,
+        )
+        current = (
+            user.get("subscription_tier"),
+            user.get("subscription_status"),
+            str(user.get("lemon_squeezy_subscription_id") or ""),
+            str(user["lemon_squeezy_variant_id"]) if user.get("lemon_squeezy_variant_id") else None,
+        )
+        if target == current:
+            unchanged.append(user["username"])
+        else:
+            changes.append((user["username"],) + target)
+    return changes, unchanged, counts
+
+
+def reconcile_subscriptions(session: requests.Session = None, base_url: str = None,
+                            store_id: str = None) -> dict:
+    """One full reconciliation pass. Returns (and records) the run stats."""
+    started = time.perf_counter()
+    stats = {
+        "started_at": datetime.now().isoformat(),
+        "status": "ok",
+        "pages": 0,
+        "subscriptions": 0,
+        "emails": 0,
+        "users_matched": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "skipped_protected": 0,
+        "skipped_comp": 0,
+        "skipped_override": 0,
+        "skipped_trial": 0,
+    }
+    owns_session = session is None
+    if owns_session and not LS_API_KEY:
+        logger.info("No LS_API_KEY set — skipping reconciliation")
+        stats["status"] = "skipped"
+        return stats
+
+    session = session or make_session()
+    try:
+        subscriptions = list(fetch_store_subscriptions(session, base_url, store_id, stats))
+        stats["subscriptions"] = len(subscriptions)
+        latest = latest_by_email(subscriptions)
+        stats["emails"] = len(latest)
+
+        changes, unchanged, counts = plan_changes(db.get_subscription_sync_candidates(), latest)
+        stats.update(counts)
+        db.apply_subscription_sync(changes, unchanged)
+        stats["updated"] = len(changes)
+        stats["unchanged"] = len(unchanged)
+    except Exception as e:
+        logger.warning(f"LS reconciliation failed: {e}")
+        stats["status"] = "error"
+        stats["error"] = str(e)
+    finally:
+        if owns_session:
+            session.close()
+
+    stats["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    try:
+        db.set_platform_setting(RUN_STATS_KEY, json.dumps(stats), updated_by="subscription_sync")
+    except Exception as e:
+        logger.warning(f"Could not record reconciliation stats: {e}")
+    logger.info(f"LS reconciliation: {stats}")
+    return stats
+
+
+def get_last_run() -> dict | None:
+    """Stats from the most recent recorded run, or None."""
+    raw = db.get_platform_setting(RUN_STATS_KEY)
+    try:
+        return json.loads(raw) if raw else None
+    except (TypeError, ValueError):
+        return None
+
+
+def run_forever(interval: int = LS_RECONCILE_INTERVAL_SECONDS) -> None:
+    """Reconcile every `interval` seconds, reusing one pooled session."""
+    if not LS_API_KEY:
+        logger.info("No LS_API_KEY set — reconciliation worker not started")
+        return
+    session = make_session()
+    while True:
+        reconcile_subscriptions(session)
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile Lemon Squeezy subscriptions into the users table.")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--interval", type=int, default=LS_RECONCILE_INTERVAL_SECONDS,
+                        help="seconds between passes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.once:
+        stats = reconcile_subscriptions()
+        return 0 if stats["status"] != "error" else 1
+    run_forever(args.interval)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
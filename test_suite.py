@@ -2080,6 +2080,2476 @@ def test_password_reset_tokens_table():
         conn.close()
 
 
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 16: Connection Pooling
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_pool_sqlite_reuses_connection():
+    """Sequential calls on one thread reuse the same SQLite connection."""
+    import db_manager as db
+    before = db.get_pool_stats()
+    db.get_user_full("testuser1")
+    db.get_profiles("testuser1")
+    db.get_org_logs("testuser1")
+    after = db.get_pool_stats()
+    if after["backend"] != "sqlite":
+        return f"Expected sqlite backend, got {after['backend']}"
+    if after["checkouts"] - before["checkouts"] < 3:
+        return f"Expected >= 3 checkouts, got {after['checkouts'] - before['checkouts']}"
+    if after["created"] != before["created"]:
+        return f"Opened {after['created'] - before['created']} new connections, expected 0"
+    if after["in_use"] != 0:
+        return f"in_use should be 0 after release, got {after['in_use']}"
+    return True
+
+
+def test_pool_discards_uncommitted_work():
+    """Releasing a connection without commit rolls back, like a real close()."""
+    import db_manager as db
+    conn = db._get_connection()
+    conn.execute("INSERT INTO platform_settings (key, value) VALUES ('pool_probe', 'x')")
+    conn.close()
+    if db.get_platform_setting("pool_probe") is not None:
+        return "Uncommitted insert leaked to the next borrower"
+    return True
+
+
+def test_pool_nested_checkout_keeps_outer_transaction():
+    """An inner checkout/release must not roll back the outer caller's work."""
+    import db_manager as db
+    outer = db._get_connection()
+    try:
+        outer.execute("INSERT INTO platform_settings (key, value) VALUES ('pool_nested', 'y')")
+        db.get_user_full("testuser1")  # nested checkout + release on same thread
+        outer.commit()
+    finally:
+        outer.close()
+    if db.get_platform_setting("pool_nested") != "y":
+        return "Outer transaction was lost after nested checkout"
+    return True
+
+
+def test_pool_sqlite_switches_db_path():
+    """Changing DB_NAME opens a fresh connection to the new file."""
+    import db_manager as db
+    original = db.DB_NAME
+    other = os.path.join(os.path.dirname(_TEST_DB_PATH), "other.db")
+    try:
+        db.DB_NAME = other
+        conn = db._get_connection()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS probe (x INTEGER)")
+            conn.commit()
+        finally:
+            conn.close()
+    finally:
+        db.DB_NAME = original
+    conn = db._get_connection()
+    try:
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
+    finally:
+        conn.close()
+    if "probe" in tables:
+        return "Connection was not reopened when DB_NAME changed"
+    return True
+
+
+def test_pool_bounded_waits_and_peak():
+    """Bounded pool blocks the (max+1)th borrower and records the wait."""
+    import threading
+    import db_manager as db
+    pool = db._ConnectionPool(lambda: sqlite3.connect(":memory:", check_same_thread=False),
+                              min_size=0, max_size=2, timeout=5)
+    a = pool.getconn()
+    b = pool.getconn()
+    got = []
+
+    def borrower():
+        got.append(pool.getconn())
+
+    t = threading.Thread(target=borrower)
+    t.start()
+    t.join(0.2)
+    if got:
+        return "Third borrower should have waited while pool was exhausted"
+    pool.putconn(a)
+    t.join(5)
+    pool.putconn(b)
+    pool.putconn(got[0])
+    stats = pool.get_stats()
+    if stats["waits"] != 1 or stats["peak_in_use"] != 2 or stats["created"] != 2:
+        return f"Unexpected stats: {stats}"
+    if stats["in_use"] != 0 or stats["idle"] != 2:
+        return f"Connections not returned: {stats}"
+    return True
+
+
+def test_pool_timeout_and_health_check():
+    """Exhausted pool raises PoolTimeoutError; dead idle connections are replaced."""
+    import db_manager as db
+    pool = db._ConnectionPool(lambda: sqlite3.connect(":memory:", check_same_thread=False),
+                              min_size=1, max_size=1, timeout=0.1)
+    conn = pool.getconn()
+    try:
+        pool.getconn()
+        return "Expected PoolTimeoutError"
+    except db.PoolTimeoutError:
+        pass
+    pool.putconn(conn)
+    conn.close()  # simulate a server-side disconnect while idle
+    saved = db.DB_POOL_PING_AFTER_SECONDS
+    db.DB_POOL_PING_AFTER_SECONDS = 0
+    try:
+        fresh = pool.getconn()
+    finally:
+        db.DB_POOL_PING_AFTER_SECONDS = saved
+    fresh.execute("SELECT 1")
+    pool.putconn(fresh)
+    stats = pool.get_stats()
+    if stats["health_check_failures"] != 1 or stats["created"] != 2:
+        return f"Dead connection not replaced: {stats}"
+    return True
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 17: Background Event Writer
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _count_events(event_type, username):
+    conn = sqlite3.connect(_TEST_DB_PATH)
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM product_events WHERE event_type = ? AND username = ?",
+            (event_type, username)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_event_writer_batches_events():
+    """Queued events land in product_events after flush_events()."""
+    import db_manager as db
+    for i in range(120):
+        db.track_event("module_action", "evt_user", metadata={"module": "copy_editor", "i": i},
+                       session_id="s1", org_id="evt_org")
+    if not db.flush_events():
+        return "flush_events() timed out"
+    count = _count_events("module_action", "evt_user")
+    if count != 120:
+        return f"Expected 120 events, found {count}"
+    stats = db.get_event_writer_stats()
+    if stats["batches"] >= 120:
+        return f"Events were not batched: {stats}"
+    return True
+
+
+def test_event_writer_timestamp_format():
+    """Queued events keep their enqueue time in CURRENT_TIMESTAMP format."""
+    import db_manager as db
+    db.track_event("session_start", "evt_ts_user", session_id="s2")
+    db.flush_events()
+    conn = sqlite3.connect(_TEST_DB_PATH)
+    try:
+        ts = conn.execute("SELECT timestamp FROM product_events WHERE username = 'evt_ts_user'").fetchone()[0]
+        recent = conn.execute(
+            "SELECT COUNT(*) FROM product_events WHERE username = 'evt_ts_user' "
+            "AND timestamp >= datetime('now', '-1 days')").fetchone()[0]
+    finally:
+        conn.close()
+    if not re.match(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$", str(ts)):
+        return f"Unexpected timestamp format: {ts}"
+    if recent != 1:
+        return "Event not visible to datetime('now') window queries"
+    return True
+
+
+def test_event_writer_milestone_dedup():
+    """Repeated milestones for the same user are written once."""
+    import db_manager as db
+    for _ in range(5):
+        db.check_milestone("evt_user", "first_module_run")
+    db.flush_events()
+    db.check_milestone("evt_user", "first_module_run")
+    db.flush_events()
+    count = _count_events("onboarding_step", "evt_user")
+    if count != 1:
+        return f"Expected 1 milestone row, found {count}"
+    return True
+
+
+def test_event_writer_milestone_seeded_from_db():
+    """Milestones already in the DB are not re-fired after a restart."""
+    import db_manager as db
+    conn = sqlite3.connect(_TEST_DB_PATH)
+    conn.execute(
+        "INSERT INTO product_events (event_type, username, metadata_json) VALUES (?, ?, ?)",
+        ("onboarding_step", "evt_seed_user", json.dumps({"step": "first_brand_created"})))
+    conn.commit()
+    conn.close()
+    db._event_writer.forget_milestones()  # simulate a fresh process
+    db.check_milestone("evt_seed_user", "first_brand_created")
+    db.check_milestone("evt_seed_user", "first_voice_sample")
+    db.flush_events()
+    count = _count_events("onboarding_step", "evt_seed_user")
+    if count != 2:
+        return f"Expected 2 milestone rows (1 seeded + 1 new), found {count}"
+    return True
+
+
+def test_event_writer_drains_on_shutdown():
+    """shutdown() writes everything still queued before the worker exits."""
+    import db_manager as db
+    writer = db._EventWriter()
+    for i in range(30):
+        writer.enqueue_event(("module_action", "evt_drain_user", None, None, None, None,
+                              db._utc_timestamp(), *db.event_columns(None)))
+    writer.shutdown()
+    if writer._thread.is_alive():
+        return "Worker still running after shutdown()"
+    count = _count_events("module_action", "evt_drain_user")
+    if count != 30:
+        return f"Expected 30 drained events, found {count}"
+    return True
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 18: Dominant Color Cache
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _make_test_image(seed=0, size=(120, 80)):
+    """Deterministic striped RGB test image."""
+    from PIL import Image
+    img = Image.new("RGB", size)
+    px = img.load()
+    palette = [(36, 54, 59), (171, 143, 89), (245, 245, 240), ((seed * 37) % 256, 20, 200)]
+    for x in range(size[0]):
+        for y in range(size[1]):
+            px[x, y] = palette[(x // 10 + y // 20) % len(palette)]
+    return img
+
+
+def test_color_cache_hit_on_same_pixels():
+    """Second extraction of identical pixels is served from cache."""
+    import logic
+    logic.clear_color_cache()
+    first = logic.extract_dominant_colors(_make_test_image(), num_colors=4)
+    again = logic.extract_dominant_colors(_make_test_image(), num_colors=4)
+    stats = logic.get_color_cache_stats()
+    if stats["misses"] != 1 or stats["memory_hits"] != 1:
+        return f"Unexpected cache stats: {stats}"
+    if first != again:
+        return "Cached result differs from computed result"
+    return True
+
+
+def test_color_cache_key_includes_params():
+    """Different pixels or num_colors are distinct cache entries."""
+    import logic
+    logic.clear_color_cache()
+    logic.extract_dominant_colors(_make_test_image(seed=1), num_colors=4)
+    logic.extract_dominant_colors(_make_test_image(seed=2), num_colors=4)
+    logic.extract_dominant_colors(_make_test_image(seed=1), num_colors=3)
+    stats = logic.get_color_cache_stats()
+    if stats["misses"] != 3 or stats["memory_hits"] != 0:
+        return f"Expected 3 misses, got {stats}"
+    return True
+
+
+def test_color_cache_result_not_mutable():
+    """Mutating a returned palette must not poison the cache."""
+    import logic
+    logic.clear_color_cache()
+    result = logic.extract_dominant_colors(_make_test_image(seed=3), num_colors=4)
+    result.clear()
+    again = logic.extract_dominant_colors(_make_test_image(seed=3), num_colors=4)
+    if not again:
+        return "Cache entry was mutated through the returned list"
+    return True
+
+
+def test_color_cache_disk_tier_and_eviction():
+    """Disk tier survives a memory wipe and evicts LRU files past its byte cap."""
+    import logic
+    tmp = tempfile.mkdtemp(prefix="signet_colorcache_")
+    try:
+        cache = logic._ColorCache(max_entries=2, disk_dir=tmp, disk_max_bytes=400)
+        value = [("#24363b", 50.0), ("#ab8f59", 30.0), ("#f5f5f0", 20.0)]
+        cache.put("a" * 64, value)
+        cache._memory.clear()
+        if cache.get("a" * 64) != value:
+            return "Disk tier did not return stored palette"
+        if cache.get_stats()["disk_hits"] != 1:
+            return f"Disk hit not counted: {cache.get_stats()}"
+        for i in range(10):
+            cache.put(f"{i:064d}", value)
+        files = [f for f in os.listdir(tmp) if f.endswith(".json")]
+        total = sum(os.path.getsize(os.path.join(tmp, f)) for f in files)
+        if total > 400:
+            return f"Disk tier exceeded cap: {total} bytes in {len(files)} files"
+        if cache.get_stats()["disk_evictions"] == 0:
+            return "No disk evictions recorded"
+        if len(cache._memory) > 2:
+            return f"Memory tier exceeded max_entries: {len(cache._memory)}"
+        return True
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 19: Color Quantization Engines
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_quantizers_share_output_contract():
+    """Every engine returns [(hex, pct)] sorted by dominance, <= num_colors, ~100%."""
+    import logic
+    img = _make_test_image(seed=4)
+    for method in logic.QUANTIZERS:
+        palette = logic.extract_dominant_colors(img, num_colors=4, method=method, use_cache=False)
+        if not palette or len(palette) > 4:
+            return f"{method}: bad palette size {palette}"
+        if not all(re.fullmatch(r"#[0-9a-f]{6}", h) for h, _ in palette):
+            return f"{method}: malformed hex in {palette}"
+        pcts = [p for _, p in palette]
+        if pcts != sorted(pcts, reverse=True):
+            return f"{method}: not sorted by dominance {palette}"
+        if abs(sum(pcts) - 100) > 1.0:
+            return f"{method}: percentages sum to {sum(pcts)}"
+    return True
+
+
+def test_quantizers_agree_on_flat_palette():
+    """On a 4-color image every engine lands within ΔE 3 of the KMeans palette."""
+    import logic
+    img = _make_test_image(seed=5)
+    reference = logic.extract_dominant_colors(img, num_colors=4, method="kmeans", use_cache=False)
+    for method in logic.QUANTIZERS:
+        palette = logic.extract_dominant_colors(img, num_colors=4, method=method, use_cache=False)
+        delta_e = logic.palette_delta_e(palette, reference)
+        if not delta_e < 3.0:
+            return f"{method}: ΔE {delta_e:.2f} vs kmeans ({palette} vs {reference})"
+    return True
+
+
+def test_quantizer_selection():
+    """Per-call method overrides COLOR_QUANTIZER; unknown setting falls back to kmeans."""
+    import logic
+    original = logic.COLOR_QUANTIZER
+    try:
+        logic.COLOR_QUANTIZER = "median_cut"
+        if logic._resolve_quantizer(None) != "median_cut":
+            return "COLOR_QUANTIZER setting not honored"
+        if logic._resolve_quantizer("pillow") != "pillow":
+            return "Per-call method did not override setting"
+        logic.COLOR_QUANTIZER = "no-such-engine"
+        if logic._resolve_quantizer(None) != "kmeans":
+            return "Unknown setting did not fall back to kmeans"
+        try:
+            logic._resolve_quantizer("no-such-engine")
+            return "Unknown per-call method accepted"
+        except ValueError:
+            pass
+    finally:
+        logic.COLOR_QUANTIZER = original
+    return True
+
+
+def test_quantizer_cache_keyed_by_method():
+    """Switching engines does not return another engine's cached palette."""
+    import logic
+    logic.clear_color_cache()
+    img = _make_test_image(seed=6)
+    logic.extract_dominant_colors(img, num_colors=4, method="median_cut")
+    logic.extract_dominant_colors(img, num_colors=4, method="pillow")
+    stats = logic.get_color_cache_stats()
+    if stats["misses"] != 2 or stats["memory_hits"] != 0:
+        return f"Engines shared a cache entry: {stats}"
+    return True
+
+
+def test_logic_import_defers_sklearn():
+    """Importing logic does not pull in sklearn (only the KMeans engines need it)."""
+    import subprocess
+    code = "import sys, logic; print('sklearn' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)), timeout=120)
+    if out.returncode != 0:
+        return f"Import failed: {out.stderr[-300:]}"
+    if out.stdout.strip().splitlines()[-1] != "False":
+        return "sklearn imported eagerly by logic"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 20: Vectorized Color Scoring
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _random_palette_case(rng):
+    """Random brand/detected palettes biased toward guard edges and true tints/shades."""
+    from logic import hex_to_rgb, rgb_to_hex
+    edges = [0, 3, 5, 6, 12, 13, 128, 200, 249, 250, 251, 255]
+
+    def channel():
+        return rng.choice(edges) if rng.random() < 0.3 else rng.randint(0, 255)
+
+    brand = [rgb_to_hex((channel(), channel(), channel())) for _ in range(rng.randint(0, 24))]
+    detected = []
+    for _ in range(rng.randint(0, 10)):
+        if brand and rng.random() < 0.5:
+            base, t = hex_to_rgb(rng.choice(brand)), rng.random()
+            if rng.random() < 0.5:
+                mixed = [c + t * (255 - c) for c in base]
+            else:
+                mixed = [c * (1 - t) for c in base]
+            detected.append(rgb_to_hex(mixed))
+        else:
+            detected.append(rgb_to_hex((channel(), channel(), channel())))
+    profile = "Primary palette: " + ", ".join(h.upper() if rng.random() < 0.2 else h for h in brand)
+    return detected, profile
+
+
+def test_vectorized_scorer_matches_scalar():
+    """NumPy grade_color_match (rgb mode) returns the same score and reasoning as the scalar loop."""
+    import random
+    from logic import ColorScorer
+    rng = random.Random(20)
+    for case in range(1500):
+        detected, profile = _random_palette_case(rng)
+        fast = ColorScorer.grade_color_match(detected, profile, mode="rgb")
+        slow = ColorScorer._grade_color_match_scalar(detected, profile)
+        if fast != slow:
+            return f"Case {case} diverged: {detected} / {profile!r}: {fast} != {slow}"
+    return True
+
+
+def test_vectorized_scorer_tint_shade_labels():
+    """Known tint and shade of a mid-tone brand color are labeled as such."""
+    from logic import ColorScorer
+    _, reason = ColorScorer.grade_color_match(["#5c9aa8"], "Brand: #1a6b7c")
+    if "Tint" not in reason:
+        return f"Tint not detected: {reason}"
+    _, reason = ColorScorer.grade_color_match(["#124b57"], "Brand: #1a6b7c")
+    if "Shade" not in reason:
+        return f"Shade not detected: {reason}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 21: Perceptual (CIEDE2000) Color Matching
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_ciede2000_reference_values():
+    """delta_e_2000 reproduces published CIEDE2000 test pairs (Sharma et al.)."""
+    import numpy as np
+    from logic import delta_e_2000
+    pairs = [
+        ((50, 2.6772, -79.7751), (50, 0, -82.7485), 2.0425),
+        ((50, 0, 0), (50, -1, 2), 2.3669),
+        ((50, 2.49, -0.001), (50, -2.49, 0.0009), 7.1792),
+        ((50, 2.5, 0), (56, -27, -3), 31.9030),
+        ((60.2574, -34.0099, 36.2677), (60.4626, -34.1751, 39.4387), 1.2644),
+        ((2.0776, 0.0795, -1.1350), (0.9033, -0.0636, -0.5514), 0.9082),
+    ]
+    got = delta_e_2000([p[0] for p in pairs], [p[1] for p in pairs])
+    expected = np.array([p[2] for p in pairs])
+    if not np.allclose(got, expected, atol=1e-4):
+        return f"CIEDE2000 mismatch: {np.round(got, 4)} vs {expected}"
+    return True
+
+
+def test_ciede2000_mode_scoring():
+    """Perceptually close colors score high; brand Lab palette is converted once."""
+    import logic
+    from logic import ColorScorer
+    logic.brand_lab_palette.cache_clear()
+    score, reason = ColorScorer.grade_color_match(["#24363b"], "#24363b", mode="ciede2000")
+    if score != 100 or "(Direct)" not in reason:
+        return f"Exact match scored {score}: {reason}"
+    close, _ = ColorScorer.grade_color_match(["#26383d"], "#24363b", mode="ciede2000")
+    far, _ = ColorScorer.grade_color_match(["#ab8f59"], "#24363b", mode="ciede2000")
+    if not close > 90 or not far < 20:
+        return f"Unexpected scores: close={close}, far={far}"
+    info = logic.brand_lab_palette.cache_info()
+    if info.misses != 1 or info.hits != 2:
+        return f"Brand Lab palette not cached: {info}"
+    try:
+        ColorScorer.grade_color_match(["#24363b"], "#24363b", mode="hsv")
+        return "Unknown mode accepted"
+    except ValueError:
+        pass
+    return True
+
+
+def test_color_compliance_reports_mode():
+    """run_color_compliance defaults to COLOR_MATCH_MODE and honors an explicit mode."""
+    import logic
+    import visual_audit
+    inputs = {"palette_primary": ["#24363b", "#ab8f59"], "palette_secondary": ["#f5f5f0"]}
+    img = _make_test_image(seed=7)
+    default = visual_audit.run_color_compliance(img, inputs)
+    if default.get("color_mode") != logic.COLOR_MATCH_MODE:
+        return f"Default mode not reported: {default.get('color_mode')}"
+    legacy = visual_audit.run_color_compliance(img, inputs, mode="rgb")
+    if legacy.get("color_mode") != "rgb" or legacy.get("score") is None:
+        return f"rgb mode result malformed: {legacy}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 22: Parallel Visual Audit Layers
+# ═══════════════════════════════════════════════════════════════════════════
+
+_AUDIT_INPUTS = {
+    "wiz_name": "Test Brand", "wiz_tone": "Confident, warm",
+    "palette_primary": ["#24363b", "#ab8f59"], "palette_secondary": ["#f5f5f0"],
+}
+
+
+def _fake_vision_call(delay):
+    """Stand-in for visual_audit._vision_call: sleeps, then returns canned JSON."""
+    import time
+    import visual_audit
+
+    def fake(system_msg, text_prompt, images, max_tokens=4096, budget="default", brand_context=None):
+        time.sleep(delay)
+        if system_msg == visual_audit._VISUAL_IDENTITY_SYSTEM:
+            return json.dumps({"logo_present": True, "logo_findings": [], "visual_findings": [],
+                               "typography_findings": [], "visual_identity_score": 80, "summary": "ok"})
+        if system_msg == visual_audit._COPY_EXTRACTION_SYSTEM:
+            return "HEADLINE: Built to last. BODY: Quality you can feel."
+        return json.dumps({"findings": [], "copy_score": 70, "text_summary": "t", "summary": "ok"})
+    return fake
+
+
+def test_audit_layers_run_concurrently():
+    """Parallel mode overlaps visual identity with the two copy calls."""
+    import time
+    import visual_audit
+    original = visual_audit._vision_call
+    visual_audit._vision_call = _fake_vision_call(0.4)
+    try:
+        img = _make_test_image(seed=8)
+        start = time.perf_counter()
+        layers = visual_audit.run_audit_layers(img, _AUDIT_INPUTS, parallel=True)
+        elapsed = time.perf_counter() - start
+    finally:
+        visual_audit._vision_call = original
+    if layers["visual_result"].get("score") != 80 or layers["copy_result"].get("score") != 70:
+        return f"Unexpected layer results: {layers}"
+    # Sequential would be 3 x 0.4s of calls; parallel is bounded by the 2-call copy path
+    if elapsed > 1.1:
+        return f"Layers did not overlap: {elapsed:.2f}s"
+    timings = layers["timings"]
+    if timings.get("mode") != "parallel" or not all(k in timings for k in ("color", "visual", "copy", "total")):
+        return f"Timings incomplete: {timings}"
+    return True
+
+
+def test_audit_layer_timeout_reported():
+    """A layer over budget becomes an error result without holding up the audit."""
+    import time
+    import visual_audit
+    original = visual_audit._vision_call
+    visual_audit._vision_call = _fake_vision_call(1.5)
+    try:
+        start = time.perf_counter()
+        layers = visual_audit.run_audit_layers(_make_test_image(seed=9), _AUDIT_INPUTS, parallel=True,
+                                               timeouts={"visual": 0.3, "copy": 0.3})
+        elapsed = time.perf_counter() - start
+    finally:
+        visual_audit._vision_call = original
+    if elapsed > 1.2:
+        return f"Audit waited on timed-out layers: {elapsed:.2f}s"
+    if sorted(layers["timings"]["timed_out"]) != ["copy", "visual"]:
+        return f"Timeouts not recorded: {layers['timings']}"
+    if layers["visual_result"].get("score") is not None or "timed out" not in layers["copy_result"].get("error", ""):
+        return f"Timed-out layers not reported as errors: {layers}"
+    if layers["color_result"].get("score") is None:
+        return "Color layer should still complete"
+    return True
+
+
+def test_audit_late_layer_usage_reported():
+    """Tokens a timed-out layer spends after the audit returns reach on_late_usage."""
+    import time
+    import types
+    import visual_audit
+    original = visual_audit._vision_call
+    canned = _fake_vision_call(0.0)
+
+    def fake(system_msg, text_prompt, images, max_tokens=4096, budget="default", brand_context=None):
+        # Identity answers quickly; each copy call is slow and bills 100/10 tokens
+        time.sleep(0.05 if system_msg == visual_audit._VISUAL_IDENTITY_SYSTEM else 0.5)
+        visual_audit._record_usage(types.SimpleNamespace(input_tokens=100, output_tokens=10))
+        return canned(system_msg, text_prompt, images, max_tokens, budget, brand_context)
+
+    late = []
+    visual_audit._vision_call = fake
+    try:
+        layers = visual_audit.run_audit_layers(_make_test_image(seed=11), _AUDIT_INPUTS, parallel=True,
+                                               timeouts={"copy": 0.2},
+                                               on_late_usage=lambda layer, usage: late.append((layer, usage)))
+        deadline = time.perf_counter() + 3
+        while not late and time.perf_counter() < deadline:
+            time.sleep(0.05)
+    finally:
+        visual_audit._vision_call = original
+    if layers["timings"]["timed_out"] != ["copy"]:
+        return f"Expected only copy to time out: {layers['timings']}"
+    if layers["usage"]["input_tokens"] != 100:
+        return f"Returned usage should cover the identity call only: {layers['usage']}"
+    if len(late) != 1 or late[0][0] != "copy" or late[0][1]["input_tokens"] != 200 \
+            or late[0][1]["output_tokens"] != 20:
+        return f"Late copy usage not reported: {late}"
+    return True
+
+
+def test_full_audit_sequential_matches_parallel():
+    """Both modes produce the same scores; the report carries timings."""
+    import visual_audit
+    original = visual_audit._vision_call
+    visual_audit._vision_call = _fake_vision_call(0.0)
+    try:
+        img = _make_test_image(seed=10)
+        par = visual_audit.run_full_audit(img, dict(_AUDIT_INPUTS), parallel=True)
+        seq = visual_audit.run_full_audit(img, dict(_AUDIT_INPUTS), parallel=False)
+    finally:
+        visual_audit._vision_call = original
+    if par["scores"] != seq["scores"] or par["overall_score"] != seq["overall_score"]:
+        return f"Modes disagree: {par['scores']} vs {seq['scores']}"
+    if seq["timings"].get("mode") != "sequential" or par["timings"].get("mode") != "parallel":
+        return f"Timing mode missing: {par['timings']} / {seq['timings']}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 23: Prepared Vision Images
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_prepare_image_cached_by_content():
+    """Identical pixels reuse one encoded payload; different pixels don't."""
+    import logic
+    first = logic.prepare_image(_make_test_image(seed=11))
+    again = logic.prepare_image(_make_test_image(seed=11))
+    other = logic.prepare_image(_make_test_image(seed=12))
+    if first is not again:
+        return "Same pixels were encoded twice"
+    if other.key == first.key:
+        return "Different pixels share a cache key"
+    if logic.prepare_image(first) is not first:
+        return "PreparedImage was re-prepared"
+    if logic.image_to_base64(_make_test_image(seed=11)) != first.data:
+        return "image_to_base64 disagrees with prepare_image"
+    block = first.content_block()
+    if block["type"] != "image" or block["source"]["data"] != first.data:
+        return f"Malformed content block: {block['source'].get('media_type')}"
+    return True
+
+
+def test_prepare_image_downscales_oversized():
+    """Screenshots beyond VISION_MAX_EDGE are downscaled before encoding."""
+    import base64
+    import io
+    import logic
+    from PIL import Image
+    big = Image.new("RGBA", (logic.VISION_MAX_EDGE * 2, logic.VISION_MAX_EDGE), (36, 54, 59, 255))
+    prepared = logic.prepare_image(big)
+    if max(prepared.size) != logic.VISION_MAX_EDGE or prepared.source_size != big.size:
+        return f"Unexpected sizes: sent {prepared.size}, source {prepared.source_size}"
+    decoded = Image.open(io.BytesIO(base64.b64decode(prepared.data)))
+    if decoded.format != "JPEG" or decoded.size != prepared.size:
+        return f"Payload is {decoded.format} {decoded.size}"
+    return True
+
+
+def test_full_audit_reuses_one_payload():
+    """Vision calls in an audit receive prepared payloads; copy calls share one."""
+    import visual_audit
+    seen = []
+    original = visual_audit._vision_call
+    fake = _fake_vision_call(0.0)
+
+    def recording(system_msg, text_prompt, images, max_tokens=4096, budget="default", brand_context=None):
+        seen.extend(images)
+        return fake(system_msg, text_prompt, images, max_tokens)
+
+    visual_audit._vision_call = recording
+    try:
+        visual_audit.run_full_audit(_make_test_image(seed=13), dict(_AUDIT_INPUTS))
+    finally:
+        visual_audit._vision_call = original
+    if len(seen) != 3:
+        return f"Expected 3 vision calls, got {len(seen)}"
+    if not all(type(img).__name__ == "PreparedImage" for img in seen):
+        return f"Vision calls got raw images: {[type(i).__name__ for i in seen]}"
+    copy_payloads = [img for img in seen if img.budget == "copy"]
+    if len(copy_payloads) != 2 or copy_payloads[0] is not copy_payloads[1]:
+        return f"Copy calls did not share one payload: {[img.budget for img in seen]}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 24: Vision Image Size Budgets
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _noisy_image(size):
+    """Random-noise RGB image — worst case for JPEG size."""
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(24)
+    return Image.fromarray(rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8))
+
+
+def test_budget_caps_bytes_with_adaptive_quality():
+    """Over-budget images step quality down, then size, until under max_bytes."""
+    import base64
+    import logic
+    img = _noisy_image((900, 600))
+    budget = {"max_edge": 1568, "max_bytes": 60 * 1024, "quality": 90, "min_quality": 50}
+    prepared = logic.prepare_image(img, budget)
+    sent = len(base64.b64decode(prepared.data))
+    if sent > budget["max_bytes"]:
+        return f"Payload {sent} bytes exceeds budget {budget['max_bytes']}"
+    if prepared.quality != 50:
+        return f"Quality should have stepped down to the floor, got q{prepared.quality}"
+    if prepared.size == img.size:
+        return "Image was not downscaled after hitting the quality floor"
+    return True
+
+
+def test_module_budgets_differ():
+    """Logo budget is tighter than copy; unknown names fall back to default."""
+    import logic
+    img = _noisy_image((2400, 1200))
+    logo = logic.prepare_image(img, "logo")
+    copy = logic.prepare_image(img, "copy")
+    if max(logo.size) > logic.VISION_IMAGE_BUDGETS["logo"]["max_edge"]:
+        return f"Logo budget not applied: {logo.size}"
+    if logo.nbytes >= copy.nbytes or max(copy.size) <= max(logo.size):
+        return f"Copy budget should be looser: logo {logo.size}/{logo.nbytes}, copy {copy.size}/{copy.nbytes}"
+    fallback = logic.prepare_image(_make_test_image(seed=14), "no-such-budget")
+    if fallback.budget != "default":
+        return f"Unknown budget not mapped to default: {fallback.budget}"
+    stats = logic.image_byte_stats([logo, copy])
+    if stats["image_bytes_original"] != 2 * logic._estimate_payload_bytes(img.size) or stats["image_bytes_sent"] != logo.nbytes + copy.nbytes:
+        return f"Byte stats wrong: {stats}"
+    if logic.prepare_image(_make_test_image(seed=15), "logo", source_bytes=123456).source_bytes != 123456:
+        return "Caller-supplied upload size not recorded"
+    return True
+
+
+def test_vision_usage_reports_image_bytes():
+    """SignetLogic vision calls record original vs sent bytes with token usage."""
+    import logic
+
+    class _Resp:
+        class usage:
+            input_tokens = 1200
+            output_tokens = 300
+        content = [type("Block", (), {"text": "A gold shield mark."})()]
+
+    class _Client:
+        class messages:
+            @staticmethod
+            def create(**kwargs):
+                return _Resp()
+
+    engine = logic.SignetLogic.__new__(logic.SignetLogic)
+    engine.client, engine.model, engine._last_usage = _Client(), "test-model", None
+    img = _noisy_image((1600, 1600))
+    out = engine.describe_logo(img)
+    usage = engine._last_usage or {}
+    if out != "A gold shield mark.":
+        return f"Unexpected response: {out}"
+    if usage.get("images") != 1 or usage.get("image_bytes_original") != logic._estimate_payload_bytes(img.size):
+        return f"Image stats missing from usage: {usage}"
+    if not 0 < usage.get("image_bytes_sent", 0) < usage["image_bytes_original"]:
+        return f"Sent bytes not recorded: {usage}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 25: Memoized Brand Context
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_brand_context_memo_hits_and_matches():
+    """Repeat builds are cache hits and identical to an uncached assembly."""
+    import copy
+    import prompt_builder
+    from sample_brand_data import SAMPLE_BRAND
+    prompt_builder.invalidate_brand_context_cache()
+    base = prompt_builder.get_brand_context_cache_stats()
+    brand = copy.deepcopy(SAMPLE_BRAND["profile_data"])
+    for cluster in (None, "Corporate Affairs"):
+        first = prompt_builder.build_brand_context(brand, cluster_filter=cluster)
+        again = prompt_builder.build_brand_context(brand, cluster_filter=cluster)
+        fresh = prompt_builder._assemble_brand_context(brand, True, cluster)
+        if not first == again == fresh:
+            return f"Memoized context differs from fresh build (filter={cluster})"
+    stats = prompt_builder.get_brand_context_cache_stats()
+    hits, misses = stats["hits"] - base["hits"], stats["misses"] - base["misses"]
+    if hits != 2 or misses != 2 or stats["voice_entries"] != 1:
+        return f"Unexpected cache stats: {stats}"
+    return True
+
+
+def test_brand_context_memo_tracks_edits():
+    """Editing a profile in place changes its fingerprint, so no stale context."""
+    import copy
+    import prompt_builder
+    from sample_brand_data import SAMPLE_BRAND
+    brand = copy.deepcopy(SAMPLE_BRAND["profile_data"])
+    before = prompt_builder.build_brand_context(brand)
+    brand["inputs"]["wiz_tone"] = "Playful, irreverent"
+    after = prompt_builder.build_brand_context(brand)
+    if before == after or "Playful, irreverent" not in after:
+        return "Stale context served after profile edit"
+    brand["inputs"]["voice_dna"] += "\n----------------\n[ASSET: CLUSTER: CRISIS & RESPONSE | SOURCE: t]\nWe are on it."
+    if prompt_builder.build_brand_context(brand) == after:
+        return "Stale context served after voice_dna edit"
+    return True
+
+
+def test_brand_context_invalidated_on_save():
+    """db.save_profile clears the memo through the registered hook."""
+    import prompt_builder
+    import db_manager as db
+    db.register_profile_saved_hook(prompt_builder.invalidate_brand_context_cache)
+    db.register_profile_saved_hook(prompt_builder.invalidate_brand_context_cache)
+    if db._profile_saved_hooks.count(prompt_builder.invalidate_brand_context_cache) != 1:
+        return "Hook registered twice"
+    prompt_builder.build_brand_context({"inputs": {"wiz_name": "Memo Brand"}})
+    before = prompt_builder.get_brand_context_cache_stats()
+    db.save_profile("testuser1", "Memo Brand", {"inputs": {"wiz_name": "Memo Brand"}})
+    after = prompt_builder.get_brand_context_cache_stats()
+    if after["entries"] != 0 or after["invalidations"] != before["invalidations"] + 1:
+        return f"Save did not invalidate: {before} -> {after}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 26: Externalized Asset Store
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _inline_asset_text(seed, label="Logo"):
+    """visual_dna-style chunk with one inline base64 PNG (distinct per seed)."""
+    import base64
+    from io import BytesIO
+    buf = BytesIO()
+    _make_test_image(seed, (64, 64)).save(buf, format="PNG")
+    b64 = base64.b64encode(buf.getvalue()).decode()
+    return (f"[ASSET: VISUAL - {label}]\n[VISUAL_REF: data:image/png;base64,{b64}]\n"
+            f"Description of {label}.\n----------------\n"), buf.getvalue()
+
+
+def test_save_profile_externalizes_images():
+    """Inline images are stored once as asset refs; the caller's dict is untouched."""
+    import db_manager as db
+    text, raw = _inline_asset_text(2601)
+    profile = {"inputs": {"wiz_name": "Asset Brand", "visual_dna": text}}
+    db.save_profile("testuser1", "Asset Brand", profile)
+    if profile["inputs"]["visual_dna"] != text:
+        return "save_profile mutated the caller's profile"
+    stored = db.get_profiles("testuser1")["Asset Brand"]["inputs"]["visual_dna"]
+    if "base64," in stored or "[VISUAL_REF: asset:" not in stored:
+        return f"Image not externalized: {stored[:120]}"
+    ref = stored.split("[VISUAL_REF:")[1].split("]")[0].strip()
+    mime, data = db.get_asset(ref[len(db.ASSET_REF_PREFIX):])
+    if mime != "image/png" or data != raw:
+        return "Stored asset bytes differ from the original"
+    return True
+
+
+def test_assets_deduplicated_across_brands():
+    """The same image in two brands is one row in profile_assets."""
+    import db_manager as db
+    text, _ = _inline_asset_text(2602)
+    conn = db._get_connection()
+    before = db._fetchone_val(db._execute_plain(conn, "SELECT COUNT(*) FROM profile_assets"))
+    conn.close()
+    db.save_profile("testuser1", "Dedup A", {"inputs": {"visual_dna": text}})
+    db.save_profile("testuser1", "Dedup B", {"inputs": {"social_dna": text}})
+    conn = db._get_connection()
+    after = db._fetchone_val(db._execute_plain(conn, "SELECT COUNT(*) FROM profile_assets"))
+    conn.close()
+    if after - before != 1:
+        return f"Expected one new asset row, got {after - before}"
+    return True
+
+
+def test_migration_rewrites_inline_profiles():
+    """Legacy rows with inline base64 shrink after migrate_profile_assets()."""
+    import json
+    import db_manager as db
+    text, _ = _inline_asset_text(2603, "Legacy")
+    legacy = json.dumps({"inputs": {"visual_dna": text * 3}})
+    conn = db._get_connection()
+    db._execute_plain(conn, db._q("INSERT INTO profiles (org_id, name, data) VALUES (?, ?, ?)"),
+                      ("testuser1", "Legacy Inline", legacy))
+    conn.commit()
+    conn.close()
+    result = db.migrate_profile_assets()
+    if result["profiles_rewritten"] < 1 or result["images_externalized"] < 3:
+        return f"Migration skipped the legacy row: {result}"
+    if result["bytes_after"] >= result["bytes_before"]:
+        return f"Profiles did not shrink: {result}"
+    stored = db.get_profiles("testuser1")["Legacy Inline"]["inputs"]["visual_dna"]
+    if "base64," in stored:
+        return "Inline image left behind"
+    again = db.migrate_profile_assets()
+    if again["profiles_rewritten"] != 0:
+        return f"Re-running the migration rewrote rows: {again}"
+    return True
+
+
+def test_resolve_visual_ref_round_trip():
+    """Asset refs and inline data URIs both resolve to the same data URI."""
+    import base64
+    import db_manager as db
+    _, raw = _inline_asset_text(2604)
+    ref = db.store_asset(raw, "image/png")
+    inline = "data:image/png;base64," + base64.b64encode(raw).decode()
+    if db.resolve_visual_ref(ref) != inline:
+        return "Asset ref did not resolve to the original data URI"
+    if db.resolve_visual_ref(f"[VISUAL_REF: {ref}]") != inline:
+        return "Full VISUAL_REF line not accepted"
+    if db.resolve_visual_ref(inline) != inline:
+        return "Inline data URI not passed through"
+    if db.resolve_visual_ref(db.ASSET_REF_PREFIX + "0" * 64) is not None:
+        return "Missing asset should resolve to None"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 27: Lazy Profile Loading
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_profile_index_projects_summary():
+    """get_profile_index reports summary fields in get_profiles() order."""
+    import json
+    import db_manager as db
+    db.save_profile("lazyuser", "Lazy A", {"calibration_score": 72, "inputs": {"wiz_name": "A"}})
+    db.save_profile("lazyuser", "Lazy B", "raw strategy text")
+    db.load_sample_brand("lazyuser")
+    index = db.get_profile_index("lazyuser")
+    if [e["name"] for e in index] != list(db.get_profiles("lazyuser")):
+        return f"Index order differs from get_profiles: {[e['name'] for e in index]}"
+    by_name = {e["name"]: e for e in index}
+    a = by_name["Lazy A"]
+    if a["calibration_score"] != 72 or a["is_sample_brand"] or not a["updated_at"]:
+        return f"Bad summary for Lazy A: {a}"
+    if a["data_bytes"] != len(json.dumps({"calibration_score": 72, "inputs": {"wiz_name": "A"}})):
+        return f"data_bytes mismatch: {a['data_bytes']}"
+    if by_name["Lazy B"]["calibration_score"] != 0:
+        return "Non-dict profile should score 0"
+    if not any(e["is_sample_brand"] for e in index):
+        return "Sample brand flag missing from index"
+    return True
+
+
+def test_lazy_profiles_decode_on_demand():
+    """Only accessed profiles are decoded; the per-session LRU is bounded."""
+    import db_manager as db
+    for i in range(4):
+        db.save_profile("lazyuser2", f"Brand {i}", {"calibration_score": i, "inputs": {}})
+    profiles = db.LazyProfiles("lazyuser2", cache_size=2)
+    if len(profiles) != 4 or "Brand 3" not in profiles or profiles.loads != 0:
+        return f"Index-only operations decoded profiles: {profiles!r}"
+    profiles["Brand 0"], profiles["Brand 0"]
+    if profiles.loads != 1 or profiles.hits != 1:
+        return f"Expected 1 load + 1 hit, got {profiles.loads}/{profiles.hits}"
+    profiles["Brand 1"], profiles["Brand 2"], profiles["Brand 0"]
+    if profiles.loads != 4:
+        return f"LRU did not evict (loads={profiles.loads})"
+    if profiles.get("Missing") is not None:
+        return "Unknown name should not resolve"
+    return True
+
+
+def test_lazy_profiles_track_session_edits():
+    """Assignments and deletes made before the DB write are visible immediately."""
+    import db_manager as db
+    profiles = db.get_profiles_lazy("lazyuser3")
+    profiles["New Brand"] = {"calibration_score": 15, "inputs": {}}
+    if list(profiles) != ["New Brand"] or profiles.loads != 0:
+        return "Assigned profile not served from session cache"
+    if profiles.meta("New Brand")["calibration_score"] != 15:
+        return "Index entry not updated on assignment"
+    del profiles["New Brand"]
+    if "New Brand" in profiles or len(profiles) != 0:
+        return "Delete not reflected"
+    return True
+
+
+def test_lazy_profiles_drop_vanished_entries():
+    """Brands deleted elsewhere or with undecodable data fall out of the index."""
+    import db_manager as db
+    db.save_profile("lazyuser4", "Gone", {"calibration_score": 10, "inputs": {}})
+    db.save_profile("lazyuser4", "Corrupt", {"calibration_score": 20, "inputs": {}})
+    db.save_profile("lazyuser4", "Kept", {"calibration_score": 30, "inputs": {}})
+    profiles = db.get_profiles_lazy("lazyuser4")
+    db.delete_profile("lazyuser4", "Gone")
+    conn = db._get_connection()
+    try:
+        db._execute_plain(conn, db._q("UPDATE profiles SET data = ? WHERE name = ?"),
+                          ("{not json", "Corrupt"))
+        conn.commit()
+    finally:
+        conn.close()
+    try:
+        if profiles.get("Gone") is not None or profiles.get("Corrupt") is not None:
+            return "Vanished profiles should resolve to None"
+        if list(profiles) != ["Kept"] or "Gone" in profiles:
+            return f"Failed loads left in index: {list(profiles)}"
+        if profiles["Kept"]["calibration_score"] != 30:
+            return "Healthy profile not served"
+        return True
+    finally:
+        db.delete_profile("lazyuser4", "Corrupt")
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 28: Secondary Indexes
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _seed_onboarding_steps(username):
+    import db_manager as db
+    conn = db._get_connection()
+    try:
+        db._event_writer._seed_steps(conn, username)
+    finally:
+        conn.close()
+
+
+# The real read paths behind each hot query; test_hot_queries_avoid_full_scans
+# traces the SQL they issue and EXPLAINs that, not a hand-copied statement.
+_HOT_QUERIES = [
+    ("get_org_logs", lambda db: db.get_org_logs("org1", 20)),
+    ("get_monthly_usage", lambda db: db.get_monthly_usage("org1", "2026-01")),
+    ("get_monthly_usage_user", lambda db: db.get_monthly_usage_user("u1", "2026-01")),
+    ("check_seat_availability", lambda db: db.check_seat_availability("org1")),
+    ("get_user_by_email", lambda db: db.get_user_by_email("u1@example.com")),
+    ("onboarding _seed_steps", lambda db: _seed_onboarding_steps("idx-u1")),
+    ("get_active_users", lambda db: db.get_active_users(7)),
+]
+
+
+def _traced_selects(db, call):
+    """Run call(db) and return the SELECT statements it sent to SQLite."""
+    statements, raws = [], []
+    real_get_connection = db._get_connection
+
+    def traced_connection():
+        conn = real_get_connection()
+        conn.set_trace_callback(statements.append)
+        raws.append(conn._raw)
+        return conn
+
+    db._get_connection = traced_connection
+    try:
+        call(db)
+    finally:
+        db._get_connection = real_get_connection
+        for raw in raws:
+            raw.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith(("SELECT", "WITH"))]
+
+
+def test_index_migration_versioned():
+    """run_migrations records the index version and creates every index."""
+    import db_manager as db
+    db.run_migrations()
+    target = max(v for v, _, _, _ in db.INDEX_MIGRATIONS)
+    if db.get_platform_setting(db.INDEX_VERSION_KEY) != str(target):
+        return f"Index version not recorded: {db.get_platform_setting(db.INDEX_VERSION_KEY)}"
+    conn = db._get_connection()
+    try:
+        names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'").fetchall()}
+    finally:
+        conn.close()
+    missing = [name for _, name, _, _ in db.INDEX_MIGRATIONS if name not in names]
+    if missing:
+        return f"Missing indexes: {missing}"
+    return True
+
+
+def test_hot_queries_avoid_full_scans():
+    """Every SELECT the hot read paths issue uses an index, never a bare SCAN."""
+    import db_manager as db
+    conn = db._get_connection()
+    try:
+        for i in range(200):
+            conn.execute("INSERT INTO activity_log (org_id, username, activity_type) VALUES (?, ?, 'X')",
+                         (f"org{i % 10}", f"u{i}"))
+            conn.execute("INSERT INTO usage_tracking (username, org_id, module, action_weight, billing_month) "
+                         "VALUES (?, ?, 'm', 1, ?)", (f"u{i % 20}", f"org{i % 10}", f"2026-{i % 12 + 1:02d}"))
+            conn.execute("INSERT INTO product_events (event_type, username, session_id, timestamp) "
+                         "VALUES (?, ?, 'idx-seed', datetime('now'))",
+                         (("module_action", "session_start", "onboarding_step")[i % 3], f"u{i % 20}"))
+        conn.commit()
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
+
+        def scanned_table(detail):
+            # "SCAN t" / "SCAN TABLE t" on a base table; subquery co-routines don't count
+            words = detail.split()
+            name = words[2] if len(words) > 2 and words[1] == "TABLE" else words[1]
+            return name if name in tables and "INDEX" not in detail else None
+
+        problems = []
+        for label, call in _HOT_QUERIES:
+            statements = _traced_selects(db, call)
+            if not statements:
+                problems.append(f"{label}: no SELECT captured")
+            for sql in statements:
+                plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+                scans = [d for d in plan if d.startswith("SCAN") and scanned_table(d)]
+                if scans or any("TEMP B-TREE FOR ORDER BY" in d for d in plan):
+                    problems.append(f"{label}: {sql.strip()[:80]} -> {plan}")
+        conn.execute("DELETE FROM activity_log WHERE activity_type = 'X'")
+        conn.execute("DELETE FROM usage_tracking WHERE module = 'm'")
+        conn.execute("DELETE FROM product_events WHERE session_id = 'idx-seed'")
+        conn.commit()
+    finally:
+        conn.close()
+    return True if not problems else "; ".join(problems)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 29: Usage Counters
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _usage_sum(where, params):
+    import db_manager as db
+    conn = db._get_connection()
+    try:
+        return db._fetchone_val(db._execute_plain(
+            conn, f"SELECT COALESCE(SUM(action_weight), 0) FROM usage_tracking WHERE {where}", params), 0)
+    finally:
+        conn.close()
+
+
+def test_usage_counters_match_tracking():
+    """Counters bumped on record equal the SUM over usage_tracking."""
+    import db_manager as db
+    month = "2031-03"
+    db.record_usage_action("ctr_a", "ctr_org", "copy_editor", 1, month)
+    db.record_usage_action("ctr_a", "ctr_org", "visual_audit", 3, month)
+    db.record_usage_action("ctr_b", "ctr_org", "copy_editor", 2, month)
+    db.record_usage_action_impersonated("ctr_a", "ctr_org", "copy_editor", 5, month)
+    if db.get_usage_counter("org", "ctr_org", month) != 6:
+        return f"Org counter {db.get_usage_counter('org', 'ctr_org', month)} != 6"
+    if db.get_usage_counter("user", "ctr_a", month) != 4:
+        return "Impersonated action counted toward the soft cap"
+    if db.get_monthly_usage("ctr_org", month) != _usage_sum("org_id = ? AND billing_month = ?", ("ctr_org", month)):
+        return "get_monthly_usage disagrees with usage_tracking"
+    if db.get_monthly_usage_user("ctr_a", month) != 9:
+        return "get_monthly_usage_user should include impersonated actions"
+    return True
+
+
+def test_usage_counters_rebuild_repairs_drift():
+    """rebuild_usage_counters recomputes totals from usage_tracking."""
+    import db_manager as db
+    month = "2031-04"
+    db.record_usage_action("ctr_c", "ctr_org2", "copy_editor", 2, month)
+    db.record_usage_action("ctr_c", "ctr_org2", "copy_editor", 2, month)
+    conn = db._get_connection()
+    conn.execute("UPDATE usage_counters SET total_weight = 999 WHERE scope_id = 'ctr_org2'")
+    conn.commit()
+    conn.close()
+    rows = db.rebuild_usage_counters(month)
+    if db.get_usage_counter("org", "ctr_org2", month) != 4 or rows < 2:
+        return f"Rebuild did not repair drift (rows={rows})"
+    if db.get_usage_counter("org", "ctr_org", "2031-03") != 6:
+        return "Month-scoped rebuild touched other months"
+    return True
+
+
+def test_check_usage_limit_reads_counter():
+    """check_usage_limit reports the counter for the current month."""
+    from datetime import datetime
+    import db_manager as db
+    import subscription_manager as sm
+    month = datetime.now().strftime("%Y-%m")
+    db.create_user_admin("ctr_solo", "ctr_solo@example.com", "pw-123456", tier="solo")
+    before = sm.check_usage_limit("ctr_solo")["used"]
+    db.record_usage_action("ctr_solo", "ctr_solo", "copy_editor", 3, month)
+    db.record_usage_action_impersonated("ctr_solo", "ctr_solo", "copy_editor", 7, month)
+    used = sm.check_usage_limit("ctr_solo")["used"]
+    if used - before != 3:
+        return f"Expected +3 used, got {before} -> {used}"
+    return True
+
+def test_delete_user_recomputes_only_affected_counters():
+    """delete_user_full drops the user's counters and recomputes their org's only."""
+    import db_manager as db
+    month = "2031-05"
+    db.create_user_admin("ctr_del", "ctr_del@example.com", "pw-123456", tier="agency", org_id="ctr_org3")
+    db.record_usage_action("ctr_del", "ctr_org3", "copy_editor", 5, month)
+    db.record_usage_action("ctr_keep", "ctr_org3", "copy_editor", 2, month)
+    db.record_usage_action("ctr_other", "ctr_org4", "copy_editor", 1, month)
+    conn = db._get_connection()
+    conn.execute("UPDATE usage_counters SET total_weight = 999 WHERE scope_id = 'ctr_org4'")
+    conn.commit()
+    conn.close()
+    result = db.delete_user_full("ctr_del")
+    if not result.get("deleted"):
+        return f"Delete failed: {result}"
+    if db.get_usage_counter("org", "ctr_org3", month) != 2:
+        return f"Org counter not recomputed: {db.get_usage_counter('org', 'ctr_org3', month)}"
+    if db.get_usage_counter("user", "ctr_del", month) != 0:
+        return "Deleted user's counters left behind"
+    if db.get_usage_counter("org", "ctr_org4", month) != 999:
+        return "Unrelated org's counters were rebuilt"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 30: Request-Scoped User Cache
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _raw_user_update(username, column, value):
+    """Write to users without going through a db_manager writer (no invalidation)."""
+    import db_manager as db
+    conn = db._get_connection()
+    try:
+        conn.execute(f"UPDATE users SET {column} = ? WHERE username = ?", (value, username))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_user_cache_serves_snapshot_in_scope():
+    """Inside a request scope repeat lookups reuse the first SELECT."""
+    import db_manager as db
+    db.create_user_admin("cache_u1", "cache_u1@example.com", "pw-123456", tier="solo")
+    with db.request_cache():
+        first = db.get_user_full("cache_u1")
+        _raw_user_update("cache_u1", "subscription_tier", "agency")
+        again = db.get_user_full("cache_u1")
+        if again["subscription_tier"] != first["subscription_tier"]:
+            return "Second lookup hit the database inside the scope"
+        again["subscription_tier"] = "mutated"
+        if db.get_user_full("cache_u1")["subscription_tier"] == "mutated":
+            return "Callers can mutate the cached snapshot"
+    if db.get_user_full("cache_u1")["subscription_tier"] != "agency":
+        return "Lookups outside a scope should not be cached"
+    return True
+
+
+def test_user_cache_invalidated_by_writers():
+    """Writers drop the snapshot so the same request sees its own writes."""
+    import db_manager as db
+    db.create_user_admin("cache_u2", "cache_u2@example.com", "pw-123456", tier="solo")
+    with db.request_cache():
+        db.get_user_full("cache_u2")
+        db.update_user_fields("cache_u2", subscription_tier="agency")
+        if db.get_user_full("cache_u2")["subscription_tier"] != "agency":
+            return "update_user_fields did not invalidate"
+        db.suspend_user("cache_u2", "test", "admin")
+        if not db.get_user_full("cache_u2")["is_suspended"]:
+            return "suspend_user did not invalidate"
+        db.set_trial_start("cache_u2")
+        db.expire_trial("cache_u2")
+        if not db.get_trial_info("cache_u2")["trial_expired"]:
+            return "expire_trial did not invalidate"
+    return True
+
+
+def test_user_cache_isolated_per_context():
+    """Concurrent requests (threads) never see each other's snapshots."""
+    import threading
+    import db_manager as db
+    db.create_user_admin("cache_u3", "cache_u3@example.com", "pw-123456", tier="solo")
+    seen = {}
+
+    def request(label, update_first):
+        with db.request_cache():
+            if update_first:
+                _raw_user_update("cache_u3", "subscription_tier", "enterprise")
+            seen[label] = db.get_user_full("cache_u3")["subscription_tier"]
+
+    with db.request_cache():
+        db.get_user_full("cache_u3")  # Warm this context's snapshot
+        t = threading.Thread(target=request, args=("other", True))
+        t.start()
+        t.join()
+        seen["main"] = db.get_user_full("cache_u3")["subscription_tier"]
+    if seen != {"other": "enterprise", "main": "solo"}:
+        return f"Unexpected snapshots: {seen}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 31: Shared Tier Cache
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_tier_cache_shared_across_sessions():
+    """A second resolve (any session) is a cache hit; local writes evict at once."""
+    import db_manager as db
+    import subscription_manager as sm
+    db.create_user_admin("tier_u1", "tier_u1@example.com", "pw-123456", tier="agency")
+    db.update_user_fields("tier_u1", last_subscription_sync=datetime.now().isoformat())
+    before = sm.get_tier_cache_stats()
+    first = sm.resolve_user_tier("tier_u1")
+    second = sm.resolve_user_tier("tier_u1")
+    after = sm.get_tier_cache_stats()
+    if first != second or first["_tier_key"] != "agency":
+        return f"Unexpected tiers: {first.get('_tier_key')} / {second.get('_tier_key')}"
+    if after["hits"] - before["hits"] != 1 or after["misses"] - before["misses"] != 1:
+        return f"Expected 1 miss + 1 hit: {before} -> {after}"
+    db.update_user_fields("tier_u1", subscription_tier="enterprise")
+    if sm.resolve_user_tier("tier_u1")["_tier_key"] != "enterprise":
+        return "Local write did not evict the cached tier"
+    return True
+
+
+def test_tier_cache_invalidated_by_other_process():
+    """A change notice published elsewhere (e.g. the webhook) evicts on poll."""
+    import db_manager as db
+    import subscription_manager as sm
+    db.create_user_admin("tier_u2", "tier_u2@example.com", "pw-123456", tier="solo")
+    db.update_user_fields("tier_u2", last_subscription_sync=datetime.now().isoformat())
+    sm.resolve_user_tier("tier_u2")
+    # Simulate the webhook process: raw write + notice, invisible to local_change_count()
+    conn = db._get_connection()
+    conn.execute("UPDATE users SET subscription_tier = 'agency' WHERE username = 'tier_u2'")
+    conn.execute("INSERT INTO change_versions (scope, change_key, created_at) VALUES ('tier', 'tier_u2', ?)",
+                 (datetime.now().isoformat(),))
+    conn.commit()
+    conn.close()
+    if sm.resolve_user_tier("tier_u2")["_tier_key"] != "solo":
+        return "Expected the cached tier before the poll interval elapsed"
+    sm._sync_tier_invalidations(force=True)
+    if sm.resolve_user_tier("tier_u2")["_tier_key"] != "agency":
+        return "Published change did not evict the cached tier"
+    return True
+
+
+def test_change_poll_sees_late_lower_id_commit():
+    """A notice committed after a higher id was polled is still returned."""
+    import db_manager as db
+    latest, _ = db.get_changes_since("tier")
+    now = datetime.now().isoformat()
+    conn = db._get_connection()
+    try:
+        conn.execute("INSERT INTO change_versions (id, scope, change_key, created_at) VALUES (?, 'tier', 'late_a', ?)",
+                     (latest + 2, now))
+        conn.commit()
+        polled, keys = db.get_changes_since("tier", latest)
+        # The writer that took latest + 1 commits only now
+        conn.execute("INSERT INTO change_versions (id, scope, change_key, created_at) VALUES (?, 'tier', 'late_b', ?)",
+                     (latest + 1, now))
+        conn.commit()
+    finally:
+        conn.close()
+    if polled != latest + 2 or "late_a" not in keys:
+        return f"First poll wrong: {polled} {keys}"
+    again, keys = db.get_changes_since("tier", polled)
+    if "late_b" not in keys or again != polled:
+        return f"Late lower-id notice missed: {again} {keys}"
+    return True
+
+
+def test_tier_cache_polls_ls_in_background():
+    """A stale LS sync returns the DB tier immediately and refreshes off-thread."""
+    import time as _t
+    import db_manager as db
+    import subscription_manager as sm
+    db.create_user_admin("tier_u3", "tier_u3@example.com", "pw-123456", tier="solo")
+    orig_key, orig_poll = sm.LS_API_KEY, sm._poll_ls_for_email
+
+    def slow_poll(email):
+        _t.sleep(0.5)
+        return "agency", "active", "sub_123"
+
+    sm.LS_API_KEY, sm._poll_ls_for_email = "test-key", slow_poll
+    try:
+        start = _t.perf_counter()
+        first = sm.resolve_user_tier("tier_u3")
+        elapsed = _t.perf_counter() - start
+        if elapsed > 0.3 or first["_tier_key"] != "solo":
+            return f"Render path blocked on LS ({elapsed:.2f}s, tier={first['_tier_key']})"
+        deadline = _t.time() + 5
+        while _t.time() < deadline and sm.resolve_user_tier("tier_u3")["_tier_key"] != "agency":
+            _t.sleep(0.05)
+        if sm.resolve_user_tier("tier_u3")["_tier_key"] != "agency":
+            return "Background LS refresh never landed"
+    finally:
+        sm.LS_API_KEY, sm._poll_ls_for_email = orig_key, orig_poll
+    return True
+
+
+def test_tier_refresh_never_caches_over_a_change():
+    """A background refresh publishes only real changes and never caches a result a notice superseded."""
+    import db_manager as db
+    import subscription_manager as sm
+    db.create_user_admin("tier_u4", "tier_u4@example.com", "pw-123456", tier="solo")
+    status = db.get_user_full("tier_u4").get("subscription_status") or "inactive"
+    orig_key, orig_poll = sm.LS_API_KEY, sm._poll_ls_for_email
+
+    def notices():
+        conn = db._get_connection()
+        try:
+            return db._fetchone_val(conn.execute(
+                "SELECT COUNT(*) FROM change_versions WHERE change_key = 'tier_u4'"), 0)
+        finally:
+            conn.close()
+
+    def webhook_during_poll(email):
+        # Another process grants comp access while the LS poll is in flight
+        conn = db._get_connection()
+        conn.execute("INSERT INTO change_versions (scope, change_key, created_at) VALUES ('tier', 'tier_u4', ?)",
+                     (datetime.now().isoformat(),))
+        conn.commit()
+        conn.close()
+        return "solo", status, "sub_u4"
+
+    try:
+        sm.LS_API_KEY = "test-key"
+        polled = []
+        sm._poll_ls_for_email = lambda email: polled.append(email) or ("solo", status, "sub_u4")
+        before = notices()
+        sm._refresh_tier("tier_u4")
+        if not polled or notices() != before:
+            return f"Unchanged refresh published a tier change notice (polled={polled})"
+        if "tier_u4" not in sm._tier_cache:
+            return "Unchanged refresh was not cached"
+
+        _raw_user_update("tier_u4", "last_subscription_sync", None)
+        sm._poll_ls_for_email = webhook_during_poll
+        sm._refresh_tier("tier_u4")
+        if "tier_u4" in sm._tier_cache:
+            return "Refresh cached a result older than a racing notice"
+
+        _raw_user_update("tier_u4", "last_subscription_sync", None)
+        sm._poll_ls_for_email = lambda email: ("agency", "active", "sub_u4")
+        before = notices()
+        sm._refresh_tier("tier_u4")
+        if notices() != before + 1:
+            return "Changed refresh did not publish for other processes"
+        if sm.resolve_user_tier("tier_u4")["_tier_key"] != "agency":
+            return "Changed tier not served after refresh"
+    finally:
+        sm.LS_API_KEY, sm._poll_ls_for_email = orig_key, orig_poll
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 32: Subscription Reconciliation
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _ls_stub_server(subscriptions, page_size):
+    """Local HTTP server mimicking LS /v1/subscriptions paging. Returns (server, base_url, hits)."""
+    import json as _json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            qs = parse_qs(parsed.query)
+            hits.append((self.client_address[1], parsed.path, qs))
+            if parsed.path != "/v1/subscriptions" or not self.headers.get("Authorization", "").startswith("Bearer "):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            page = int(qs.get("page[number]", ["1"])[0])
+            last = max(1, -(-len(subscriptions) // page_size))
+            chunk = subscriptions[(page - 1) * page_size: page * page_size]
+            body = _json.dumps({"data": chunk, "meta": {"page": {"currentPage": page, "lastPage": last}}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.api+json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1", hits
+
+
+def _ls_sub(sub_id, email, status, variant_id, created_at):
+    return {"id": sub_id, "type": "subscriptions",
+            "attributes": {"user_email": email, "status": status, "variant_id": variant_id,
+                           "created_at": created_at}}
+
+
+def test_reconcile_pages_and_applies_diff():
+    """A full pass pages the stub, updates changed users and leaves others alone."""
+    import db_manager as db
+    import subscription_sync as sync
+    from tier_config import TIER_CONFIG
+    agency_variant = TIER_CONFIG["agency"]["lemon_squeezy_variant_ids"][0]
+    db.create_user_admin("rec_u1", "rec_u1@example.com", "pw-123456", tier="solo")
+    db.create_user_admin("rec_u2", "rec_u2@example.com", "pw-123456", tier="solo")
+    db.create_user_admin("rec_admin", "rec_admin@example.com", "pw-123456", tier="super_admin")
+    db.set_user_subscription("rec_u2", "solo", "active", "s2", None)
+    subs = [_ls_sub("s1-old", "rec_u1@example.com", "expired", agency_variant, "2025-01-01T00:00:00Z"),
+            _ls_sub("s1", "REC_U1@example.com", "active", agency_variant, "2026-01-01T00:00:00Z"),
+            _ls_sub("s2", "rec_u2@example.com", "active", None, "2026-01-01T00:00:00Z"),
+            _ls_sub("s3", "rec_admin@example.com", "cancelled", None, "2026-01-01T00:00:00Z"),
+            _ls_sub("s4", "nobody@example.com", "active", None, "2026-01-01T00:00:00Z")]
+    server, base_url, hits = _ls_stub_server(subs, page_size=2)
+    try:
+        stats = sync.reconcile_subscriptions(sync.make_session("test-key"), base_url=base_url, store_id="1")
+    finally:
+        server.shutdown()
+    if stats["status"] != "ok" or stats["pages"] != 3 or stats["subscriptions"] != 5:
+        return f"Paging wrong: {stats}"
+    if (stats["updated"], stats["unchanged"], stats["skipped_protected"]) != (1, 1, 1):
+        return f"Diff wrong: {stats}"
+    u1 = db.get_user_full("rec_u1")
+    if (u1["subscription_tier"], u1["subscription_status"], u1["lemon_squeezy_subscription_id"]) != ("agency", "active", "s1"):
+        return f"rec_u1 not reconciled: {u1['subscription_tier']}/{u1['subscription_status']}/{u1['lemon_squeezy_subscription_id']}"
+    if db.get_user_full("rec_admin")["subscription_tier"] != "super_admin":
+        return "Protected tier was overwritten"
+    if not db.get_user_full("rec_u2")["last_subscription_sync"]:
+        return "Unchanged user's sync timestamp not refreshed"
+    if len({port for port, _, _ in hits}) != 1:
+        return f"Session did not reuse its connection ({len({p for p, _, _ in hits})} sockets)"
+    return True
+
+
+def test_reconcile_records_stats_and_survives_errors():
+    """Run stats are recorded; an HTTP failure aborts without writing users."""
+    import db_manager as db
+    import subscription_sync as sync
+    server, base_url, _ = _ls_stub_server([], page_size=10)
+    try:
+        stats = sync.reconcile_subscriptions(sync.make_session("test-key"), base_url=base_url + "/missing")
+    finally:
+        server.shutdown()
+    if stats["status"] != "error" or "404" not in stats.get("error", ""):
+        return f"Expected a recorded 404 error: {stats}"
+    last = sync.get_last_run()
+    if not last or last["started_at"] != stats["started_at"] or last["status"] != "error":
+        return f"Run stats not recorded: {last}"
+    return True
+
+def test_plan_changes_skips_resolver_protected_users():
+    """Comp access, overrides and running trials are skipped like resolve_user_tier does."""
+    from datetime import timedelta
+    import subscription_sync as sync
+    now = datetime.now()
+    future, past = (now + timedelta(days=3)).isoformat(), (now - timedelta(days=3)).isoformat()
+    base = {"subscription_tier": "solo", "subscription_status": "inactive",
+            "lemon_squeezy_subscription_id": None, "lemon_squeezy_variant_id": None}
+    users = [
+        dict(base, username="p_comp", email="p_comp@x.com", comp_expires_at=future),
+        dict(base, username="p_override", email="p_override@x.com", subscription_override_until=future),
+        dict(base, username="p_trial", email="p_trial@x.com", trial_start_date=past, trial_expired=0),
+        dict(base, username="p_comp_old", email="p_comp_old@x.com", comp_expires_at=past),
+        dict(base, username="p_trial_old", email="p_trial_old@x.com",
+             trial_start_date=(now - timedelta(days=sync.db.TRIAL_DAYS + 1)).isoformat()),
+    ]
+    latest = {u["email"]: _ls_sub(f"s_{u['username']}", u["email"], "active", None, "2026-01-01T00:00:00Z")
+              for u in users}
+    changes, unchanged, counts = sync.plan_changes(users, latest)
+    for reason in ("comp", "override", "trial"):
+        if counts[f"skipped_{reason}"] != 1:
+            return f"Expected one skipped_{reason}: {counts}"
+    changed = sorted(c[0] for c in changes)
+    if changed != ["p_comp_old", "p_trial_old"] or unchanged:
+        return f"Expired comp/trial users should reconcile: {changed} / {unchanged}"
+    return True
+
+
+def test_reconcile_fails_when_page_cap_hit():
+    """Hitting MAX_PAGES is an error, not a successful run on partial data."""
+    import subscription_sync as sync
+    subs = [_ls_sub(f"cap{i}", f"cap{i}@example.com", "active", None, "2026-01-01T00:00:00Z") for i in range(5)]
+    server, base_url, _ = _ls_stub_server(subs, page_size=2)
+    orig_max = sync.MAX_PAGES
+    sync.MAX_PAGES = 2
+    try:
+        stats = sync.reconcile_subscriptions(sync.make_session("test-key"), base_url=base_url, store_id="1")
+    finally:
+        sync.MAX_PAGES = orig_max
+        server.shutdown()
+    if stats["status"] != "error" or "MAX_PAGES" not in stats.get("error", "") or stats["updated"]:
+        return f"Page cap did not fail the run: {stats}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 33: LLM Gateway
+# ═══════════════════════════════════════════════════════════════════════════
+
+class _FakeAPIError(Exception):
+    """Shaped like anthropic.APIStatusError: status_code plus response.headers."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type("Resp", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+def _fake_llm_client(delay=0.0, failures=(), is_async=False):
+    """Client exposing messages.create; raises `failures` in order, then answers."""
+    import threading
+    import time
+    import types
+    state = {"active": 0, "peak": 0, "calls": 0}
+    lock = threading.Lock()
+    pending = list(failures)
+    usage = types.SimpleNamespace(input_tokens=10, output_tokens=5)
+    response = types.SimpleNamespace(content=[types.SimpleNamespace(text="ok")], usage=usage)
+
+    def _begin():
+        with lock:
+            state["calls"] += 1
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            return pending.pop(0) if pending else None
+
+    def _end():
+        with lock:
+            state["active"] -= 1
+
+    if is_async:
+        import asyncio
+
+        async def create(**request):
+            failure = _begin()
+            try:
+                await asyncio.sleep(delay)
+                if failure:
+                    raise failure
+                return response
+            finally:
+                _end()
+    else:
+        def create(**request):
+            failure = _begin()
+            try:
+                time.sleep(delay)
+                if failure:
+                    raise failure
+                return response
+            finally:
+                _end()
+
+    client = types.SimpleNamespace(messages=types.SimpleNamespace(create=create))
+    return client, state
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_gateway_caps_concurrency():
+    """Threads beyond max_concurrency queue instead of hitting the API."""
+    import threading
+    import llm_gateway
+    gw = llm_gateway.LLMGateway(max_concurrency=2, requests_per_minute=0,
+                                input_tokens_per_minute=0, output_tokens_per_minute=0)
+    client, state = _fake_llm_client(delay=0.05)
+    threads = [threading.Thread(target=gw.call, kwargs={"client": client, "model": "m", "max_tokens": 10,
+                                                          "messages": [{"role": "user", "content": "hi"}]})
+               for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = gw.get_stats()
+    if state["calls"] != 6 or state["peak"] > 2:
+        return f"Expected 6 calls with peak <= 2, got {state}"
+    if stats["in_flight"] != 0 or stats["queue_wait_max"] <= 0:
+        return f"Queue metrics not recorded: {stats}"
+    return True
+
+
+def test_gateway_request_bucket_delays():
+    """Once the per-minute request budget is spent, the next call waits for refill."""
+    import llm_gateway
+    clock = _FakeClock()
+    gw = llm_gateway.LLMGateway(requests_per_minute=2, input_tokens_per_minute=0,
+                                output_tokens_per_minute=0, clock=clock, sleep=clock.sleep)
+    client, _ = _fake_llm_client()
+    for _ in range(3):
+        gw.call(client, model="m", max_tokens=10, messages=[{"role": "user", "content": "hi"}])
+    if len(clock.sleeps) != 1 or abs(clock.sleeps[0] - 30.0) > 1e-6:
+        return f"Expected one 30s wait for the third request, got {clock.sleeps}"
+    bucket = llm_gateway.TokenBucket(600, clock)
+    if bucket.reserve(100) != 0 or bucket.reserve(600) <= 0:
+        return "Token bucket should only delay once the minute's budget is overdrawn"
+    return True
+
+
+def test_gateway_retry_policy():
+    """retry-after is honoured, 5xx uses bounded jitter, 4xx surfaces immediately."""
+    import random
+    import llm_gateway
+    clock = _FakeClock()
+    gw = llm_gateway.LLMGateway(requests_per_minute=0, input_tokens_per_minute=0, output_tokens_per_minute=0,
+                                max_retries=2, backoff_base=2, backoff_max=30,
+                                clock=clock, sleep=clock.sleep, rng=random.Random(1))
+    client, state = _fake_llm_client(failures=[_FakeAPIError(429, retry_after="7"), _FakeAPIError(503)])
+    resp = gw.call(client, model="m", max_tokens=10, messages=[{"role": "user", "content": "hi"}])
+    if resp.content[0].text != "ok" or state["calls"] != 3:
+        return f"Expected success on the third attempt, got {state['calls']} calls"
+    if len(clock.sleeps) != 2 or clock.sleeps[0] != 7.0 or not (0 <= clock.sleeps[1] <= 4):
+        return f"Backoff delays wrong: {clock.sleeps}"
+    stats = gw.get_stats()
+    if stats["retries"] != 2 or stats["rate_limited"] != 1:
+        return f"Retry metrics wrong: {stats}"
+
+    client, state = _fake_llm_client(failures=[_FakeAPIError(400)])
+    try:
+        gw.call(client, model="m", max_tokens=10, messages=[{"role": "user", "content": "hi"}])
+        return "400 should have been raised"
+    except _FakeAPIError as e:
+        if e.status_code != 400 or state["calls"] != 1:
+            return f"400 was retried ({state['calls']} calls)"
+    client, state = _fake_llm_client(failures=[_FakeAPIError(503)] * 3)
+    try:
+        gw.call(client, model="m", max_tokens=10, messages=[{"role": "user", "content": "hi"}])
+        return "Exhausted retries should re-raise"
+    except _FakeAPIError:
+        if state["calls"] != 3:
+            return f"Expected 1 + max_retries attempts, got {state['calls']}"
+    return True
+
+
+def test_gateway_async_caps_concurrency():
+    """acall shares the concurrency limit across concurrently awaited requests."""
+    import asyncio
+    import llm_gateway
+    gw = llm_gateway.LLMGateway(max_concurrency=3, requests_per_minute=0,
+                                input_tokens_per_minute=0, output_tokens_per_minute=0)
+    client, state = _fake_llm_client(delay=0.02, is_async=True)
+
+    async def _burst():
+        return await asyncio.gather(*[
+            gw.acall(client, model="m", max_tokens=10, messages=[{"role": "user", "content": "hi"}])
+            for _ in range(10)])
+
+    responses = asyncio.run(_burst())
+    if len(responses) != 10 or state["peak"] > 3 or state["peak"] < 2:
+        return f"Async burst not capped at 3: {state}"
+    return True
+
+
+def test_call_sites_use_gateway():
+    """SignetLogic text calls and visual_audit vision calls are routed through the gateway."""
+    import llm_gateway
+    import logic
+    import visual_audit
+    client, state = _fake_llm_client()
+    before = llm_gateway.get_stats()["calls"]
+    engine = object.__new__(logic.SignetLogic)
+    engine.client = client
+    engine.model = "m"
+    if engine._safe_generate("sys", "hello", max_tokens=10) != "ok":
+        return "Text call did not return the client's answer"
+    if (engine._last_usage["input_tokens"], engine._last_usage["output_tokens"]) != (10, 5):
+        return f"Usage not captured: {engine._last_usage}"
+    original = visual_audit.client
+    visual_audit.client = client
+    try:
+        answer = visual_audit._vision_call("sys", "describe", [_make_test_image(3, (64, 64))])
+    finally:
+        visual_audit.client = original
+    if answer != "ok":
+        return f"Vision call did not return the client's answer: {answer}"
+    if llm_gateway.get_stats()["calls"] - before != 2 or state["calls"] != 2:
+        return f"Expected 2 gateway calls, saw {llm_gateway.get_stats()['calls'] - before}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 34: Streaming Generation
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _fake_stream_client(blocks, failures=(), fail_after=None, input_tokens=12):
+    """Client exposing messages.stream(); emits raw SDK-shaped events for `blocks`.
+
+    failures are raised on entering the stream (before any event); fail_after=n
+    raises after n events have been yielded.
+    """
+    import types
+    ns = types.SimpleNamespace
+    pending = list(failures)
+    state = {"opened": 0}
+
+    def _events():
+        events = [ns(type="message_start", message=ns(usage=ns(input_tokens=input_tokens)))]
+        output = 0
+        for i, (kind, chunks) in enumerate(blocks):
+            events.append(ns(type="content_block_start", index=i, content_block=ns(type=kind)))
+            for chunk in chunks:
+                output += 1
+                delta = ns(type="text_delta", text=chunk) if kind == "text" else ns(type="input_json_delta", partial_json=chunk)
+                events.append(ns(type="content_block_delta", index=i, delta=delta))
+            events.append(ns(type="content_block_stop", index=i))
+        events.append(ns(type="message_delta", usage=ns(output_tokens=output)))
+        events.append(ns(type="message_stop"))
+        return events, output
+
+    class _Stream:
+        def __enter__(self):
+            state["opened"] += 1
+            if pending:
+                raise pending.pop(0)
+            self.events, self.output = _events()
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def __iter__(self):
+            for n, event in enumerate(self.events):
+                if fail_after is not None and n == fail_after:
+                    raise _FakeAPIError(500)
+                yield event
+
+        def get_final_message(self):
+            return ns(usage=ns(input_tokens=input_tokens, output_tokens=self.output))
+
+    client = ns(messages=ns(stream=lambda **request: _Stream()))
+    return client, state
+
+
+def test_safe_stream_yields_deltas_and_usage():
+    """Deltas arrive one by one, text blocks are newline-joined, usage is captured."""
+    import logic
+    client, _ = _fake_stream_client([("text", ["Hello", ", world"]), ("server_tool_use", ["{}"]),
+                                     ("text", ["Second block"])])
+    engine = object.__new__(logic.SignetLogic)
+    engine.client = client
+    engine.model = "m"
+    engine._last_usage = None
+    chunks = list(engine._safe_stream("sys", "hi", max_tokens=50, tools=[logic.WEB_SEARCH_TOOL]))
+    if chunks != ["Hello", ", world", "\n", "Second block"]:
+        return f"Unexpected deltas: {chunks}"
+    if (engine._last_usage["input_tokens"], engine._last_usage["output_tokens"]) != (12, 4):
+        return f"Usage not captured: {engine._last_usage}"
+    return True
+
+
+def test_stream_copy_editor_supports_post_parsing():
+    """The joined copy editor stream still carries TRIAGE/FINDINGS markers intact."""
+    import logic
+    engine = object.__new__(logic.SignetLogic)
+    engine.model = "m"
+    engine._last_usage = None
+    engine.client, _ = _fake_stream_client([("text", ["TRIAGE: ", "REJECT\n", "Draft is from Acme."])])
+    joined = "".join(engine.stream_copy_editor("We at Acme...", "Brand: Meridian"))
+    if "TRIAGE: REJECT" not in joined or joined.split("TRIAGE: REJECT", 1)[1].strip() != "Draft is from Acme.":
+        return f"Reject marker split across deltas was not reassembled: {joined!r}"
+    engine.client, _ = _fake_stream_client([("text", ["RATIONALE: tone\nREWRITE: ", "New copy\nFIND", "INGS: none"])])
+    joined = "".join(engine.stream_content_generator("topic", "Blog", "points", "Brand"))
+    if "FINDINGS:" not in joined or engine._last_usage["output_tokens"] != 3:
+        return f"Generator stream incomplete: {joined!r} / {engine._last_usage}"
+    return True
+
+
+def test_gateway_stream_retries_only_before_output():
+    """Errors before the first event are retried; after partial output they surface."""
+    import llm_gateway
+    clock = _FakeClock()
+    gw = llm_gateway.LLMGateway(requests_per_minute=0, input_tokens_per_minute=0, output_tokens_per_minute=0,
+                                max_retries=2, clock=clock, sleep=clock.sleep)
+    client, state = _fake_stream_client([("text", ["ok"])], failures=[_FakeAPIError(529, retry_after="3")])
+    events = list(gw.stream(client, model="m", max_tokens=10, messages=[{"role": "user", "content": "hi"}]))
+    if state["opened"] != 2 or clock.sleeps != [3.0] or not events:
+        return f"Pre-output failure not retried: opened={state['opened']} sleeps={clock.sleeps}"
+
+    client, state = _fake_stream_client([("text", ["partial", "more"])], fail_after=3)
+    try:
+        list(gw.stream(client, model="m", max_tokens=10, messages=[{"role": "user", "content": "hi"}]))
+        return "Mid-stream failure should have been raised"
+    except _FakeAPIError:
+        pass
+    if state["opened"] != 1:
+        return f"Mid-stream failure was retried ({state['opened']} attempts)"
+
+    client, _ = _fake_stream_client([("text", ["a", "b", "c"])])
+    gen = gw.stream(client, model="m", max_tokens=10, messages=[{"role": "user", "content": "hi"}])
+    next(gen)
+    gen.close()
+    if gw.get_stats()["in_flight"] != 0 or not gw._slots.acquire(blocking=False):
+        return "Abandoned stream did not release its slot"
+    gw._slots.release()
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 35: Prompt Caching
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _recording_llm_client(answer=lambda request: "ok", cache_read=0, cache_write=0):
+    """Client whose messages.create records each request and reports cache usage."""
+    import types
+    ns = types.SimpleNamespace
+    requests_seen = []
+
+    def create(**request):
+        requests_seen.append(request)
+        usage = ns(input_tokens=20, output_tokens=5, cache_creation_input_tokens=cache_write,
+                   cache_read_input_tokens=cache_read)
+        return ns(content=[ns(text=answer(request))], usage=usage)
+
+    return ns(messages=ns(create=create)), requests_seen
+
+
+def test_brand_context_is_cached_prefix():
+    """System prompt and brand block lead the request with cache breakpoints; the draft follows."""
+    import logic
+    client, seen = _recording_llm_client(cache_read=1800)
+    engine = object.__new__(logic.SignetLogic)
+    engine.client = client
+    engine.model = "m"
+    engine.run_copy_editor("First draft about widgets.", "BRAND: Meridian\nTONE: Calm")
+    engine.run_copy_editor("Second, different draft.", "BRAND: Meridian\nTONE: Calm")
+    first, second = seen
+    if first["system"][0].get("cache_control") != logic.CACHE_CONTROL:
+        return f"System prompt not marked for caching: {first['system']}"
+    blocks = first["messages"][0]["content"]
+    if not (blocks[0].get("cache_control") and "<brand_profile>" in blocks[0]["text"]
+            and "First draft" not in blocks[0]["text"] and "First draft" in blocks[-1]["text"]):
+        return f"Brand block is not a cached prefix ahead of the draft: {blocks}"
+    if (first["system"], blocks[0]) != (second["system"], second["messages"][0]["content"][0]):
+        return "Prefix changed between drafts for the same brand"
+    if engine._last_usage.get("cache_read_input_tokens") != 1800:
+        return f"Cache reads not captured: {engine._last_usage}"
+    return True
+
+
+def test_estimate_api_cost_prices_cache_tokens():
+    """Cache writes bill at 1.25x input, reads at 0.1x; defaults keep the old formula."""
+    import db_manager as db
+    base = db.estimate_api_cost(1_000_000, 0, model="claude-opus-4-6")
+    if base != 5.0 or db.estimate_api_cost(1000, 200) != round(1000 * 5e-6 + 200 * 25e-6, 6):
+        return f"Uncached pricing changed: {base}"
+    write = db.estimate_api_cost(0, 0, model="claude-opus-4-6", cache_creation_input_tokens=1_000_000)
+    read = db.estimate_api_cost(0, 0, model="claude-opus-4-6", cache_read_input_tokens=1_000_000)
+    if (write, read) != (6.25, 0.5):
+        return f"Cache pricing wrong: write={write} read={read}"
+    return True
+
+
+def test_visual_audit_caches_brand_and_tallies_usage():
+    """Audit vision calls put the brand block before the image and report summed usage."""
+    import visual_audit
+
+    def answer(request):
+        if request["system"][0]["text"] == visual_audit._VISUAL_IDENTITY_SYSTEM:
+            return json.dumps({"logo_present": True, "logo_findings": [], "visual_findings": [],
+                               "typography_findings": [], "visual_identity_score": 80, "summary": "ok"})
+        if request["system"][0]["text"] == visual_audit._COPY_EXTRACTION_SYSTEM:
+            return "HEADLINE: Built to last. BODY: Quality you can feel."
+        return json.dumps({"findings": [], "copy_score": 70, "text_summary": "t", "summary": "ok"})
+
+    client, seen = _recording_llm_client(answer, cache_read=900, cache_write=100)
+    original = visual_audit.client
+    visual_audit.client = client
+    try:
+        layers = visual_audit.run_audit_layers(_make_test_image(seed=21), dict(_AUDIT_INPUTS), parallel=True)
+    finally:
+        visual_audit.client = original
+    if len(seen) != 3:
+        return f"Expected 3 vision calls, got {len(seen)}"
+    usage = layers["usage"]
+    if (usage["input_tokens"], usage["cache_read_input_tokens"], usage["cache_creation_input_tokens"]) != (60, 2700, 300):
+        return f"Usage not summed across layers: {usage}"
+    identity = next(r for r in seen if r["system"][0]["text"] == visual_audit._VISUAL_IDENTITY_SYSTEM)
+    blocks = identity["messages"][0]["content"]
+    if not (blocks[0].get("cache_control") and "<brand_visual_identity>" in blocks[0]["text"]
+            and blocks[1]["type"] == "image" and "<detected_colors>" in blocks[-1]["text"]):
+        return f"Identity request not prefix-ordered: {[b.get('type') for b in blocks]}"
+    if visual_audit._usage_tally.get() is not None:
+        return "Usage tally leaked past the audit"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 36: Analytics Rollups
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _seed_rollup_events(user, days_ago_list):
+    """Insert one of each rolled-up event type per day for `user`, UTC timestamps."""
+    import json
+    from datetime import datetime, timedelta, timezone
+    import db_manager as db
+    now = datetime.now(timezone.utc)
+    conn = db._get_connection()
+    try:
+        for days_ago in days_ago_list:
+            ts = (now - timedelta(days=days_ago)).strftime("%Y-%m-%d %H:%M:%S")
+            for event_type, meta in (
+                    ("module_action", {"module": "copy_editor"}),
+                    ("session_start", {}),
+                    ("api_cost", {"module": "copy_editor", "estimated_cost_usd": 0.25,
+                                  "input_tokens": 100, "output_tokens": 10}),
+                    ("output_feedback", {"module": "copy_editor", "rating": "close"})):
+                conn.execute("INSERT INTO product_events (event_type, username, metadata_json, session_id, timestamp) "
+                             "VALUES (?, ?, ?, 'rollup-seed', ?)", (event_type, user, json.dumps(meta), ts))
+        conn.commit()
+    finally:
+        conn.close()
+    db.backfill_event_columns()
+
+
+def _analytics_snapshot():
+    import db_manager as db
+    costs = db.get_api_costs(30)
+    return {
+        "active_7": db.get_active_users(7),
+        "active_30": db.get_active_user_count(30),
+        "sessions": db.get_user_sessions_per_week(28),
+        "engagement": sorted((m["module"], m["total_actions"], m["unique_users"]) for m in db.get_module_engagement()),
+        "week0": db.get_module_engagement_week(0),
+        "week1": db.get_module_engagement_week(1),
+        "cost": (round(costs["total_cost"], 6), costs["total_actions"],
+                 [(d["day"], round(d["cost"], 6)) for d in costs["daily"]]),
+        "feedback": db.get_feedback_summary(),
+        "feedback_by_module": sorted((m["module"], m["close"], m["total_actions"]) for m in db.get_feedback_by_module()),
+        "feedback_weekly": db.get_feedback_weekly(4),
+    }
+
+
+def _delete_rollup_seed():
+    import db_manager as db
+    conn = db._get_connection()
+    try:
+        conn.execute("DELETE FROM product_events WHERE session_id = 'rollup-seed'")
+        conn.commit()
+    finally:
+        conn.close()
+    db.rebuild_analytics_rollups()
+
+
+def test_rollup_readers_match_raw_events():
+    """Readers return the same numbers before a refresh, after it, and after a rebuild."""
+    import db_manager as db
+    lag, db.ANALYTICS_ROLLUP_LAG_SECONDS = db.ANALYTICS_ROLLUP_LAG_SECONDS, 0
+    try:
+        db.rebuild_analytics_rollups()
+        base = _analytics_snapshot()
+        _seed_rollup_events("rollup_a", [0, 2, 5, 12, 40])
+        raw = _analytics_snapshot()
+        if raw["active_7"] != base["active_7"] + 1 or raw["active_30"] != base["active_30"] + 1:
+            return f"Unrolled events not counted: {base['active_7']} -> {raw['active_7']}"
+        if raw["feedback"]["close"] != base["feedback"]["close"] + 5:
+            return f"Feedback before refresh: {raw['feedback']}"
+        if round(raw["cost"][0] - base["cost"][0], 6) != 1.0:
+            return f"Cost over 30 days should grow by 4 x 0.25: {base['cost'][0]} -> {raw['cost'][0]}"
+        if db.refresh_analytics_rollups() < 20:
+            return "Refresh did not fold the seeded events"
+        if _analytics_snapshot() != raw:
+            return f"Rollups changed the numbers: {_analytics_snapshot()} != {raw}"
+        db.rebuild_analytics_rollups()
+        if _analytics_snapshot() != raw:
+            return "Rebuild changed the numbers"
+    finally:
+        _delete_rollup_seed()
+        db.ANALYTICS_ROLLUP_LAG_SECONDS = lag
+    return True
+
+
+def test_rollup_refresh_is_incremental():
+    """Refresh only reads events past the watermark and never double counts."""
+    import db_manager as db
+    lag, db.ANALYTICS_ROLLUP_LAG_SECONDS = db.ANALYTICS_ROLLUP_LAG_SECONDS, 0
+    try:
+        db.rebuild_analytics_rollups()
+        _seed_rollup_events("rollup_b", [1, 3])
+        start = db.get_rollup_watermark()
+        if db.refresh_analytics_rollups(batch_size=3) != 8:
+            return "Batched refresh should fold all 8 seeded events"
+        if db.get_rollup_watermark() <= start:
+            return "Watermark did not advance"
+        if db.refresh_analytics_rollups() != 0:
+            return "Second refresh re-read processed events"
+        folded = _analytics_snapshot()
+        _seed_rollup_events("rollup_b", [3])
+        if db.refresh_analytics_rollups(max_batches=1, batch_size=2) != 2:
+            return "max_batches did not cap the run"
+        # Two of the four new events are rolled up, two are still past the watermark
+        partial = _analytics_snapshot()
+        if partial["feedback"]["close"] != folded["feedback"]["close"] + 1:
+            return f"Pending closed-day events missing: {partial['feedback']}"
+        if partial["cost"][1] != folded["cost"][1] + 1:
+            return "Pending api_cost event missing from costs"
+        conn = db._get_connection()
+        try:
+            rows = conn.execute("SELECT SUM(module_actions), SUM(sessions) FROM analytics_user_daily "
+                                "WHERE username = 'rollup_b'").fetchone()
+        finally:
+            conn.close()
+        if tuple(rows) != (3, 3):
+            return f"Rollup rows double counted or missing: {tuple(rows)}"
+    finally:
+        _delete_rollup_seed()
+        db.ANALYTICS_ROLLUP_LAG_SECONDS = lag
+    return True
+
+
+def test_rollup_watermark_waits_out_safety_lag():
+    """The watermark stops before events inside the lag; readers still count them."""
+    import db_manager as db
+    lag, db.ANALYTICS_ROLLUP_LAG_SECONDS = db.ANALYTICS_ROLLUP_LAG_SECONDS, 0
+    try:
+        db.rebuild_analytics_rollups()
+        _seed_rollup_events("rollup_c", [2])
+        _seed_rollup_events("rollup_c", [0])  # Just written: inside the lag window
+        _seed_rollup_events("rollup_c", [3])
+        raw = _analytics_snapshot()
+        db.ANALYTICS_ROLLUP_LAG_SECONDS = 300
+        if db.refresh_analytics_rollups() != 4:
+            return "Refresh should stop at the first event inside the lag"
+        if _analytics_snapshot() != raw:
+            return "Events inside the lag (or after them) missing from readers"
+        db.ANALYTICS_ROLLUP_LAG_SECONDS = 0
+        if db.refresh_analytics_rollups() != 8:
+            return "Settled events were not folded once the lag passed"
+        if _analytics_snapshot() != raw:
+            return "Folding after the lag changed the numbers"
+    finally:
+        _delete_rollup_seed()
+        db.ANALYTICS_ROLLUP_LAG_SECONDS = lag
+    return True
+
+
+def test_rollups_initialized_by_migration_and_worker():
+    """run_migrations does the initial fold; the worker's pass folds what arrives later."""
+    import db_manager as db
+    import analytics_worker
+    lag, db.ANALYTICS_ROLLUP_LAG_SECONDS = db.ANALYTICS_ROLLUP_LAG_SECONDS, 0
+    try:
+        _seed_rollup_events("rollup_d", [1, 4])
+        conn = db._get_connection()
+        try:
+            conn.execute("DELETE FROM analytics_user_daily")
+            conn.execute("DELETE FROM analytics_module_daily")
+            conn.execute("DELETE FROM platform_settings WHERE key IN (?, ?)",
+                         (db.ROLLUP_WATERMARK_KEY, db._ROLLUP_INITIAL_KEY))
+            conn.commit()
+        finally:
+            conn.close()
+        db.run_migrations()
+        if db.get_platform_setting(db._ROLLUP_INITIAL_KEY) != "done" or db.get_rollup_watermark() == 0:
+            return "run_migrations did not do the initial rollup fold"
+        if db.refresh_analytics_rollups() != 0:
+            return "Initial fold left events behind"
+        _seed_rollup_events("rollup_d", [2])
+        if analytics_worker.refresh_once() != 4 or analytics_worker.main(["--once"]) != 0:
+            return "Worker pass did not fold the new events"
+    finally:
+        _delete_rollup_seed()
+        db.ANALYTICS_ROLLUP_LAG_SECONDS = lag
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 37: Inactive User Diagnostics
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_inactive_diagnostics_fixed_query_count():
+    """Diagnostics cover every inactive user with the same few queries at any scale."""
+    import json
+    import db_manager as db
+    conn = db._get_connection()
+    try:
+        for i in range(12):
+            conn.execute("INSERT INTO users (username, email, password_hash, org_id, subscription_tier, "
+                         "subscription_status, created_at) VALUES (?, ?, 'x', ?, 'solo', 'active', "
+                         "'2020-01-01')", (f"idle{i}", f"idle{i}@example.com", "idle_org" if i < 6 else None))
+        conn.execute("INSERT INTO product_events (event_type, username, metadata_json, timestamp) "
+                     "VALUES ('module_action', 'idle0', ?, '2020-01-02 00:00:00')",
+                     (json.dumps({"module": "copy_editor"}),))
+        conn.execute("INSERT INTO profiles (org_id, name, data, created_at) VALUES ('idle_org', 'B', ?, '2020-01-01')",
+                     (json.dumps({"calibration_score": 72, "inputs": {"voice_dna": "v" * 40,
+                                                                      "mh_brand_promise": "p"}}),))
+        conn.execute("INSERT INTO profiles (org_id, name, data, created_at) VALUES ('idle7', 'B', ?, '2020-01-01')",
+                     (json.dumps({"calibration_score": 30, "inputs": {}}),))
+        conn.commit()
+    finally:
+        conn.close()
+    db.backfill_profile_summaries()
+    db.backfill_event_columns()
+
+    calls = [0]
+    execute = db._execute_plain
+
+    def counting(*args, **kwargs):
+        calls[0] += 1
+        return execute(*args, **kwargs)
+
+    db._execute_plain = counting
+    try:
+        rows = {r["username"]: r for r in db.get_inactive_user_diagnostics(14)}
+    finally:
+        db._execute_plain = execute
+        conn = db._get_connection()
+        try:
+            conn.execute("DELETE FROM users WHERE username LIKE 'idle%'")
+            conn.execute("DELETE FROM product_events WHERE username = 'idle0'")
+            conn.execute("DELETE FROM profiles WHERE org_id IN ('idle_org', 'idle7')")
+            conn.commit()
+        finally:
+            conn.close()
+
+    if calls[0] > 3:
+        return f"{calls[0]} queries for {len(rows)} inactive users"
+    if not all(f"idle{i}" in rows for i in range(12)):
+        return "Inactive users missing from diagnostics"
+    idle0, idle5, idle7 = rows["idle0"], rows["idle5"], rows["idle7"]
+    if (idle0["total_actions"], idle0["confidence"]) != (1, 72) or "Copy Editor" in idle0["missing"]:
+        return f"Org brand or module history not applied: {idle0}"
+    if idle0["missing"].startswith("No ") or idle5["confidence"] != 72:
+        return f"Org readiness not shared across members: {idle0} / {idle5}"
+    if idle7["confidence"] != 30 or not idle7["missing"].startswith("No voice samples, No message house"):
+        return f"Org-less user should fall back to own brands: {idle7}"
+    if rows["idle8"]["last_active"] != "Never":
+        return f"User without events should be Never active: {rows['idle8']}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 38: Profile Summary Columns
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_profile_summary_columns_maintained():
+    """save_profile writes summary columns; backfill repairs rows written without them."""
+    import json
+    import db_manager as db
+    voice = "[ASSET: a]\nCLUSTER: THOUGHT LEADERSHIP\n[ASSET: b]\nCLUSTER: Thought Leadership\n[ASSET: c]\nCLUSTER: Crisis & Response"
+    data = {"calibration_score": 70, "inputs": {"wiz_name": "N", "wiz_mission": "M", "wiz_values": "V",
+                                                "voice_dna": voice, "mh_boilerplate": "About us."}}
+    db.save_profile("summary_user", "Summary Brand", data)
+
+    def _row():
+        conn = db._get_connection()
+        try:
+            return dict(conn.execute(f"SELECT {', '.join(db._SUMMARY_NAMES)}, LENGTH(data) AS real_bytes "
+                                     "FROM profiles WHERE org_id = 'summary_user'").fetchone())
+        finally:
+            conn.close()
+
+    try:
+        row = _row()
+        clusters = json.loads(row["voice_cluster_counts"])
+        expected = {"calibration_score": 70, "strategy_fields": 3, "voice_samples": 3, "has_voice": 1,
+                    "has_message_house": 1, "has_visual": 0, "has_social": 0}
+        if any(row[k] != v for k, v in expected.items()):
+            return f"Summary columns wrong: {row}"
+        if (clusters["Thought Leadership"], clusters["Crisis & Response"], clusters["Brand Marketing"]) != (2, 1, 0):
+            return f"Cluster counts wrong: {clusters}"
+        if row["data_bytes"] != row["real_bytes"]:
+            return f"data_bytes {row['data_bytes']} != {row['real_bytes']}"
+
+        data["calibration_score"] = 90
+        data["inputs"]["visual_dna"] = "[ASSET: logo]"
+        db.save_profile("summary_user", "Summary Brand", data)
+        if (_row()["calibration_score"], _row()["has_visual"]) != (90, 1):
+            return "Re-save did not refresh the summary"
+
+        conn = db._get_connection()
+        try:
+            conn.execute("UPDATE profiles SET calibration_score = 0, has_voice = 0, data_bytes = 0 "
+                         "WHERE org_id = 'summary_user'")
+            conn.commit()
+        finally:
+            conn.close()
+        db.backfill_profile_summaries()
+        row = _row()
+        if (row["calibration_score"], row["has_voice"], row["data_bytes"]) != (90, 1, row["real_bytes"]):
+            return f"Backfill did not restore the summary: {row}"
+        if [p["calibration_score"] for p in db.get_profile_index("summary_user")] != [90]:
+            return "Profile index not served from the summary column"
+    finally:
+        db.delete_profile("summary_user", "Summary Brand")
+    return True
+
+
+def test_profile_analytics_aggregate_summary_columns():
+    """Calibration and completion analytics match a JSON decode of every brand."""
+    import json
+    import db_manager as db
+    conn = db._get_connection()
+    try:
+        profiles = [json.loads(r[0]) for r in conn.execute(
+            "SELECT data FROM profiles WHERE is_sample_brand = 0 OR is_sample_brand IS NULL").fetchall()]
+        profiles = [p if isinstance(p, dict) else {} for p in profiles]
+    finally:
+        conn.close()
+    buckets, scores = db.get_calibration_distribution()
+    expected_scores = sorted(int(float(p.get("calibration_score") or 0)) for p in profiles)
+    if sorted(scores) != expected_scores or sum(buckets.values()) != len(profiles):
+        return f"Distribution {buckets} / {scores} != {expected_scores}"
+    stats = db.get_profile_completion_stats()
+    if profiles:
+        voice = sum(1 for p in profiles
+                    if len(p.get("inputs", {}).get("voice_dna", "")) > 20 or "[ASSET:" in p.get("inputs", {}).get("voice_dna", ""))
+        if stats.get("voice_samples") != round(voice / len(profiles) * 100):
+            return f"Voice completion {stats} disagrees with decoded profiles"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 39: Streaming Exports
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_export_event_types_cover_call_sites():
+    """PRODUCT_EVENT_TYPES lists every event type the code records."""
+    import glob
+    import re
+    import db_manager as db
+    recorded = {"onboarding_step"}  # check_milestone
+    for path in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")):
+        if os.path.basename(path).startswith(("test_", "benchmark_")):
+            continue
+        with open(path, encoding="utf-8") as f:
+            recorded |= set(re.findall(r"track_event\(\s*[\"']([a-z_]+)[\"']", f.read()))
+    missing = sorted(recorded - set(db.PRODUCT_EVENT_TYPES))
+    return True if not missing else f"Event types missing from PRODUCT_EVENT_TYPES: {missing}"
+
+
+def test_event_export_streams_filters_and_gzips():
+    """Event export streams in batches, honours filters, and gzips losslessly."""
+    import csv
+    import gzip
+    import io
+    import db_manager as db
+    conn = db._get_connection()
+    try:
+        for i in range(25):
+            conn.execute("INSERT INTO product_events (event_type, username, session_id, timestamp) "
+                         "VALUES (?, 'export_u', 'export-seed', ?)",
+                         ("export_a" if i % 2 else "export_b", f"2030-01-{i + 1:02d} 12:00:00"))
+        conn.commit()
+    finally:
+        conn.close()
+    try:
+        chunks = list(db.iter_product_events_csv(start="2030-01-01", end="2030-02-01", fetch_size=10))
+        rows = list(csv.reader(io.StringIO("".join(chunks))))
+        if len(chunks) != 3 or len(rows) != 26 or rows[0][:2] != ["id", "event_type"]:
+            return f"Expected header + 25 rows in 3 chunks, got {len(rows)} rows in {len(chunks)} chunks"
+        ts = rows[0].index("timestamp")
+        if [r[ts][:10] for r in rows[1:3]] != ["2030-01-25", "2030-01-24"]:
+            return "Export is not newest first"
+        filtered = list(csv.reader(io.StringIO(db.get_product_events_csv(
+            start="2030-01-05", end="2030-01-10", event_types=["export_a"]))))
+        if [r[ts][:10] for r in filtered[1:]] != ["2030-01-08", "2030-01-06"]:
+            return f"Filters not applied: {filtered[1:]}"
+        raw = "".join(db.iter_product_events_csv(start="2030-01-01"))
+        if gzip.decompress(b"".join(db.gzip_chunks(db.iter_product_events_csv(start="2030-01-01")))).decode() != raw:
+            return "gzip stream does not round-trip"
+        empty = db.get_product_events_csv(start="2099-01-01")
+        if not empty.startswith("id,event_type") or empty.count("\n") != 1:
+            return f"Empty export should be header only: {empty!r}"
+    finally:
+        conn = db._get_connection()
+        try:
+            conn.execute("DELETE FROM product_events WHERE session_id = 'export-seed'")
+            conn.commit()
+        finally:
+            conn.close()
+    return True
+
+
+def test_user_export_is_set_based():
+    """User export reads usage for every user in one query and matches the per-user counters."""
+    import csv
+    import io
+    import db_manager as db
+    month = "2031-07"
+    db.record_usage_action("ctr_a", "ctr_org", "copy_editor", 4, month)
+    rows = list(csv.DictReader(io.StringIO("".join(db.iter_user_export_csv(month)))))
+    by_user = db.get_monthly_usage_by_user(month)
+    users = db.get_all_users_full()
+    if len(rows) != len(users) or set(by_user) != {u["username"] for u in users}:
+        return f"Export has {len(rows)} rows for {len(users)} users"
+    for row in rows:
+        if int(row["actions_this_month"]) != db.get_monthly_usage_user(row["username"], month):
+            return f"Usage mismatch for {row['username']}: {row}"
+    return True
+
+
+def test_event_export_memory_ceiling():
+    """Exporting a large synthetic event table keeps RSS growth bounded (subprocess)."""
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(
+        [sys.executable, os.path.join(here, "benchmark_event_export.py"), "--events", "100000",
+         "--fetch-size", "1000", "--max-rss-growth-mb", "48", "--gzip"],
+        cwd=here, capture_output=True, text=True, timeout=300)
+    if proc.returncode != 0:
+        return f"Export exceeded memory ceiling or failed: {proc.stdout[-400:]} {proc.stderr[-400:]}"
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════
+# CATEGORY 40: Typed Event Columns
+# ═══════════════════════════════════════════════════════════════════════════
+
+def test_track_event_fills_typed_columns():
+    """track_event copies module, model, tokens, cost, rating, confidence and new_score into columns."""
+    import db_manager as db
+    db.track_event("api_cost", "typed_user", metadata={
+        "module": "copy_editor", "model": "claude-sonnet-4-6", "input_tokens": 1200,
+        "output_tokens": 300, "estimated_cost_usd": 0.0081})
+    db.track_event("output_feedback", "typed_user", metadata={
+        "module": "copy_editor", "rating": "close", "engine_confidence": 64})
+    db.track_event("calibration_change", "typed_user", metadata={"old_score": 40, "new_score": 70})
+    db.check_milestone("typed_user", "first_module_run")
+    db.flush_events()
+    conn = db._get_connection()
+    try:
+        rows = {r["event_type"]: dict(r) for r in conn.execute(
+            f"SELECT event_type, {', '.join(db._EVENT_COLUMN_NAMES)} FROM product_events "
+            "WHERE username = 'typed_user'").fetchall()}
+    finally:
+        conn.close()
+    cost, feedback = rows.get("api_cost", {}), rows.get("output_feedback", {})
+    if (cost.get("module"), cost.get("model"), cost.get("input_tokens"), cost.get("output_tokens"),
+            cost.get("cost_usd")) != ("copy_editor", "claude-sonnet-4-6", 1200, 300, 0.0081):
+        return f"api_cost columns: {cost}"
+    if (feedback.get("rating"), feedback.get("confidence")) != ("close", 64.0):
+        return f"output_feedback columns: {feedback}"
+    change = rows.get("calibration_change", {})
+    if (change.get("new_score"), change.get("confidence")) != (70.0, None):
+        return f"calibration_change should carry new_score in its own column: {change}"
+    if not any(w["avg_score"] for w in db.get_avg_calibration_trend(1)):
+        return "Calibration trend does not read new_score"
+    if rows.get("onboarding_step", {}).get("step") != "first_module_run":
+        return f"Milestone step column not set: {rows.get('onboarding_step')}"
+    return True
+
+
+def test_event_columns_backfill_and_index():
+    """Legacy JSON-only rows are backfilled, and module cost queries use the typed index."""
+    import db_manager as db
+    conn = db._get_connection()
+    try:
+        conn.execute("INSERT INTO product_events (event_type, username, metadata_json) VALUES "
+                     "('onboarding_step', 'typed_legacy', ?)", (json.dumps({"step": "message_house_started"}),))
+        conn.execute("INSERT INTO product_events (event_type, username, metadata_json) VALUES "
+                     "('api_cost', 'typed_legacy', ?)",
+                     (json.dumps({"module": "visual_audit", "estimated_cost_usd": "0.5", "input_tokens": 10}),))
+        conn.execute("INSERT INTO product_events (event_type, username, metadata_json) VALUES "
+                     "('page_view', 'typed_legacy', 'not json')")
+        conn.commit()
+    finally:
+        conn.close()
+    before, _ = db.get_onboarding_funnel()
+    if db.backfill_event_columns(batch_size=1) < 2:
+        return "Backfill skipped legacy rows"
+    after, _ = db.get_onboarding_funnel()
+    if after["message_house_started"] != before["message_house_started"] + 1:
+        return f"Funnel does not read the backfilled step column: {before} -> {after}"
+    conn = db._get_connection()
+    try:
+        row = conn.execute("SELECT module, cost_usd, input_tokens FROM product_events "
+                           "WHERE username = 'typed_legacy' AND event_type = 'api_cost'").fetchone()
+        plan = [r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT SUM(cost_usd) FROM product_events WHERE event_type = 'api_cost' "
+            "AND module = ? AND timestamp >= ?", ("visual_audit", "2026-01-01")).fetchall()]
+    finally:
+        conn.close()
+    if tuple(row) != ("visual_audit", 0.5, 10):
+        return f"Backfilled api_cost columns wrong: {tuple(row)}"
+    if not any("idx_pe_type_module_ts" in d for d in plan):
+        return f"Module cost query does not use idx_pe_type_module_ts: {plan}"
+    return True
+
+
 # Report Generation
 # ═══════════════════════════════════════════════════════════════════════════
 
@@ -2480,6 +4950,244 @@ def main():
     cat15_pass = sum(1 for s,_,_ in results[cat15_start:] if s=='PASS')
     print(f"  {cat15_pass}/{len(results)-cat15_start} passed")
 
+    # ── Category 16: Connection Pooling ──
+    print("Category 16: Connection Pooling...")
+    cat16_start = len(results)
+    run_test("Cat 16: SQLite connection reused", test_pool_sqlite_reuses_connection)
+    run_test("Cat 16: Uncommitted work discarded on release", test_pool_discards_uncommitted_work)
+    run_test("Cat 16: Nested checkout keeps outer transaction", test_pool_nested_checkout_keeps_outer_transaction)
+    run_test("Cat 16: DB_NAME switch reopens connection", test_pool_sqlite_switches_db_path)
+    run_test("Cat 16: Bounded pool waits + peak", test_pool_bounded_waits_and_peak)
+    run_test("Cat 16: Timeout + health check", test_pool_timeout_and_health_check)
+    cat16_pass = sum(1 for s,_,_ in results[cat16_start:] if s=='PASS')
+    print(f"  {cat16_pass}/{len(results)-cat16_start} passed")
+
+    # ── Category 17: Background Event Writer ──
+    print("Category 17: Background Event Writer...")
+    cat17_start = len(results)
+    run_test("Cat 17: Events batched and flushed", test_event_writer_batches_events)
+    run_test("Cat 17: Enqueue timestamp format", test_event_writer_timestamp_format)
+    run_test("Cat 17: Milestone dedup", test_event_writer_milestone_dedup)
+    run_test("Cat 17: Milestones seeded from DB", test_event_writer_milestone_seeded_from_db)
+    run_test("Cat 17: Queue drained on shutdown", test_event_writer_drains_on_shutdown)
+    cat17_pass = sum(1 for s,_,_ in results[cat17_start:] if s=='PASS')
+    print(f"  {cat17_pass}/{len(results)-cat17_start} passed")
+
+    # ── Category 18: Dominant Color Cache ──
+    print("Category 18: Dominant Color Cache...")
+    cat18_start = len(results)
+    run_test("Cat 18: Cache hit on identical pixels", test_color_cache_hit_on_same_pixels)
+    run_test("Cat 18: Key includes pixels and num_colors", test_color_cache_key_includes_params)
+    run_test("Cat 18: Returned palette is a copy", test_color_cache_result_not_mutable)
+    run_test("Cat 18: Disk tier + size eviction", test_color_cache_disk_tier_and_eviction)
+    cat18_pass = sum(1 for s,_,_ in results[cat18_start:] if s=='PASS')
+    print(f"  {cat18_pass}/{len(results)-cat18_start} passed")
+
+    # ── Category 19: Color Quantization Engines ──
+    print("Category 19: Color Quantization Engines...")
+    cat19_start = len(results)
+    run_test("Cat 19: Engines share output contract", test_quantizers_share_output_contract)
+    run_test("Cat 19: Engines agree with KMeans (ΔE)", test_quantizers_agree_on_flat_palette)
+    run_test("Cat 19: Quantizer selection + fallback", test_quantizer_selection)
+    run_test("Cat 19: Cache keyed by engine", test_quantizer_cache_keyed_by_method)
+    run_test("Cat 19: sklearn import deferred", test_logic_import_defers_sklearn)
+    cat19_pass = sum(1 for s,_,_ in results[cat19_start:] if s=='PASS')
+    print(f"  {cat19_pass}/{len(results)-cat19_start} passed")
+
+    # ── Category 20: Vectorized Color Scoring ──
+    print("Category 20: Vectorized Color Scoring...")
+    cat20_start = len(results)
+    run_test("Cat 20: Vectorized == scalar (randomized)", test_vectorized_scorer_matches_scalar)
+    run_test("Cat 20: Tint/shade labels", test_vectorized_scorer_tint_shade_labels)
+    cat20_pass = sum(1 for s,_,_ in results[cat20_start:] if s=='PASS')
+    print(f"  {cat20_pass}/{len(results)-cat20_start} passed")
+
+    # ── Category 21: Perceptual (CIEDE2000) Color Matching ──
+    print("Category 21: Perceptual Color Matching...")
+    cat21_start = len(results)
+    run_test("Cat 21: CIEDE2000 reference pairs", test_ciede2000_reference_values)
+    run_test("Cat 21: Lab mode scoring + palette cache", test_ciede2000_mode_scoring)
+    run_test("Cat 21: Color compliance mode", test_color_compliance_reports_mode)
+    cat21_pass = sum(1 for s,_,_ in results[cat21_start:] if s=='PASS')
+    print(f"  {cat21_pass}/{len(results)-cat21_start} passed")
+
+    # ── Category 22: Parallel Visual Audit Layers ──
+    print("Category 22: Parallel Visual Audit Layers...")
+    cat22_start = len(results)
+    run_test("Cat 22: Layers overlap in parallel mode", test_audit_layers_run_concurrently)
+    run_test("Cat 22: Per-layer timeout reported", test_audit_layer_timeout_reported)
+    run_test("Cat 22: Late layer usage reported", test_audit_late_layer_usage_reported)
+    run_test("Cat 22: Sequential == parallel scores", test_full_audit_sequential_matches_parallel)
+    cat22_pass = sum(1 for s,_,_ in results[cat22_start:] if s=='PASS')
+    print(f"  {cat22_pass}/{len(results)-cat22_start} passed")
+
+    # ── Category 23: Prepared Vision Images ──
+    print("Category 23: Prepared Vision Images...")
+    cat23_start = len(results)
+    run_test("Cat 23: Payload cached by content", test_prepare_image_cached_by_content)
+    run_test("Cat 23: Oversized images downscaled", test_prepare_image_downscales_oversized)
+    run_test("Cat 23: One payload per audit", test_full_audit_reuses_one_payload)
+    cat23_pass = sum(1 for s,_,_ in results[cat23_start:] if s=='PASS')
+    print(f"  {cat23_pass}/{len(results)-cat23_start} passed")
+
+    # ── Category 24: Vision Image Size Budgets ──
+    print("Category 24: Vision Image Size Budgets...")
+    cat24_start = len(results)
+    run_test("Cat 24: Adaptive quality caps bytes", test_budget_caps_bytes_with_adaptive_quality)
+    run_test("Cat 24: Per-module budgets", test_module_budgets_differ)
+    run_test("Cat 24: Usage reports image bytes", test_vision_usage_reports_image_bytes)
+    cat24_pass = sum(1 for s,_,_ in results[cat24_start:] if s=='PASS')
+    print(f"  {cat24_pass}/{len(results)-cat24_start} passed")
+
+    # ── Category 25: Memoized Brand Context ──
+    print("Category 25: Memoized Brand Context...")
+    cat25_start = len(results)
+    run_test("Cat 25: Memo hits match fresh build", test_brand_context_memo_hits_and_matches)
+    run_test("Cat 25: Profile edits change fingerprint", test_brand_context_memo_tracks_edits)
+    run_test("Cat 25: Invalidated on profile save", test_brand_context_invalidated_on_save)
+    cat25_pass = sum(1 for s,_,_ in results[cat25_start:] if s=='PASS')
+    print(f"  {cat25_pass}/{len(results)-cat25_start} passed")
+
+    # ── Category 26: Externalized Asset Store ──
+    print("Category 26: Externalized Asset Store...")
+    cat26_start = len(results)
+    run_test("Cat 26: Save externalizes images", test_save_profile_externalizes_images)
+    run_test("Cat 26: Assets deduplicated", test_assets_deduplicated_across_brands)
+    run_test("Cat 26: Migration shrinks inline profiles", test_migration_rewrites_inline_profiles)
+    run_test("Cat 26: resolve_visual_ref round trip", test_resolve_visual_ref_round_trip)
+    cat26_pass = sum(1 for s,_,_ in results[cat26_start:] if s=='PASS')
+    print(f"  {cat26_pass}/{len(results)-cat26_start} passed")
+
+    # ── Category 27: Lazy Profile Loading ──
+    print("Category 27: Lazy Profile Loading...")
+    cat27_start = len(results)
+    run_test("Cat 27: Index projects summary fields", test_profile_index_projects_summary)
+    run_test("Cat 27: Decode on demand with LRU", test_lazy_profiles_decode_on_demand)
+    run_test("Cat 27: Session edits visible", test_lazy_profiles_track_session_edits)
+    run_test("Cat 27: Vanished brands drop from index", test_lazy_profiles_drop_vanished_entries)
+    cat27_pass = sum(1 for s,_,_ in results[cat27_start:] if s=='PASS')
+    print(f"  {cat27_pass}/{len(results)-cat27_start} passed")
+
+    # ── Category 28: Secondary Indexes ──
+    print("Category 28: Secondary Indexes...")
+    cat28_start = len(results)
+    run_test("Cat 28: Index migration versioned", test_index_migration_versioned)
+    run_test("Cat 28: Hot queries avoid full scans", test_hot_queries_avoid_full_scans)
+    cat28_pass = sum(1 for s,_,_ in results[cat28_start:] if s=='PASS')
+    print(f"  {cat28_pass}/{len(results)-cat28_start} passed")
+
+    # ── Category 29: Usage Counters ──
+    print("Category 29: Usage Counters...")
+    cat29_start = len(results)
+    run_test("Cat 29: Counters match usage_tracking", test_usage_counters_match_tracking)
+    run_test("Cat 29: Rebuild repairs drift", test_usage_counters_rebuild_repairs_drift)
+    run_test("Cat 29: check_usage_limit reads counter", test_check_usage_limit_reads_counter)
+    run_test("Cat 29: Delete user recomputes only affected counters", test_delete_user_recomputes_only_affected_counters)
+    cat29_pass = sum(1 for s,_,_ in results[cat29_start:] if s=='PASS')
+    print(f"  {cat29_pass}/{len(results)-cat29_start} passed")
+
+    # ── Category 30: Request-Scoped User Cache ──
+    print("Category 30: Request-Scoped User Cache...")
+    cat30_start = len(results)
+    run_test("Cat 30: Snapshot reused in scope", test_user_cache_serves_snapshot_in_scope)
+    run_test("Cat 30: Writers invalidate", test_user_cache_invalidated_by_writers)
+    run_test("Cat 30: Isolated per context", test_user_cache_isolated_per_context)
+    cat30_pass = sum(1 for s,_,_ in results[cat30_start:] if s=='PASS')
+    print(f"  {cat30_pass}/{len(results)-cat30_start} passed")
+
+    # ── Category 31: Shared Tier Cache ──
+    print("Category 31: Shared Tier Cache...")
+    cat31_start = len(results)
+    run_test("Cat 31: Shared across sessions", test_tier_cache_shared_across_sessions)
+    run_test("Cat 31: Invalidated by change notices", test_tier_cache_invalidated_by_other_process)
+    run_test("Cat 31: Change poll sees late lower-id commit", test_change_poll_sees_late_lower_id_commit)
+    run_test("Cat 31: LS poll off the render path", test_tier_cache_polls_ls_in_background)
+    run_test("Cat 31: Refresh never caches over a change", test_tier_refresh_never_caches_over_a_change)
+    cat31_pass = sum(1 for s,_,_ in results[cat31_start:] if s=='PASS')
+    print(f"  {cat31_pass}/{len(results)-cat31_start} passed")
+
+    # ── Category 32: Subscription Reconciliation ──
+    print("Category 32: Subscription Reconciliation...")
+    cat32_start = len(results)
+    run_test("Cat 32: Pages stub and applies diff", test_reconcile_pages_and_applies_diff)
+    run_test("Cat 32: Records stats, survives errors", test_reconcile_records_stats_and_survives_errors)
+    run_test("Cat 32: Skips comp/override/trial users", test_plan_changes_skips_resolver_protected_users)
+    run_test("Cat 32: Page cap fails the run", test_reconcile_fails_when_page_cap_hit)
+    cat32_pass = sum(1 for s,_,_ in results[cat32_start:] if s=='PASS')
+    print(f"  {cat32_pass}/{len(results)-cat32_start} passed")
+
+    # ── Category 33: LLM Gateway ──
+    print("Category 33: LLM Gateway...")
+    cat33_start = len(results)
+    run_test("Cat 33: Concurrency cap holds", test_gateway_caps_concurrency)
+    run_test("Cat 33: Request bucket delays", test_gateway_request_bucket_delays)
+    run_test("Cat 33: Retry policy", test_gateway_retry_policy)
+    run_test("Cat 33: Async facade caps concurrency", test_gateway_async_caps_concurrency)
+    run_test("Cat 33: Call sites use gateway", test_call_sites_use_gateway)
+    cat33_pass = sum(1 for s,_,_ in results[cat33_start:] if s=='PASS')
+    print(f"  {cat33_pass}/{len(results)-cat33_start} passed")
+
+    # ── Category 34: Streaming Generation ──
+    print("Category 34: Streaming Generation...")
+    cat34_start = len(results)
+    run_test("Cat 34: Stream yields deltas and usage", test_safe_stream_yields_deltas_and_usage)
+    run_test("Cat 34: Copy editor stream post-parsing", test_stream_copy_editor_supports_post_parsing)
+    run_test("Cat 34: Gateway stream retry policy", test_gateway_stream_retries_only_before_output)
+    cat34_pass = sum(1 for s,_,_ in results[cat34_start:] if s=='PASS')
+    print(f"  {cat34_pass}/{len(results)-cat34_start} passed")
+
+    # ── Category 35: Prompt Caching ──
+    print("Category 35: Prompt Caching...")
+    cat35_start = len(results)
+    run_test("Cat 35: Brand context is cached prefix", test_brand_context_is_cached_prefix)
+    run_test("Cat 35: Cost prices cache tokens", test_estimate_api_cost_prices_cache_tokens)
+    run_test("Cat 35: Visual audit caches and tallies", test_visual_audit_caches_brand_and_tallies_usage)
+    cat35_pass = sum(1 for s,_,_ in results[cat35_start:] if s=='PASS')
+    print(f"  {cat35_pass}/{len(results)-cat35_start} passed")
+
+    # ── Category 36: Analytics Rollups ──
+    print("Category 36: Analytics Rollups...")
+    cat36_start = len(results)
+    run_test("Cat 36: Rollup readers match raw events", test_rollup_readers_match_raw_events)
+    run_test("Cat 36: Rollup refresh is incremental", test_rollup_refresh_is_incremental)
+    run_test("Cat 36: Watermark waits out safety lag", test_rollup_watermark_waits_out_safety_lag)
+    run_test("Cat 36: Initialized by migration and worker", test_rollups_initialized_by_migration_and_worker)
+    cat36_pass = sum(1 for s,_,_ in results[cat36_start:] if s=='PASS')
+    print(f"  {cat36_pass}/{len(results)-cat36_start} passed")
+
+    # ── Category 37: Inactive User Diagnostics ──
+    print("Category 37: Inactive User Diagnostics...")
+    cat37_start = len(results)
+    run_test("Cat 37: Inactive diagnostics fixed query count", test_inactive_diagnostics_fixed_query_count)
+    cat37_pass = sum(1 for s,_,_ in results[cat37_start:] if s=='PASS')
+    print(f"  {cat37_pass}/{len(results)-cat37_start} passed")
+
+    # ── Category 38: Profile Summary Columns ──
+    print("Category 38: Profile Summary Columns...")
+    cat38_start = len(results)
+    run_test("Cat 38: Summary columns maintained", test_profile_summary_columns_maintained)
+    run_test("Cat 38: Analytics aggregate summary columns", test_profile_analytics_aggregate_summary_columns)
+    cat38_pass = sum(1 for s,_,_ in results[cat38_start:] if s=='PASS')
+    print(f"  {cat38_pass}/{len(results)-cat38_start} passed")
+
+    # ── Category 39: Streaming Exports ──
+    print("Category 39: Streaming Exports...")
+    cat39_start = len(results)
+    run_test("Cat 39: Event export streams, filters, gzips", test_event_export_streams_filters_and_gzips)
+    run_test("Cat 39: User export is set-based", test_user_export_is_set_based)
+    run_test("Cat 39: Event export memory ceiling", test_event_export_memory_ceiling)
+    run_test("Cat 39: Export event types cover call sites", test_export_event_types_cover_call_sites)
+    cat39_pass = sum(1 for s,_,_ in results[cat39_start:] if s=='PASS')
+    print(f"  {cat39_pass}/{len(results)-cat39_start} passed")
+
+    # ── Category 40: Typed Event Columns ──
+    print("Category 40: Typed Event Columns...")
+    cat40_start = len(results)
+    run_test("Cat 40: track_event fills typed columns", test_track_event_fills_typed_columns)
+    run_test("Cat 40: Backfill and module index", test_event_columns_backfill_and_index)
+    cat40_pass = sum(1 for s,_,_ in results[cat40_start:] if s=='PASS')
+    print(f"  {cat40_pass}/{len(results)-cat40_start} passed")
+
     # Cleanup
     print("\nCleaning up test database...")
     _teardown_test_db()
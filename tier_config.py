@@ -64,6 +64,17 @@ TIER_CONFIG = {
 # Protected tiers bypass Lemon Squeezy subscription checks entirely
 PROTECTED_TIERS = {"retainer", "super_admin"}
 
+# Lemon Squeezy subscription status → users.subscription_status
+LS_STATUS_MAP = {
+    "active":    "active",
+    "on_trial":  "active",
+    "past_due":  "past_due",
+    "cancelled": "cancelled",
+    "expired":   "cancelled",
+    "unpaid":    "cancelled",
+    "paused":    "inactive",
+}
+
 
 def get_tier_config(tier_key: str) -> dict:
     """Return the tier config dict for a given tier key. Defaults to solo."""
@@ -101,6 +101,13 @@ def _update_user_subscription(username: str, tier_key: str, status: str, sub_id:
     logger.info(f"Webhook: updated {username!r} → tier={tier_key!r}, status={status!r}")
 
 
+@app.middleware("http")
+async def user_request_cache(request: Request, call_next):
+    """Share user snapshots across the lookups made while handling one request."""
+    with db.request_cache():
+        return await call_next(request)
+
+
 @app.post("/webhooks/lemonsqueezy")
 async def handle_ls_webhook(request: Request):
     body = await request.body()
@@ -133,6 +140,8 @@ async def handle_ls_webhook(request: Request):
         logger.warning(f"Webhook: no user found for email={email!r}, event={event!r}")
         return {"status": "ok", "note": "user_not_found"}
 
+    # The db writers below publish "tier" change notices, so every app
+    # process evicts this user's cached tier on its next poll.
     if event == "subscription_created":
         _handle_subscription_active(username, tier_key, sub_id, str(variant_id), attrs)
     elif event == "subscription_updated":